@@ -1,24 +1,47 @@
 import requests
 import json
-from flask import Flask, request, jsonify, send_from_directory, make_response, Response
+from flask import (Flask, request, jsonify, send_from_directory, make_response, Response, stream_with_context,
+                   redirect)
 from flask_cors import CORS
 import os
 import io
 import base64
+import tempfile
+import threading
 from dotenv import load_dotenv
 from openai import OpenAI
 from google.oauth2 import id_token
 from google.auth.transport import requests as grequests
-import PyPDF2
-import pdfplumber
-import fitz  # PyMuPDF for image extraction
 import urllib.parse
 from datetime import datetime, date, time
 import re
 from functools import wraps
 import firebase_admin
 from firebase_admin import credentials, firestore, storage, auth
+from google.cloud.firestore_v1.field_path import FieldPath
 from google.oauth2 import id_token
+from pdf_ingest import ingest_pdf
+from page_images import (EXT_TO_MIME, PAGE_IMAGE_VARIANTS, DEFAULT_SIZE as DEFAULT_IMAGE_SIZE,
+                         resolve_size as resolve_image_size, legacy_page_prefix, page_image_path,
+                         render_dpi, variant_dimensions, load_page_image, cached_image, remember_image,
+                         image_response, delete_page_images)
+from upload_jobs import STAGES as UPLOAD_STAGES, create_job, get_job, run_job, submit_job, resume_pending_jobs
+from content_store import (CONTENT_COLLECTION, hash_file, content_storage_path, page_image_prefix,
+                           content_blob_path, acquire_content, store_content, release_content,
+                           mirrored_pages, record_mirrored_page, ContentBusy)
+from pdf_quality import PROFILE_VERSION as QUALITY_PROFILE_VERSION, stored_quality_verdict
+from chunker import chunk_pages, stored_chunks, leading_text
+import bm25_index
+import vector_index
+import library_index
+import image_upload
+from notes_pipeline import (build_sections, rebuild_sections, note_sections, notes_stale, chunks_fingerprint,
+                            generate_sections, stream_sections)
+import notes_cache
+import pdf_cache
+import text_store
+from note_checkpoints import (new_generation_id, load_generation, retry_decision, start_generation, load_checkpoints,
+                              save_checkpoint, fail_generation, finish_generation, run_generation)
 
 # Load environment variables
 load_dotenv()
@@ -47,8 +70,30 @@ bucket = storage.bucket()
 app = Flask(__name__)
 CORS(app)
 
+# Reject oversized uploads before they are read; uploads are spooled to disk
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 100))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR', tempfile.gettempdir())
+
 # Initialize OpenAI client
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+embedder = vector_index.make_embedder(client)
+# Chat retrieval: bm25 | vector | hybrid
+CHAT_RETRIEVAL = os.environ.get('CHAT_RETRIEVAL', 'hybrid')
+# PDFs per /api/list-pdfs page
+LIST_PDFS_PAGE_SIZE = int(os.environ.get('LIST_PDFS_PAGE_SIZE', 100))
+# 1 = redirect content page images to the CDN (R2_* settings in image_upload.py)
+PAGE_IMAGE_CDN = os.environ.get('PAGE_IMAGE_CDN', '0') == '1'
+# 1 = also copy raw uploaded PDFs to R2 (served from the CDN as pdf_url, deleted with the content)
+R2_OFFLOAD = os.environ.get('R2_OFFLOAD', '0') == '1'
+if PAGE_IMAGE_CDN or R2_OFFLOAD:
+    image_upload.get_client()  # fail at startup if the R2_* settings are missing
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# Redirects to the CDN are temporary (the domain may change) but long-lived
+CDN_REDIRECT_CACHE = "public, max-age=604800"
+CONTENT_HASH_RE = re.compile(r"[0-9a-f]{64}")
+# (content hash, page) known to be on the CDN
+_cdn_mirrored = set()
 
 # ============================================================================
 # SUBSCRIPTION & USAGE TRACKING SYSTEM
@@ -144,13 +189,41 @@ def check_limit(user_id, tier, feature):
     remaining = max(0, limit - usage)
     return allowed, remaining, limit
 
-def require_subscription(feature):
-    """Decorator to check subscription limits before executing endpoint"""
+def generation_retry(mode):
+    """
+    retry_decision for the generation_id in the request body ("new" if none).
+    Only generations of this user for the same pdf_name, level and mode count.
+    """
+    data = request.get_json(silent=True) or {}
+    generation_id = data.get('generation_id')
+    if not generation_id:
+        return "new"
+    generation = load_generation(db, get_current_user_id(), generation_id)
+    return retry_decision(generation, data.get('pdf_name'), data.get('level', 'beginner'), mode)
+
+def require_subscription(feature, resumable=None):
+    """
+    Decorator to check subscription limits before executing endpoint.
+    With resumable set to a note generation mode, retrying a failed or
+    abandoned generation (same generation_id) isn't counted again; unknown
+    or still running generation IDs are rejected.
+    """
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             user_id = get_or_create_user_id()
             tier = get_user_tier_from_request()
+
+            if resumable:
+                retry = generation_retry(resumable)
+                if retry == "unknown":
+                    return jsonify({"error": "Unknown generation_id"}), 400
+                if retry == "running":
+                    return jsonify({"error": "This generation is still running"}), 409
+                if retry == "resume":
+                    request.user_tier = tier
+                    request.user_id = user_id
+                    return f(*args, **kwargs)
             
             allowed, remaining, limit = check_limit(user_id, tier, feature)
             
@@ -251,41 +324,6 @@ if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
 
 
-def check_pdf_quality(text, min_words=30, min_word_ratio=0.4):
-    """
-    Check if extracted PDF text is readable enough to generate content from.
-    Returns (is_ok: bool, reason: str)
-    
-    Checks:
-    1. Minimum word count
-    2. Ratio of real English words (>=2 chars, mostly alpha) vs garbage tokens
-    3. Average word length sanity (garbage OCR produces very short or very long tokens)
-    """
-    if not text or not text.strip():
-        return False, "The PDF appears to be empty or contains no extractable text. It may be a scanned image without OCR."
-    
-    words = text.split()
-    if len(words) < min_words:
-        return False, f"The PDF contains too little readable text ({len(words)} words found). The content may be handwritten, a scanned image, or in a language we can't process."
-    
-    # Count "real" words: at least 2 chars, mostly alphabetic
-    real_words = 0
-    for w in words:
-        cleaned = ''.join(c for c in w if c.isalpha())
-        if len(cleaned) >= 2:
-            real_words += 1
-    
-    ratio = real_words / len(words) if words else 0
-    if ratio < min_word_ratio:
-        return False, "The PDF text quality is too low — most of the content couldn't be read clearly. This may be due to poor handwriting, low scan quality, or image-based content without proper text."
-    
-    # Average word length check (garbage tends to be very short fragments)
-    avg_len = sum(len(w) for w in words) / len(words)
-    if avg_len < 2.0:
-        return False, "The PDF content appears to be fragmented or corrupted. Please try a clearer version of the document."
-    
-    return True, "OK"
-
 def get_current_user_id():
     auth_header = request.headers.get("Authorization")
     if not auth_header:
@@ -308,8 +346,275 @@ def get_current_user_id():
 #=========================================================
 # PDF MANAGEMENT ROUTES
 # ============================================================================
+def spool_path():
+    """Create an empty temp file for a spooled PDF and return its path."""
+    fd, path = tempfile.mkstemp(suffix=".pdf", dir=UPLOAD_SPOOL_DIR)
+    os.close(fd)
+    return path
+
+
+def get_pdf_ref(user_id, pdf_name):
+    return db.collection('users').document(user_id).collection('pdfs').document(pdf_name)
+
+
+# A PDF is stored as:
+#   users/{uid}/pdfs/{name}                 metadata (filename, contentHash, fileUrl, timestamps)
+#   users/{uid}/pdfs/{name}/content/notes   the user's notes for it (NOTE_FIELDS)
+#   pdfContent/{sha256}                     shared extracted content (CONTENT_FIELDS)
+# Older documents keep everything inline in the metadata document.
+CONTENT_FIELDS = ("pdfText", "chunks", "textStore", "images", "pageCount", "qualityProfile", "storagePath",
+                  "pagePrefix")
+NOTE_FIELDS = ("notes", "noteSections", "noteChunksHash", "notes_level", "notesGeneratedAt", "regeneratedAt")
+# What endpoints that work from the document text read (see load_pdf_text_record)
+TEXT_FIELDS = ("chunks", "textStore", "qualityProfile")
+
+
+def get_notes_ref(user_id, pdf_name):
+    return get_pdf_ref(user_id, pdf_name).collection('content').document('notes')
+
+
+def pdf_version(snapshot):
+    """Cache version of a PDF document: its updatedAt, or Firestore's update time for older documents."""
+    stamp = (snapshot.to_dict() or {}).get("updatedAt") or snapshot.update_time
+    return stamp.isoformat() if hasattr(stamp, "isoformat") else str(stamp)
+
+
+def current_version(pdf_ref):
+    """
+    Version of a PDF's metadata document, or None if it doesn't exist. Reads
+    only updatedAt, and at most once per PDF_CACHE_FRESH_SECONDS.
+    """
+    stamp_key = f"{pdf_ref.path}#version"
+    version = pdf_cache.get_fresh(stamp_key)
+    if version is None:
+        stamp = pdf_ref.get(field_paths=["updatedAt"])
+        if not stamp.exists:
+            return None
+        version = pdf_cache.put(stamp_key, pdf_version(stamp), pdf_version(stamp), disk=False)
+    return version
+
+
+def pdf_changed(pdf_ref):
+    """Call after writing a PDF's documents so this process re-reads its version."""
+    pdf_cache.invalidate(f"{pdf_ref.path}#version")
+
+
+def read_fields(ref, fields, version):
+    """Projected read of one document through pdf_cache ({} if it doesn't exist)."""
+    key = f"{ref.path}?{','.join(sorted(fields))}"
+    data = pdf_cache.get(key, version)
+    if data is None:
+        doc = ref.get(field_paths=sorted(fields))
+        if not doc.exists and version is None:
+            return {}  # unversioned entries are kept forever, don't pin a miss
+        data = pdf_cache.put(key, version, doc.to_dict() if doc.exists else {})
+    return data
+
+
+def load_pdf_record(user_id, pdf_name, fields=CONTENT_FIELDS + NOTE_FIELDS):
+    """
+    Fetch the given fields of a user's PDF as one dict, or None if the PDF
+    doesn't exist. Each document is read with a field mask, and only if one
+    of its fields was asked for: metadata always, shared content via
+    contentHash, the notes document for NOTE_FIELDS. contentHash, filename
+    and updatedAt are always included.
+
+    Reads go through pdf_cache. Each user-owned read is cached under the
+    metadata's updatedAt (written with every change). Shared content never
+    changes, so it is cached without a version.
+    """
+    pdf_ref = get_pdf_ref(user_id, pdf_name)
+    version = current_version(pdf_ref)
+    if version is None:
+        return None
+
+    content_fields = [field for field in fields if field in CONTENT_FIELDS]
+    note_fields = [field for field in fields if field in NOTE_FIELDS]
+    own_fields = [field for field in fields if field not in CONTENT_FIELDS]
+    pdf_data = dict(read_fields(pdf_ref, own_fields + ["contentHash", "filename", "updatedAt"], version))
+
+    if content_fields:
+        content_hash = pdf_data.get("contentHash")
+        if content_hash:
+            content = read_fields(db.collection(CONTENT_COLLECTION).document(content_hash), content_fields, None)
+        else:
+            content = read_fields(pdf_ref, content_fields, version)  # older inline document
+        pdf_data = {**content, **pdf_data}
+
+    if note_fields:
+        pdf_data.update(read_fields(get_notes_ref(user_id, pdf_name), note_fields, version))
+    return pdf_data
+
+
+def attach_chunks(pdf_data, max_tokens=None):
+    """
+    Fill in pdf_data["chunks"] from the sharded text store of newer uploads
+    (only the opening chunks within max_tokens, when given).
+    """
+    manifest = pdf_data.get("textStore")
+    if manifest and "chunks" not in pdf_data:
+        pdf_data["chunks"] = text_store.load_chunks(bucket, pdf_data["contentHash"], manifest, max_tokens)
+    return pdf_data
+
+
+def needs_full_text(pdf_data):
+    """True for older documents whose chunks or quality verdict must come from pdfText."""
+    chunks = pdf_data.get("chunks")
+    profile = pdf_data.get("qualityProfile") or {}
+    return not (chunks and isinstance(chunks[0], dict)) or profile.get("version") != QUALITY_PROFILE_VERSION
+
+
+def load_pdf_text_record(user_id, pdf_name, fields=(), max_tokens=None):
+    """
+    load_pdf_record for endpoints that work from the text: structured chunks
+    and the stored quality verdict, plus pdfText only when an older document
+    needs it, so the full text isn't downloaded on every call. Endpoints that
+    only use the opening text pass max_tokens to fetch just those chunks.
+    """
+    pdf_data = load_pdf_record(user_id, pdf_name, TEXT_FIELDS + tuple(fields))
+    if pdf_data is None:
+        return None
+    attach_chunks(pdf_data, max_tokens)
+    if needs_full_text(pdf_data):
+        if pdf_data.get("textStore"):
+            pdf_data["pdfText"] = text_store.read_text(bucket, pdf_data["contentHash"], pdf_data["textStore"])
+        else:
+            pdf_data.update(load_pdf_record(user_id, pdf_name, ("pdfText",)) or {})
+    return pdf_data
+
+
+def save_note_fields(user_id, pdf_name, fields):
+    """
+    Write note fields to the notes document and bump the metadata's
+    updatedAt in one batch. Inline copies of the written fields left by older
+    versions are removed; the notes document wins for any that remain.
+    """
+    pdf_ref = get_pdf_ref(user_id, pdf_name)
+    batch = db.batch()
+    batch.set(get_notes_ref(user_id, pdf_name), fields, merge=True)
+    batch.update(pdf_ref, {
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+        **{field: firestore.DELETE_FIELD for field in fields}
+    })
+    batch.commit()
+    pdf_changed(pdf_ref)
+
+
+def release_pdf_storage(user_id, pdf_name, pdf_data):
+    """Drop whatever a user's PDF document points at (shared content or legacy blobs)."""
+    if pdf_data.get("contentHash"):
+        release_content(db, bucket, pdf_data["contentHash"])
+        return
+
+    # Pre-dedup documents own their blobs directly
+    storage_path = pdf_data.get("storagePath")
+    if storage_path:
+        blob = bucket.blob(storage_path)
+        if blob.exists():
+            blob.delete()
+    delete_page_images(bucket, legacy_page_prefix(user_id, pdf_name))
+
+
+def link_pdf(user_id, pdf_name, filename, content_hash, storage_path):
+    """
+    Point a user's PDF document at shared content. The caller must already
+    hold a reference on content_hash; the document's previous target is released.
+    """
+    pdf_ref = get_pdf_ref(user_id, pdf_name)
+    old_doc = pdf_ref.get(field_paths=["contentHash", "storagePath"])
+
+    # Optional: get public URL
+    file_url = bucket.blob(storage_path).generate_signed_url(expiration=3600*24*7)  # 7-day signed URL
+    pdf_ref.set({
+        "filename": filename,
+        "contentHash": content_hash,
+        "fileUrl": file_url,
+        "uploadedAt": firestore.SERVER_TIMESTAMP,
+        "updatedAt": firestore.SERVER_TIMESTAMP
+    })
+    # Notes were written for the previous upload
+    get_notes_ref(user_id, pdf_name).delete()
+    pdf_changed(pdf_ref)
+
+    if old_doc.exists:
+        release_pdf_storage(user_id, pdf_name, old_doc.to_dict())
+
+
+def run_upload_job(job, progress, pdf_path=None):
+    """
+    Ingest stages for an uploaded PDF whose raw bytes are already in Storage.
+    Runs on the upload job pool (or inline for synchronous uploads, passing
+    the already spooled pdf_path). The PDF is processed from a file on disk,
+    never as one in-memory copy.
+    """
+    user_id = job["userId"]
+    pdf_name = job["pdfName"]
+    content_hash = job["contentHash"]
+    blob = bucket.blob(job["storagePath"])
+
+    progress("extract")
+    owns_spool = pdf_path is None
+    if owns_spool:
+        pdf_path = spool_path()
+        blob.download_to_filename(pdf_path)
+    try:
+        # Single pass: text, skip decisions & stats. Pages are rendered lazily
+        # by /api/pdf-image, so only image metadata is stored here.
+        # Background jobs wait for memory budget; inline uploads fail fast.
+        ingest = ingest_pdf(pdf_path, render=False, budget_timeout=300 if owns_spool else 0,
+                            candidate_dpi=render_dpi())
+    finally:
+        if owns_spool:
+            os.remove(pdf_path)
+    extracted_images = ingest["images"]
+    print(f"📄 Ingested {ingest['stats']['page_count']} pages via {ingest['stats']['engine']}")
+    if ingest["quality"]["droppedPages"]:
+        print(f"🧹 Dropped unreadable pages {ingest['quality']['droppedPages']}")
+
+    progress("chunk")
+    # Structure-aware chunks, reused by notes, chat, tests and flashcards
+    chunks = chunk_pages(ingest["page_blocks"])
+
+    progress("index")
+    # Search indexes for chat retrieval, stored next to the content
+    texts = [chunk["text"] for chunk in chunks]
+    bm25 = bm25_index.build_index(texts)
+    bm25_index.save_index(bucket, content_blob_path(content_hash, bm25_index.INDEX_FILENAME), bm25)
+    vectors = None
+    try:
+        vectors = vector_index.build_index(embedder, texts)
+        vector_index.save_index(bucket, content_blob_path(content_hash, vector_index.INDEX_FILENAME), vectors)
+    except Exception as e:
+        # Not fatal: chat embeds the chunks on first use instead
+        print(f"⚠️ Could not embed chunks ({e})")
+
+    progress("publish")
+    # Chunk text goes to compressed segment blobs; the document only gets the manifest
+    text_manifest = text_store.save_text(bucket, content_hash, chunks)
+    # Shared by every user who uploads the same bytes
+    store_content(db, content_hash, {
+        "textStore": text_manifest,
+        "images": extracted_images,
+        "pageCount": ingest["stats"]["page_count"],
+        "qualityProfile": ingest["quality"],
+        "storagePath": job["storagePath"],
+        "pagePrefix": page_image_prefix(content_hash)
+    })
+
+    progress("save")
+    link_pdf(user_id, pdf_name, job["filename"], content_hash, job["storagePath"])
+    add_to_library(user_id, pdf_name, {"contentHash": content_hash, "chunks": chunks}, bm25, vectors)
+
+    return {"pdf_name": pdf_name, "image_count": len(extracted_images)}
+
+
 @app.route('/api/upload-pdf', methods=['POST'])
 def upload_pdf():
+    """
+    Upload a PDF. The raw file is stored first, then ingested as an upload job.
+    Send form field async=1 to get a job_id back immediately and poll
+    /api/upload-status/<job_id>; otherwise the job runs before responding.
+    """
     user_id = get_current_user_id()
     print("Upload PDF request from user:", user_id)
     if 'pdf' not in request.files:
@@ -317,52 +622,231 @@ def upload_pdf():
     
     file = request.files['pdf']
     pdf_name = request.form.get('pdf_name', file.filename)
+    run_async = request.form.get('async', '').lower() in ('1', 'true', 'yes')
 
     if file.filename == '':
         return jsonify({"error": "No file selected"}), 400
     
+    pdf_path = spool_path()
     try:
-        # Read bytes for processing
-        file_bytes = file.read()
-        file.seek(0)
-
-        # Extract text & images
-        pdf_text = extract_pdf_text(file)
-        extracted_images = extract_pdf_images(file_bytes)
-        chunks = chunk_text(pdf_text)
-
-        # Upload PDF to Firebase Storage
-        blob = bucket.blob(f'users/{user_id}/pdfs/{pdf_name}')
-        blob.upload_from_string(file_bytes, content_type='application/pdf')
-        # Optional: get public URL
-        file_url = blob.generate_signed_url(expiration=3600*24*7)  # 7-day signed URL
-
-        # Save metadata to Firestore
-        pdf_ref = db.collection('users').document(user_id).collection('pdfs').document(pdf_name)
-        pdf_ref.set({
-            "filename": file.filename,
-            "pdfText": pdf_text,
-            "chunks": chunks,
-            "images": extracted_images,
-            "storagePath": f'users/{user_id}/pdfs/{pdf_name}',
-            "fileUrl": file_url,
-            "uploadedAt": firestore.SERVER_TIMESTAMP
-        })
+        # Stream the upload to disk in chunks instead of reading it into memory
+        file.save(pdf_path)
+        content_hash = hash_file(pdf_path)
+
+        # Same bytes already ingested (by anyone) - just reference them
+        content = acquire_content(db, content_hash)
+        if content is not None:
+            pdf_url = finish_pdf_offload(start_pdf_offload(pdf_path, content["storagePath"]))
+            link_pdf(user_id, pdf_name, file.filename, content_hash, content["storagePath"])
+            add_to_library(user_id, pdf_name, {**content, "contentHash": content_hash})
+            print(f"♻️ Reusing stored content {content_hash[:12]} for '{pdf_name}'")
+            return jsonify({
+                "success": True,
+                "pdf_name": pdf_name,
+                "pdf_url": pdf_url,
+                "image_count": len(content.get("images", [])),
+                "deduplicated": True,
+                "message": f"PDF '{pdf_name}' uploaded successfully for user '{user_id}'"
+            }), 200
+
+        # Upload PDF to Firebase Storage - the job resumes from here after a restart.
+        # The R2 copy (R2_OFFLOAD) goes up at the same time.
+        storage_path = content_storage_path(content_hash)
+        offload = start_pdf_offload(pdf_path, storage_path)
+        bucket.blob(storage_path).upload_from_filename(pdf_path, content_type='application/pdf')
+        pdf_url = finish_pdf_offload(offload)
+        # Inline runs hold the job's lease from the start so no other worker resumes it
+        job_id = create_job(db, user_id, pdf_name, file.filename, storage_path, content_hash,
+                            run_here=not run_async)
+
+        if run_async:
+            submit_job(db, job_id, run_upload_job)
+            return jsonify({
+                "success": True,
+                "job_id": job_id,
+                "pdf_name": pdf_name,
+                "pdf_url": pdf_url,
+                "status_url": f"/api/upload-status/{job_id}"
+            }), 202
+
+        job = run_job(db, job_id, lambda job, progress: run_upload_job(job, progress, pdf_path), claimed=True)
+        if job["status"] != "done":
+            status_code = 503 if job.get("retryable") else 500
+            return jsonify({"error": job.get("error") or "Upload processing failed", "job_id": job_id}), status_code
 
         return jsonify({
             "success": True,
+            "job_id": job_id,
             "pdf_name": pdf_name,
-            "image_count": len(extracted_images),
+            "pdf_url": pdf_url,
+            "image_count": job["result"]["image_count"],
             "message": f"PDF '{pdf_name}' uploaded successfully for user '{user_id}'"
         }), 200
 
+    except ContentBusy as e:
+        # The same file was just deleted and its stored copy is still being purged
+        return jsonify({"error": f"{e}, please try again shortly", "retryable": True}), 503
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
+    finally:
+        os.remove(pdf_path)
+
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({"error": f"File too large. Maximum upload size is {MAX_UPLOAD_MB} MB."}), 413
+
+
+@app.route('/api/upload-status/<job_id>', methods=['GET'])
+def upload_status(job_id):
+    """Report per-stage progress of an upload job"""
+    try:
+        user_id = get_current_user_id()
+        job = get_job(db, job_id)
+
+        if not job or job.get("userId") != user_id:
+            return jsonify({"error": "Upload job not found"}), 404
+
+        return jsonify({
+            "job_id": job_id,
+            "pdf_name": job.get("pdfName"),
+            "status": job.get("status"),
+            "stages": [{"name": stage, "status": job.get("stages", {}).get(stage, "pending")} for stage in UPLOAD_STAGES],
+            "progress": job.get("progress"),
+            "result": job.get("result"),
+            "error": job.get("error")
+        }), 200
+
+    except Exception as e:
+        print(f"Upload status error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+def sse_event(event, payload):
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def save_notes(user_id, pdf_name, sections, texts, level, timestamp_field, chunks_hash):
+    """Store notes as addressable sections plus the joined text; returns the joined notes."""
+    notes = "\n\n".join(texts)
+    save_note_fields(user_id, pdf_name, {
+        "notes": notes,
+        "noteSections": note_sections(sections, texts),
+        "noteChunksHash": chunks_hash,
+        "notes_level": level,
+        timestamp_field: firestore.SERVER_TIMESTAMP
+    })
+    return notes
+
+
+def run_notes_generation(user_id, pdf_name, chunks, build, level, mode, timestamp_field, data):
+    """
+    Generate notes for a PDF's chunks under a generation ID, checkpointing
+    every finished section. build() returns the sections (build_sections);
+    streamed requests call it after the start event, as the map stage of a
+    long document can take a while. A request carrying the generation_id of
+    a failed or abandoned attempt (checked by require_subscription) only
+    generates the sections that are still missing.
+    """
+    generation_id = data.get('generation_id') or new_generation_id()
+    done = load_checkpoints(db, user_id, generation_id, pdf_name, level, mode)
+    if done:
+        print(f"🔁 Resuming generation {generation_id}: {len(done)} sections checkpointed")
+    start_generation(db, user_id, generation_id, pdf_name, level, mode)
+    chunks_hash = chunks_fingerprint(chunks)
+
+    def checkpoint(section, text):
+        save_checkpoint(db, user_id, generation_id, section["index"], section["key"], text)
+
+    if data.get('stream'):
+        return stream_notes_response(user_id, pdf_name, build, level, timestamp_field, chunks_hash,
+                                     generation_id, done, checkpoint)
+
+    try:
+        sections = build()
+        texts = generate_sections(client, sections, done, checkpoint)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        fail_generation(db, user_id, generation_id, e)
+        # Finished sections are checkpointed; retry with this generation_id
+        return jsonify({
+            "error": f"Server error: {str(e)}",
+            "generation_id": generation_id,
+            "resumable": True
+        }), 500
+
+    notes = save_notes(user_id, pdf_name, sections, texts, level, timestamp_field, chunks_hash)
+    finish_generation(db, user_id, generation_id)
+
+    return jsonify({
+        "success": True,
+        "notes": notes,
+        "section_ids": [section["id"] for section in sections],
+        "pdf_name": pdf_name,
+        "level": level,
+        "generation_id": generation_id
+    }), 200
+
+
+def stream_notes_response(user_id, pdf_name, build, level, timestamp_field, chunks_hash,
+                          generation_id, done, checkpoint):
+    """
+    Stream note sections over SSE as they are generated (token deltas, then
+    each finished section). The start event goes out before the sections are
+    built, so clients hear back before any map stage runs. Sections are
+    checkpointed as they finish; the joined notes are written to Firestore
+    once, after the last section. If the client disconnects, generation stops
+    and is marked failed, so it can be resumed with its generation_id at once.
+
+    Events: start {generation_id, ...}, plan {sections, section_ids},
+            delta {section, text}, retry {section}, section {section, content},
+            done {notes, ...}, error {error, generation_id}
+    """
+    def steps():
+        events = None
+        try:
+            yield "start", {"pdf_name": pdf_name, "level": level, "generation_id": generation_id}
+            sections = build()
+            yield "plan", {"sections": len(sections), "section_ids": [section["id"] for section in sections]}
+
+            texts = [None] * len(sections)
+            events = stream_sections(client, sections, done, checkpoint)
+            for kind, index, value in events:
+                if kind == "delta":
+                    yield "delta", {"section": index, "text": value}
+                elif kind == "retry":
+                    yield "retry", {"section": index}
+                else:
+                    texts[index] = value
+                    yield "section", {"section": index, "content": value}
+
+            notes = save_notes(user_id, pdf_name, sections, texts, level, timestamp_field, chunks_hash)
+            yield "done", {"success": True, "notes": notes, "pdf_name": pdf_name, "level": level,
+                           "section_ids": [section["id"] for section in sections],
+                           "generation_id": generation_id}
+        finally:
+            if events is not None:
+                events.close()
+
+    def generate():
+        run = run_generation(db, user_id, generation_id, steps())
+        try:
+            for event, payload in run:
+                yield sse_event(event, payload)
+        finally:
+            run.close()  # on client disconnect: stop the sections, mark the generation failed
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 
 @app.route('/api/generate-notes', methods=['POST'])
-@require_subscription('note_generations')
+@require_subscription('note_generations', resumable="generate")
 def generate_notes():
     data = request.json
     pdf_name = data.get('pdf_name')
@@ -375,98 +859,28 @@ def generate_notes():
     print("PDF:", pdf_name)
     try:
         # 🔥 Fetch from Firestore
-        pdf_ref = db.collection('users').document(user_id).collection('pdfs').document(pdf_name)
-        pdf_doc = pdf_ref.get()
+        pdf_data = load_pdf_text_record(user_id, pdf_name, ["images"])
 
-        if not pdf_doc.exists:
+        if pdf_data is None:
             return jsonify({"error": f"PDF '{pdf_name}' not found"}), 404
 
-        pdf_data = pdf_doc.to_dict()
         pdf_content = pdf_data.get("pdfText", "")
         images = pdf_data.get("images", [])
 
         # ── Quality check ──
-        is_ok, reason = check_pdf_quality(pdf_content)
+        is_ok, reason = stored_quality_verdict(pdf_data, pdf_content)
         if not is_ok:
             return jsonify({"error": reason}), 400
 
-        num_images = len(images)
-        content_length = len(pdf_content)
-
-        # Split content into chunks
-        CHUNK_SIZE = 4000
-        chunks = [pdf_content[i:i + CHUNK_SIZE] for i in range(0, content_length, CHUNK_SIZE)]
-
-        if len(chunks) > 15:
-            step = len(chunks) / 15
-            chunks = [chunks[int(i * step)] for i in range(15)]
-
-        num_chunks = len(chunks)
-        print(f"📄 PDF has {content_length} chars, split into {num_chunks} chunks")
-
-        def get_images_for_chunk(chunk_idx, total_chunks, total_images):
-            if total_images == 0:
-                return []
-            images_per_chunk = total_images / total_chunks
-            start_img = int(chunk_idx * images_per_chunk)
-            end_img = int((chunk_idx + 1) * images_per_chunk)
-            return list(range(start_img, min(end_img, total_images)))
-
-        # -------- PROMPTS (unchanged) ----------
-        level_instructions = {
-            "beginner": "Create SIMPLE and EASY-TO-UNDERSTAND notes.",
-            "intermediate": "Create DETAILED and COMPREHENSIVE notes.",
-            "advanced": "Create DEEP and ANALYTICAL notes."
-        }
-
-        system_prompt = f"You are an expert educational note-taking assistant.\n{level_instructions.get(level)}"
-
-        # Generate notes
-        all_notes = []
-        for chunk_idx, chunk_text in enumerate(chunks):
-            chunk_images = get_images_for_chunk(chunk_idx, num_chunks, num_images)
-
-            img_instruction = ""
-            if chunk_images:
-                img_refs = ", ".join([f"[PDF_IMG:{i}]" for i in chunk_images])
-                img_instruction = f"\nUse images: {img_refs}"
-
-            chunk_message = f"""
-Write detailed study notes ({level} level).
-Section {chunk_idx+1}/{num_chunks}.
-{img_instruction}
-
-CONTENT:
-{chunk_text}
-"""
-
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": chunk_message}
-                ],
-                temperature=0.7,
-                max_tokens=4096
-            )
+        chunks = stored_chunks(pdf_data)
 
-            all_notes.append(response.choices[0].message.content)
+        def build():
+            sections = build_sections(client, chunks, images, level, "generate", quick=bool(data.get("quick")))
+            print(f"📄 PDF has {len(chunks)} chunks, generating {len(sections)} sections")
+            return sections
 
-        notes = "\n\n".join(all_notes)
-
-        # 🔥 Save notes back to Firestore
-        pdf_ref.update({
-            "notes": notes,
-            "notes_level": level,
-            "notesGeneratedAt": firestore.SERVER_TIMESTAMP
-        })
-
-        return jsonify({
-            "success": True,
-            "notes": notes,
-            "pdf_name": pdf_name,
-            "level": level
-        }), 200
+        return run_notes_generation(user_id, pdf_name, chunks, build, level, "generate", "notesGeneratedAt",
+                                    data)
 
     except Exception as e:
         import traceback
@@ -475,16 +889,30 @@ CONTENT:
     
 @app.route('/api/list-pdfs', methods=['GET'])
 def list_pdfs():
-    """List all uploaded PDFs for the current user"""
+    """
+    List the current user's uploaded PDFs, one page at a time, in name order.
+    Query: limit (default 100, max 500), cursor (next_cursor of the previous
+    page). Only document names are read.
+    """
     try:
         user_id = get_current_user_id()
+        try:
+            limit = max(1, min(int(request.args.get('limit', LIST_PDFS_PAGE_SIZE)), 500))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        cursor = request.args.get('cursor')
 
         pdfs_ref = db.collection('users').document(user_id).collection('pdfs')
-        docs = pdfs_ref.stream()
+        query = pdfs_ref.select([FieldPath.document_id()]).order_by(FieldPath.document_id())
+        if cursor:
+            query = query.start_after({FieldPath.document_id(): cursor})
+        # One extra to know whether another page follows
+        docs = list(query.limit(limit + 1).stream())
 
-        pdf_names = [doc.id for doc in docs]
+        pdf_names = [doc.id for doc in docs[:limit]]
+        next_cursor = pdf_names[-1] if len(docs) > limit else None
 
-        return jsonify({"pdfs": pdf_names}), 200
+        return jsonify({"pdfs": pdf_names, "next_cursor": next_cursor}), 200
 
     except Exception as e:
         print(f"List PDFs error: {str(e)}")
@@ -493,90 +921,173 @@ def list_pdfs():
         return jsonify({"error": str(e)}), 500
 
 
-def extract_pdf_images(file_bytes):
-    """Render each PDF page as a high-quality image using PyMuPDF.
-    Skips pages that only contain URLs/links or very little meaningful text."""
-    images = []
+@app.route('/api/delete-pdf/<pdf_name>', methods=['DELETE'])
+def delete_pdf(pdf_name):
+    """Delete a PDF for the current user, releasing its shared content"""
     try:
-        import re
-        doc = fitz.open(stream=file_bytes, filetype="pdf")
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            
-            # Check page text - skip pages that are mostly just URLs or near-empty
-            page_text = page.get_text().strip()
-            # Remove common watermarks/headers
-            clean_text = re.sub(r'(oalevelnotes\.com|dalevelnotes\.com|made with gamma)', '', page_text, flags=re.IGNORECASE).strip()
-            # Check if remaining text is mostly URLs
-            non_url_text = re.sub(r'https?://\S+|www\.\S+', '', clean_text).strip()
-            
-            if len(non_url_text) < 20:
-                print(f"  Skipping page {page_num+1} (only URLs or near-empty)")
-                continue
-            
-            # Render page at 2x zoom for good quality (default is 72 DPI, 2x = 144 DPI)
-            mat = fitz.Matrix(2, 2)
-            pix = page.get_pixmap(matrix=mat)
-            
-            # Convert to PNG bytes
-            image_data = pix.tobytes("png")
-            image_b64 = base64.b64encode(image_data).decode('utf-8')
-            
-            images.append({
-                "data": image_b64,
-                "ext": "png",
-                "width": pix.width,
-                "height": pix.height,
-                "page": page_num + 1
-            })
-            print(f"  Rendered page {page_num+1} as image: {pix.width}x{pix.height}")
-        
-        doc.close()
+        user_id = get_current_user_id()
+        pdf_ref = get_pdf_ref(user_id, pdf_name)
+        pdf_doc = pdf_ref.get(field_paths=["contentHash", "storagePath"])
+
+        if not pdf_doc.exists:
+            return jsonify({"error": "PDF not found"}), 404
+
+        get_notes_ref(user_id, pdf_name).delete()
+        pdf_ref.delete()
+        pdf_changed(pdf_ref)
+        release_pdf_storage(user_id, pdf_name, pdf_doc.to_dict())
+        remove_from_library(user_id, pdf_name)
+
+        return jsonify({"success": True, "pdf_name": pdf_name}), 200
+
     except Exception as e:
-        print(f"Error rendering PDF pages: {str(e)}")
+        print(f"Delete PDF error: {str(e)}")
         import traceback
         traceback.print_exc()
-    
-    return images
+        return jsonify({"error": str(e)}), 500
+
+
+def content_image_url(content_hash, images, image_index, size=DEFAULT_IMAGE_SIZE):
+    """Immutable URL of a shared-content page image (aliases resolve to their canonical image)."""
+    canonical = images[image_index].get("alias_of", image_index) if image_index < len(images) else image_index
+    return f"/api/content-image/{content_hash}/{canonical}/{resolve_image_size(size)}"
+
+
+def cdn_image_url(content_hash, page, size, load):
+    """
+    CDN URL of a content page image variant. The first time a page is asked
+    for, every variant of it is copied to R2 in one parallel batch and the
+    page is recorded, so /api/pdf-image-count links the CDN directly after.
+    """
+    prefix = page_image_prefix(content_hash)
+    path = page_image_path(prefix, page, size)
+    if (content_hash, page) not in _cdn_mirrored:
+        if not image_upload.r2_object_exists(path):
+            uploads = []
+            for variant in PAGE_IMAGE_VARIANTS:
+                data, mime, _ = load(variant)  # the first load renders every variant
+                uploads.append((data, page_image_path(prefix, page, variant), mime))
+            image_upload.upload_many_to_r2(uploads)
+        record_mirrored_page(db, content_hash, page)
+        _cdn_mirrored.add((content_hash, page))
+    return image_upload.cdn_url(path)
+
+
+def start_pdf_offload(pdf_path, storage_path):
+    """With R2_OFFLOAD, start copying a raw PDF to R2; returns a Future or None."""
+    if not R2_OFFLOAD:
+        return None
+    # Keys are content-addressed: a copy already there has the same bytes
+    return image_upload.submit_to_r2(pdf_path, storage_path, 'application/pdf', if_missing=True)
+
+
+def finish_pdf_offload(future):
+    """CDN URL of an offloaded PDF, or None (offload is best effort)."""
+    if future is None:
+        return None
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"⚠️ Could not copy PDF to R2 ({e})")
+        return None
 
 
+@app.route('/api/content-image/<content_hash>/<int:image_index>/<size>')
+def serve_content_image(content_hash, image_index, size):
+    """
+    Serve a page image of shared content by content hash. The URL never
+    changes meaning, so it is cached as immutable by browsers and CDNs; the
+    hash is the capability, no auth header needed (works in <img> tags).
+    With PAGE_IMAGE_CDN=1 the client is redirected (302) to the CDN copy
+    instead; /api/pdf-image-count links mirrored pages there directly.
+    """
+    if not CONTENT_HASH_RE.fullmatch(content_hash) or size not in PAGE_IMAGE_VARIANTS:
+        return jsonify({"error": "Image not found"}), 404
+
+    try:
+        content = read_fields(db.collection(CONTENT_COLLECTION).document(content_hash),
+                              ["images", "pagePrefix", "storagePath"], None)
+        images = content.get("images", [])
+        if image_index < 0 or image_index >= len(images):
+            return jsonify({"error": "Image not found"}), 404
+
+        img = images[image_index]
+        if "alias_of" in img:
+            img = images[img["alias_of"]]
+
+        def load(variant):
+            return load_page_image(bucket, content["storagePath"], content["pagePrefix"],
+                                   img["page"], variant, img.get("clip"))
+
+        if PAGE_IMAGE_CDN:
+            response = redirect(cdn_image_url(content_hash, img["page"], size, load), 302)
+            response.headers["Cache-Control"] = CDN_REDIRECT_CACHE
+            return response
+
+        image_data, mime_type, etag = load(size)
+        return image_response(image_data, mime_type, etag, IMMUTABLE_CACHE)
+
+    except Exception as e:
+        print(f"Serve content image error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
 
 @app.route('/api/pdf-image/<pdf_name>/<int:image_index>')
 def serve_pdf_image(pdf_name, image_index):
-    """Serve an extracted image from a PDF (Firestore version)"""
+    """
+    Serve a PDF page image, rendering it into Storage on first request.
+    Optional ?size=thumb|display|full (default display).
+
+    PDFs backed by shared content are redirected to their immutable
+    /api/content-image URL. Older PDFs are served here with an ETag, so
+    browsers revalidate instead of downloading again.
+    """
     try:
         user_id = get_current_user_id()
+        size = request.args.get('size', DEFAULT_IMAGE_SIZE)
 
         # Fetch PDF doc
-        pdf_ref = db.collection('users').document(user_id).collection('pdfs').document(pdf_name)
-        pdf_doc = pdf_ref.get()
+        pdf_data = load_pdf_record(user_id, pdf_name, ["images", "pagePrefix", "storagePath"])
 
-        if not pdf_doc.exists:
+        if pdf_data is None:
             return jsonify({"error": "PDF not found"}), 404
 
-        pdf_data = pdf_doc.to_dict()
         images = pdf_data.get("images", [])
 
         # Bounds check
         if image_index < 0 or image_index >= len(images):
             return jsonify({"error": "Image index out of range"}), 404
 
+        if pdf_data.get("contentHash"):
+            response = redirect(content_image_url(pdf_data["contentHash"], images, image_index, size), 302)
+            # The name may later point at another upload, so only briefly
+            response.headers["Cache-Control"] = "private, max-age=300"
+            return response
+
+        # Near-duplicate of an earlier page - serve the canonical copy
+        image_index = images[image_index].get("alias_of", image_index)
         img = images[image_index]
-        image_data = base64.b64decode(img["data"])
-
-        # MIME detection
-        ext_to_mime = {
-            "png": "image/png",
-            "jpg": "image/jpeg",
-            "jpeg": "image/jpeg",
-            "gif": "image/gif",
-            "bmp": "image/bmp",
-            "tiff": "image/tiff",
-            "webp": "image/webp"
-        }
-        mime_type = ext_to_mime.get(img.get("ext", "png").lower(), "image/png")
 
-        return Response(image_data, mimetype=mime_type)
+        if "data" in img:
+            # Legacy documents stored the rendered page inline as base64
+            key = f"{get_pdf_ref(user_id, pdf_name).path}@{pdf_data.get('updatedAt')}/{image_index}"
+            entry = cached_image(key) or remember_image(
+                key, base64.b64decode(img["data"]), EXT_TO_MIME.get(img.get("ext", "png").lower(), "image/png"))
+        else:
+            prefix = pdf_data.get("pagePrefix") or legacy_page_prefix(user_id, pdf_name)
+            entry = load_page_image(
+                bucket,
+                pdf_data.get("storagePath", f'users/{user_id}/pdfs/{pdf_name}'),
+                prefix,
+                img["page"],
+                size,
+                img.get("clip")
+            )
+
+        image_data, mime_type, etag = entry
+        return image_response(image_data, mime_type, etag, "private, no-cache")
 
     except Exception as e:
         print(f"Serve PDF image error: {str(e)}")
@@ -592,23 +1103,46 @@ def get_pdf_image_count(pdf_name):
         user_id = get_current_user_id()
 
         # Fetch PDF document
-        pdf_ref = db.collection('users').document(user_id).collection('pdfs').document(pdf_name)
-        pdf_doc = pdf_ref.get()
+        pdf_data = load_pdf_record(user_id, pdf_name, ["imageMeta"])
 
-        if not pdf_doc.exists:
+        if pdf_data is None:
             return jsonify({"error": "PDF not found"}), 404
 
-        pdf_data = pdf_doc.to_dict()
-        images = pdf_data.get("images", [])
+        images = pdf_data.get("imageMeta")
+        if images is None:
+            # Shared content only stores metadata. Older documents not yet
+            # given an imageMeta copy (migrate_image_meta.py) have the base64
+            # pages inline; the read is cached, only the metadata is returned
+            images = (load_pdf_record(user_id, pdf_name, ["images"]) or {}).get("images", [])
+            images = [{k: v for k, v in img.items() if k != "data"} for img in images]
+
+        content_hash = pdf_data.get("contentHash")
+        # Pages already copied to R2 are linked on the CDN, skipping this server entirely
+        on_cdn = mirrored_pages(db, content_hash) if content_hash and PAGE_IMAGE_CDN else set()
+
+        def image_url(i, size):
+            page = images[images[i].get("alias_of", i)].get("page")
+            if page in on_cdn:
+                return image_upload.cdn_url(page_image_path(page_image_prefix(content_hash), page,
+                                                            resolve_image_size(size)))
+            if content_hash:
+                return content_image_url(content_hash, images, i, size)
+            return f"/api/pdf-image/{pdf_name}/{i}" + ("" if size == DEFAULT_IMAGE_SIZE else f"?size={size}")
 
         image_info = []
         for i, img in enumerate(images):
+            width, height = img.get("width"), img.get("height")
+            if "dpi" in img:
+                # Candidates record their render size; report the served variant's
+                width, height = variant_dimensions(width, height, img["dpi"], DEFAULT_IMAGE_SIZE)
             image_info.append({
                 "index": i,
-                "width": img.get("width"),
-                "height": img.get("height"),
+                "width": width,
+                "height": height,
                 "page": img.get("page"),
-                "url": f"/api/pdf-image/{pdf_name}/{i}"
+                "duplicate_of": img.get("alias_of"),
+                "url": image_url(i, DEFAULT_IMAGE_SIZE),
+                "thumbnail_url": image_url(i, "thumb")
             })
 
         return jsonify({
@@ -627,7 +1161,7 @@ def get_pdf_image_count(pdf_name):
 # ============================================================================
 
 @app.route('/api/regenerate-notes', methods=['POST'])
-@require_subscription('note_regenerations')
+@require_subscription('note_regenerations', resumable="regenerate")
 def regenerate_notes():
     data = request.json
     pdf_name = data.get('pdf_name')
@@ -638,106 +1172,97 @@ def regenerate_notes():
         return jsonify({"error": "Missing pdf_name"}), 400
 
     user_id = get_current_user_id()
-    pdf_ref = db.collection('users').document(user_id).collection('pdfs').document(pdf_name)
-    pdf_doc = pdf_ref.get()
+    pdf_data = load_pdf_text_record(user_id, pdf_name, ["images"])
 
-    if not pdf_doc.exists:
+    if pdf_data is None:
         return jsonify({"error": f"PDF '{pdf_name}' not found"}), 404
 
     try:
-        pdf_data = pdf_doc.to_dict()
 
         # ✅ FIX 1 — correct field name
         pdf_content = pdf_data.get("pdfText", "")
         images = pdf_data.get("images", [])
 
         # ── Quality check ──
-        is_ok, reason = check_pdf_quality(pdf_content)
+        is_ok, reason = stored_quality_verdict(pdf_data, pdf_content)
         if not is_ok:
             return jsonify({"error": reason}), 400
 
-        num_images = len(images)
-        content_length = len(pdf_content)
-
-        # Split content into chunks
-        CHUNK_SIZE = 4000
-        chunks = [pdf_content[i:i + CHUNK_SIZE] for i in range(0, content_length, CHUNK_SIZE)]
-
-        if len(chunks) > 15:
-            step = len(chunks) / 15
-            chunks = [chunks[int(i * step)] for i in range(15)]
-
-        num_chunks = len(chunks)
-
-        def get_images_for_chunk(chunk_idx, total_chunks, total_images):
-            if total_images == 0:
-                return []
-            images_per_chunk = total_images / total_chunks
-            start_img = int(chunk_idx * images_per_chunk)
-            end_img = int((chunk_idx + 1) * images_per_chunk)
-            return list(range(start_img, min(end_img, total_images)))
-
-        level_instructions = {
-            "beginner": "Create SIMPLE notes with a DIFFERENT approach than before.",
-            "intermediate": "Create DETAILED notes using a DIFFERENT structure.",
-            "advanced": "Create DIFFERENT DEEP and ANALYTICAL notes."
-        }
+        chunks = stored_chunks(pdf_data)
 
-        system_prompt = f"""You are an expert educational note-taking assistant.
-Write COMPLETELY DIFFERENT, ALTERNATIVE study notes.
+        def build():
+            return build_sections(client, chunks, images, level, "regenerate", quick=bool(data.get("quick")))
 
-{level_instructions.get(level, level_instructions['beginner'])}
+        return run_notes_generation(user_id, pdf_name, chunks, build, level, "regenerate", "regeneratedAt",
+                                    data)
 
-Write in NATURAL FLOWING PARAGRAPHS.
-Use headings (##, ###). No glossary format."""
+    except Exception as e:
+        print(f"Notes Regeneration Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
 
-        all_notes = []
-        for chunk_idx, chunk_text in enumerate(chunks):
-            chunk_images = get_images_for_chunk(chunk_idx, num_chunks, num_images)
+@app.route('/api/regenerate-sections', methods=['POST'])
+@require_subscription('note_regenerations')
+def regenerate_sections():
+    """
+    Regenerate only the chosen note sections and splice them back into the
+    stored notes. Body: pdf_name, section_ids (IDs from generate/regenerate
+    notes), optional level (must be the notes' level; regenerate the full
+    notes to change it).
+    """
+    data = request.json or {}
+    pdf_name = data.get('pdf_name')
+    section_ids = data.get('section_ids') or data.get('section_id')
+    if isinstance(section_ids, str):
+        section_ids = [section_ids]
 
-            if chunk_images:
-                img_refs = ", ".join([f"[PDF_IMG:{i}]" for i in chunk_images])
-                img_instruction = f"\nIMAGES: {img_refs}"
-            else:
-                img_instruction = ""
+    if not pdf_name or not section_ids:
+        return jsonify({"error": "Missing pdf_name or section_ids"}), 400
 
-            chunk_message = f"""Write COMPLETELY DIFFERENT study notes.
-Section {chunk_idx + 1} of {num_chunks}.
-{img_instruction}
+    try:
+        user_id = get_current_user_id()
+        pdf_data = load_pdf_text_record(user_id, pdf_name, NOTE_FIELDS)
 
-CONTENT:
-{chunk_text}"""
-
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": chunk_message}
-                ],
-                temperature=0.8,
-                max_tokens=4096
-            )
+        if pdf_data is None:
+            return jsonify({"error": f"PDF '{pdf_name}' not found"}), 404
 
-            all_notes.append(response.choices[0].message.content)
+        stored = pdf_data.get("noteSections")
+        chunks = stored_chunks(pdf_data)
+        if not stored or notes_stale(stored, chunks, pdf_data.get("noteChunksHash")):
+            return jsonify({"error": "These notes have no stored sections, regenerate the full notes first"}), 409
 
-        notes = "\n\n".join(all_notes)
+        unknown = set(section_ids) - {section["id"] for section in stored}
+        if unknown:
+            return jsonify({"error": f"Unknown section_ids: {', '.join(sorted(unknown))}"}), 400
 
-        # ✅ FIX 3 — store back to Firestore
-        pdf_ref.update({
+        level = pdf_data.get('notes_level', 'beginner')
+        if data.get('level', level) != level:
+            return jsonify({
+                "error": f"These notes are at the {level} level, regenerate the full notes to change it"
+            }), 400
+        sections = rebuild_sections(client, chunks, stored, set(section_ids), level)
+        print(f"📝 Regenerating {len(sections)}/{len(stored)} sections of {pdf_name}")
+        regenerated = dict(zip((section["id"] for section in sections), generate_sections(client, sections)))
+
+        merged = [{**section, "content": regenerated.get(section["id"], section["content"])} for section in stored]
+        notes = "\n\n".join(section["content"] for section in merged)
+        save_note_fields(user_id, pdf_name, {
             "notes": notes,
-            "notes_level": level,
+            "noteSections": merged,
             "regeneratedAt": firestore.SERVER_TIMESTAMP
         })
 
         return jsonify({
             "success": True,
             "notes": notes,
+            "sections": [{"id": section_id, "content": text} for section_id, text in regenerated.items()],
             "pdf_name": pdf_name,
             "level": level
         }), 200
 
     except Exception as e:
-        print(f"Notes Regeneration Error: {str(e)}")
+        print(f"Section Regeneration Error: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": f"Server error: {str(e)}"}), 500
@@ -764,24 +1289,19 @@ def chat_with_pdf():
         user_id = get_current_user_id()
 
         # 🔥 Fetch PDF from Firestore
-        pdf_ref = db.collection('users') \
-                    .document(user_id) \
-                    .collection('pdfs') \
-                    .document(pdf_name)
+        pdf_data = load_pdf_text_record(user_id, pdf_name)
 
-        pdf_doc = pdf_ref.get()
-
-        if not pdf_doc.exists:
+        if pdf_data is None:
             return jsonify({"error": f"PDF '{pdf_name}' not found"}), 404
 
-        pdf_data = pdf_doc.to_dict()
-        pdf_content = pdf_data.get("content", "")
+        chunks = stored_chunks(pdf_data)
 
-        if not pdf_content:
+        if not chunks:
             return jsonify({"error": "PDF content is empty"}), 400
 
         # 🔥 Find relevant chunks
-        relevant_chunks = find_relevant_chunks(pdf_content, question, top_k=3)
+        relevant_chunks = find_relevant_chunks(user_id, pdf_name, pdf_data, chunks, question,
+                                               top_k=3, mode=data.get('retrieval', CHAT_RETRIEVAL))
 
         system_prompt = (
             "You are a helpful AI assistant that answers questions based on provided PDF content. "
@@ -824,54 +1344,141 @@ def chat_with_pdf():
 # HELPER FUNCTIONS
 # ============================================================================
 
-def extract_pdf_text(file):
-    """Extract text from PDF file"""
-    text = ""
+def index_location(user_id, pdf_name, pdf_data, filename):
+    """
+    (cache key, storage path) of a PDF's search index. Indexes of pre-dedup
+    uploads are built on first use and kept in process memory only.
+    """
+    content_hash = pdf_data.get("contentHash")
+    if content_hash:
+        return content_hash, content_blob_path(content_hash, filename)
+    return f"{user_id}/{pdf_name}", None
+
+
+def find_relevant_chunks(user_id, pdf_name, pdf_data, chunks, query, top_k=3, mode=CHAT_RETRIEVAL):
+    """
+    Rank the PDF's stored chunks for a question.
+      bm25   - BM25 over the inverted index (only the query terms' postings)
+      vector - cosine similarity of chunk embeddings
+      hybrid - cosine blended with BM25 (default)
+    Falls back to BM25 when embeddings are unavailable.
+    """
+    texts = [chunk["text"] for chunk in chunks]
+    key, path = index_location(user_id, pdf_name, pdf_data, bm25_index.INDEX_FILENAME)
+    scores = bm25_index.load_index(bucket, key, path, texts).scores(query)
+
+    if mode in ("vector", "hybrid"):
+        try:
+            key, path = index_location(user_id, pdf_name, pdf_data, vector_index.INDEX_FILENAME)
+            vectors = vector_index.load_index(bucket, key, path, texts, embedder)
+            cosine = vectors.scores(embedder.embed([query])[0])
+            scores = cosine if mode == "vector" else vector_index.hybrid_scores(cosine, scores)
+        except Exception as e:
+            print(f"⚠️ Vector search unavailable ({e}), using BM25 only")
+
+    relevant = [chunks[i]["text"] for i, score in vector_index.top_hits(scores, top_k) if score > 0]
+    return "\n---\n".join(relevant) if relevant else leading_text(chunks, 500)
+
+
+def document_indexes(user_id, pdf_name, pdf_data, chunks):
+    """(BM25 index, vector index or None) of one PDF, loaded or built as chat does."""
+    texts = [chunk["text"] for chunk in chunks]
+    key, path = index_location(user_id, pdf_name, pdf_data, bm25_index.INDEX_FILENAME)
+    bm25 = bm25_index.load_index(bucket, key, path, texts)
     try:
-        pdf_reader = PyPDF2.PdfReader(file)
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-    except:
-        # Fallback to pdfplumber if PyPDF2 fails
-        file.seek(0)
-        with pdfplumber.open(file) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() + "\n"
-    
-    return text
+        key, path = index_location(user_id, pdf_name, pdf_data, vector_index.INDEX_FILENAME)
+        return bm25, vector_index.load_index(bucket, key, path, texts, embedder)
+    except Exception as e:
+        print(f"⚠️ No embeddings for '{pdf_name}' ({e}), library search will use BM25 only")
+        return bm25, None
 
-def chunk_text(text, chunk_size=500, overlap=50):
-    """Split text into chunks with overlap"""
-    chunks = []
-    words = text.split()
-    
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = " ".join(words[i:i + chunk_size])
-        chunks.append(chunk)
-    
-    return chunks
 
-def find_relevant_chunks(text, query, top_k=3):
+def add_to_library(user_id, pdf_name, pdf_data, bm25=None, vectors=None):
+    """Merge a PDF's indexes into the user's library index. Failures are logged, not raised."""
+    try:
+        if library_index.load_library(bucket, user_id) is None:
+            build_library(user_id)  # first library for this user, includes the new PDF
+            return
+        chunks = stored_chunks(attach_chunks(pdf_data))
+        if bm25 is None or vectors is None:
+            # Embeddings that failed at upload are retried here
+            loaded_bm25, vectors = document_indexes(user_id, pdf_name, pdf_data, chunks)
+            if bm25 is None:
+                bm25 = loaded_bm25
+        library_index.update_library(bucket, user_id, lambda library: library_index.add_document(
+            library, pdf_name, pdf_data.get("contentHash"), chunks, bm25, vectors))
+        print(f"📚 Added '{pdf_name}' ({len(chunks)} chunks) to library of {user_id}")
+    except Exception as e:
+        print(f"⚠️ Could not add '{pdf_name}' to library ({e})")
+
+
+def remove_from_library(user_id, pdf_name):
+    try:
+        library_index.update_library(bucket, user_id,
+                                     lambda library: library_index.remove_document(library, pdf_name),
+                                     create=False)
+    except Exception as e:
+        print(f"⚠️ Could not remove '{pdf_name}' from library ({e})")
+
+
+def build_library(user_id):
     """
-    Simple relevance matching using keyword overlap
-    (In production, use embeddings/vector search)
+    Build a user's library index from all their PDFs. Only needed once for
+    users whose PDFs predate the library; uploads and deletes keep it current.
     """
-    chunks = chunk_text(text)
-    query_words = set(query.lower().split())
-    
-    # Score chunks by word overlap
-    scored_chunks = []
-    for chunk in chunks:
-        chunk_words = set(chunk.lower().split())
-        overlap = len(query_words & chunk_words)
-        if overlap > 0:
-            scored_chunks.append((overlap, chunk))
-    
-    # Return top-k chunks
-    scored_chunks.sort(reverse=True)
-    relevant = [chunk for _, chunk in scored_chunks[:top_k]]
-    
-    return "\n---\n".join(relevant) if relevant else text[:2000]
+    def build(library):
+        pdfs = db.collection('users').document(user_id).collection('pdfs')
+        for doc in pdfs.select([FieldPath.document_id()]).stream():
+            pdf_data = load_pdf_text_record(user_id, doc.id)
+            chunks = stored_chunks(pdf_data) if pdf_data else []
+            if chunks:
+                bm25, vectors = document_indexes(user_id, doc.id, pdf_data, chunks)
+                library = library_index.add_document(library, doc.id, pdf_data.get("contentHash"),
+                                                     chunks, bm25, vectors)
+        return library
+
+    print(f"📚 Building library index for {user_id}")
+    return library_index.update_library(bucket, user_id, lambda _: build(library_index.Library.empty()))
+
+
+@app.route('/api/library-search', methods=['POST'])
+def library_search():
+    """
+    Search passages across all of the user's PDFs.
+    Body: {"query", "top_k" (default 5, 1-50), "retrieval": "bm25" | "hybrid"}
+    """
+    data = request.json or {}
+    query = (data.get('query') or '').strip()
+    if not query:
+        return jsonify({"error": "Missing query"}), 400
+    try:
+        top_k = max(1, min(int(data.get('top_k', 5)), 50))
+    except (TypeError, ValueError):
+        return jsonify({"error": "top_k must be an integer"}), 400
+
+    try:
+        user_id = get_current_user_id()
+        library = library_index.load_library(bucket, user_id) or build_library(user_id)
+
+        query_vector = None
+        if data.get('retrieval', CHAT_RETRIEVAL) != "bm25" and library.model == embedder.model:
+            try:
+                query_vector = embedder.embed([query])[0]
+            except Exception as e:
+                print(f"⚠️ Vector search unavailable ({e}), using BM25 only")
+
+        return jsonify({
+            "success": True,
+            "query": query,
+            "pdf_count": len(library.names),
+            "results": library.search(query, query_vector, top_k)
+        }), 200
+
+    except Exception as e:
+        print(f"❌ Library search error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 # ============================================================================
 # TEST GENERATION ROUTES
@@ -893,24 +1500,19 @@ def generate_test():
         user_id = get_current_user_id()
 
         # 🔥 Fetch PDF from Firestore
-        pdf_ref = db.collection('users') \
-                    .document(user_id) \
-                    .collection('pdfs') \
-                    .document(pdf_name)
+        pdf_data = load_pdf_text_record(user_id, pdf_name, max_tokens=1000)
 
-        pdf_doc = pdf_ref.get()
-
-        if not pdf_doc.exists:
+        if pdf_data is None:
             return jsonify({"error": "PDF not found"}), 400
 
-        pdf_data = pdf_doc.to_dict()
-        pdf_content = pdf_data.get('content', '')
+        pdf_content = pdf_data.get("pdfText", "")
+        chunks = stored_chunks(pdf_data)
 
-        if not pdf_content:
+        if not chunks:
             return jsonify({"error": "PDF content empty"}), 400
 
         # ── Quality check ──
-        is_ok, reason = check_pdf_quality(pdf_content)
+        is_ok, reason = stored_quality_verdict(pdf_data, pdf_content)
         if not is_ok:
             return jsonify({"error": reason}), 400
 
@@ -928,7 +1530,7 @@ def generate_test():
         prompt = f"""Generate exactly 30 MCQs from the content below.
 
 CONTENT:
-{pdf_content[:4000]}
+{leading_text(chunks, 1000)}
 
 Return ONLY valid JSON array of questions.
 
@@ -1387,29 +1989,24 @@ def generate_flashcards():
         user_id = get_current_user_id()
 
         # 🔥 Fetch PDF from Firestore
-        pdf_ref = db.collection('users') \
-                    .document(user_id) \
-                    .collection('pdfs') \
-                    .document(pdf_name)
-
-        pdf_doc = pdf_ref.get()
+        pdf_data = load_pdf_text_record(user_id, pdf_name, max_tokens=1500)
 
-        if not pdf_doc.exists:
+        if pdf_data is None:
             return jsonify({"error": "PDF not found"}), 404
 
-        pdf_data = pdf_doc.to_dict()
-        pdf_content = pdf_data.get("content", "")
+        pdf_content = pdf_data.get("pdfText", "")
+        chunks = stored_chunks(pdf_data)
 
-        if not pdf_content:
+        if not chunks:
             return jsonify({"error": "PDF content is empty"}), 400
 
         # ── Quality check ──
-        is_ok, reason = check_pdf_quality(pdf_content)
+        is_ok, reason = stored_quality_verdict(pdf_data, pdf_content)
         if not is_ok:
             return jsonify({"error": reason}), 400
 
-        # Use up to 6000 chars
-        content = pdf_content[:6000]
+        # Opening chunks, up to ~1500 tokens
+        content = leading_text(chunks, 1500)
 
         prompt = f"""Read the following content and generate flashcards.
 
@@ -1520,29 +2117,24 @@ def generate_flowchart():
         if pdf_name:
             user_id = get_current_user_id()
 
-            pdf_ref = db.collection('users') \
-                        .document(user_id) \
-                        .collection('pdfs') \
-                        .document(pdf_name)
+            pdf_data = load_pdf_text_record(user_id, pdf_name, max_tokens=1500)
 
-            pdf_doc = pdf_ref.get()
-
-            if not pdf_doc.exists:
+            if pdf_data is None:
                 return jsonify({"error": "PDF not found"}), 404
 
-            pdf_data = pdf_doc.to_dict()
-            pdf_content = pdf_data.get("content", "")
+            pdf_content = pdf_data.get("pdfText", "")
+            chunks = stored_chunks(pdf_data)
 
-            if not pdf_content:
+            if not chunks:
                 return jsonify({"error": "PDF content is empty"}), 400
 
             # ── Quality check ──
-            is_ok, reason = check_pdf_quality(pdf_content)
+            is_ok, reason = stored_quality_verdict(pdf_data, pdf_content)
             if not is_ok:
                 return jsonify({"error": reason}), 400
 
-            # Truncate for tokens
-            truncated = pdf_content[:6000]
+            # Opening chunks, up to ~1500 tokens
+            truncated = leading_text(chunks, 1500)
             content = f"PDF Content:\n{truncated}"
 
         elif subject:
@@ -1618,7 +2210,9 @@ def health():
     api_key_set = os.getenv("OPENAI_API_KEY") is not None
     return jsonify({
         "status": "ok",
-        "openai_key_set": api_key_set
+        "openai_key_set": api_key_set,
+        "notes_cache": notes_cache.stats(),
+        "pdf_cache": pdf_cache.stats()
     }), 200
 
 
@@ -1871,6 +2465,27 @@ def verify_token():
 # RUN SERVER
 # ============================================================================
 
+_jobs_resumed = threading.Event()
+_resume_lock = threading.Lock()
+
+
+@app.before_request
+def resume_upload_jobs():
+    """
+    Pick up upload jobs interrupted by a restart, once per process, when it
+    starts serving (scripts importing app don't run jobs).
+    """
+    if _jobs_resumed.is_set():
+        return
+    with _resume_lock:
+        if _jobs_resumed.is_set():
+            return
+        _jobs_resumed.set()
+    try:
+        resume_pending_jobs(db, run_upload_job)
+    except Exception as e:
+        print(f"Could not resume upload jobs: {str(e)}")
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     print(f"🚀 LiftOff AI Backend starting on 0.0.0.0:{port}")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark sequential vs concurrent section generation against a stubbed
+chat model. Latency follows a simple model of a completion call: a fixed
+time-to-first-token plus a per-token rate, with lognormal jitter and an
+occasional transient failure (e.g. a 429) that forces a retry.
+
+TIME_SCALE shrinks every sleep so the run finishes quickly; reported times
+are scaled back up to real seconds.
+
+Usage: python bench_llm_batch.py [sections] [concurrency]
+"""
+
+import sys
+import time
+import random
+import threading
+import contextlib
+import io
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from llm_batch import complete, complete_all, LLM_CONCURRENCY
+
+TIME_SCALE = 0.02
+FIRST_TOKEN_S = 1.5
+TOKENS_PER_S = 45
+OUTPUT_TOKENS = (600, 1400)
+FAILURE_RATE = 0.08
+
+
+class StubClient:
+    """Mimics client.chat.completions.create with realistic latency."""
+
+    def __init__(self, seed=7):
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        with self.lock:
+            self.calls += 1
+            tokens = self.random.randint(*OUTPUT_TOKENS)
+            jitter = self.random.lognormvariate(0, 0.25)
+            fail = self.random.random() < FAILURE_RATE
+        latency = (FIRST_TOKEN_S + tokens / TOKENS_PER_S) * jitter
+        if fail:
+            time.sleep(FIRST_TOKEN_S * TIME_SCALE)
+            response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+            raise openai.RateLimitError("429 rate limited", response=response, body=None)
+        time.sleep(latency * TIME_SCALE)
+        section = request["messages"][-1]["content"]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"notes for {section}"))])
+
+
+def build_requests(sections):
+    return [{
+        "model": "gpt-3.5-turbo",
+        "messages": [{"role": "user", "content": f"section {i + 1}"}],
+        "max_tokens": 4096
+    } for i in range(sections)]
+
+
+def run_sequential(client, requests):
+    return [complete(client, request, backoff=0) for request in requests]
+
+
+def timed(fn, *args, **kwargs):
+    # Silence the retry warnings
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+    return elapsed / TIME_SCALE, result
+
+
+def run_benchmark():
+    sections = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else LLM_CONCURRENCY
+    requests = build_requests(sections)
+
+    print("=" * 60)
+    print(f"Note generation benchmark ({sections} sections, concurrency={concurrency})")
+    print("=" * 60)
+
+    seq_client = StubClient()
+    seq_time, seq_notes = timed(run_sequential, seq_client, requests)
+    par_client = StubClient()
+    par_time, par_notes = timed(complete_all, par_client, requests, concurrency=concurrency, backoff=0)
+
+    # Sections must come back in order regardless of finish order
+    assert seq_notes == par_notes == [f"notes for section {i + 1}" for i in range(sections)]
+
+    print(f"sequential: {seq_time:7.1f}s  ({seq_client.calls} calls)")
+    print(f"concurrent: {par_time:7.1f}s  ({par_client.calls} calls)")
+    print(f"speedup:    {seq_time / par_time:7.2f}x")
+
+
+if __name__ == "__main__":
+    run_benchmark()
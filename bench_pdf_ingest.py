@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark serial vs page-parallel PDF ingestion.
+Builds synthetic slide-like PDFs of increasing page counts and times
+pdf_ingest.ingest_pdf in both modes. The parallel run is capped at one worker
+per CPU (pdf_ingest.parallel_workers); the engine column shows whether it
+actually sharded, so on a single-CPU host both runs are serial.
+
+Usage: python bench_pdf_ingest.py [workers]
+"""
+
+import os
+import sys
+import time
+import contextlib
+import io
+
+import fitz
+
+from pdf_ingest import ingest_pdf, parallel_workers, PARALLEL_WORKERS
+
+PAGE_COUNTS = [10, 25, 50, 100, 200]
+
+
+def build_pdf(page_count):
+    """Create a PDF whose pages have a heading, body text and a few shapes."""
+    doc = fitz.open()
+    for i in range(page_count):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Lecture slide {i + 1}", fontsize=24)
+        body = " ".join(f"concept{j} explains photosynthesis and respiration" for j in range(40))
+        page.insert_textbox(fitz.Rect(72, 110, 520, 500), body, fontsize=11)
+        # A simple bar chart so the page is classified as a figure
+        for k in range(6):
+            page.draw_rect(fitz.Rect(80 + k * 70, 700 - k * 30, 130 + k * 70, 700), color=(0, 0, 1), fill=(0.8, 0.9, 1))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def timed(pdf_bytes, parallel, workers):
+    # Silence the per-page progress prints (quiet covers the worker processes)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = ingest_pdf(pdf_bytes, parallel=parallel, workers=workers, quiet=True)
+        elapsed = time.perf_counter() - start
+    return elapsed, result
+
+
+def run_benchmark():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else PARALLEL_WORKERS
+
+    print("=" * 60)
+    print(f"PDF ingest benchmark (workers={workers}, cpus={os.cpu_count()})")
+    print("=" * 60)
+    print(f"{'pages':>6} {'serial s':>10} {'parallel s':>11} {'speedup':>8}  {'workers':>7}  engine")
+
+    for page_count in PAGE_COUNTS:
+        pdf_bytes = build_pdf(page_count)
+        serial_time, serial = timed(pdf_bytes, False, workers)
+        parallel_time, parallel = timed(pdf_bytes, True, workers)
+
+        # Both modes must produce identical, in-order output
+        assert serial["page_texts"] == parallel["page_texts"]
+        assert [img["page"] for img in serial["images"]] == [img["page"] for img in parallel["images"]]
+
+        used = parallel_workers(page_count, workers) if parallel["stats"]["engine"] == "pymupdf-parallel" else 1
+        print(f"{page_count:>6} {serial_time:>10.2f} {parallel_time:>11.2f} {serial_time / parallel_time:>7.2f}x"
+              f"  {used:>7}  {parallel['stats']['engine']}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
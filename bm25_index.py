@@ -0,0 +1,200 @@
+"""
+BM25 inverted index over a PDF's stored chunks, for chat retrieval.
+
+The index is built once at upload from the chunk texts (stopwords removed,
+light suffix stemming) and saved as a compressed .npz blob next to the
+content (content/{sha256}/bm25.npz):
+
+    terms    sorted term strings
+    offsets  postings start per term (len(terms) + 1)
+    docs     chunk index of each posting    (uint32)
+    tfs      term frequency of each posting (uint16)
+    lengths  token count per chunk          (uint32)
+
+Loaded indexes are kept in a small per-process LRU, so a chat message only
+touches the postings of its query terms.
+"""
+
+import io
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+from google.api_core.exceptions import NotFound
+
+INDEX_VERSION = 1
+INDEX_FILENAME = 'bm25.npz'
+
+K1 = 1.5
+B = 0.75
+
+# Loaded indexes kept per process
+INDEX_CACHE_SIZE = 32
+
+TERM_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have
+having he her here hers herself him himself his how i if in into is it its itself just me more most
+my myself no nor not now of off on once only or other our ours ourselves out over own same she should
+so some such than that the their theirs them themselves then there these they this those through to
+too under until up very was we were what when where which while who whom why will with would you your
+yours yourself yourselves also may might must shall us per via etc eg ie
+""".split())
+
+# (suffix, replacement), longest first; applied once, keeping a stem of >= 3 chars
+SUFFIXES = [
+    ("ational", "ate"), ("ization", "ize"), ("fulness", "ful"), ("iveness", "ive"),
+    ("ations", "ate"), ("ation", "ate"), ("ments", ""), ("ment", ""), ("ness", ""),
+    ("ingly", ""), ("edly", ""), ("ies", "y"), ("ing", ""), ("sses", "ss"),
+    ("ly", ""), ("ed", ""), ("es", ""), ("s", "")
+]
+
+
+def stem(word):
+    """Light suffix-stripping stemmer (osmosis/osmotic stay apart, cells -> cell)."""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    for suffix, replacement in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) + len(replacement) >= 3:
+            if suffix == "s" and word.endswith(("ss", "us", "is")):
+                return word
+            return word[:len(word) - len(suffix)] + replacement
+    return word
+
+
+def tokenize(text):
+    return [stem(token) for token in TERM_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+class Bm25Index:
+    """Postings arrays plus a term -> row lookup."""
+
+    def __init__(self, terms, offsets, docs, tfs, lengths):
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.lengths = lengths
+        self.rows = {term: i for i, term in enumerate(terms.tolist())}
+        self.avg_length = float(lengths.mean()) if len(lengths) else 0.0
+
+    @property
+    def doc_count(self):
+        return len(self.lengths)
+
+    def scores(self, query):
+        """BM25 score of every chunk for a query (zeros where no term matches)."""
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        if not self.doc_count:
+            return scores
+        norm = K1 * (1 - B + B * self.lengths / max(self.avg_length, 1e-9))
+        for term in set(tokenize(query)):
+            row = self.rows.get(term)
+            if row is None:
+                continue
+            start, end = self.offsets[row], self.offsets[row + 1]
+            docs = self.docs[start:end]
+            tfs = self.tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = np.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tfs * (K1 + 1) / (tfs + norm[docs])
+        return scores
+
+    def search(self, query, top_k=3):
+        """[(chunk index, score)] of the best matching chunks, best first."""
+        scores = self.scores(query)
+        hits = np.flatnonzero(scores)
+        if not len(hits):
+            return []
+        top = hits[np.argsort(-scores[hits], kind="stable")[:top_k]]
+        return [(int(i), float(scores[i])) for i in top]
+
+
+def build_index(texts):
+    """Build an index over a list of chunk texts."""
+    postings = {}
+    lengths = np.zeros(len(texts), dtype=np.uint32)
+    for doc, text in enumerate(texts):
+        tokens = tokenize(text)
+        lengths[doc] = len(tokens)
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term, []).append((doc, min(tf, 65535)))
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.uint32)
+    docs, tfs = [], []
+    for i, term in enumerate(terms):
+        entries = postings[term]
+        offsets[i + 1] = offsets[i] + len(entries)
+        docs.extend(doc for doc, _ in entries)
+        tfs.extend(tf for _, tf in entries)
+
+    return Bm25Index(
+        np.array(terms, dtype=str), offsets,
+        np.array(docs, dtype=np.uint32), np.array(tfs, dtype=np.uint16), lengths
+    )
+
+
+def dumps(index):
+    buf = io.BytesIO()
+    np.savez_compressed(
+        buf, version=np.array([INDEX_VERSION]), terms=index.terms, offsets=index.offsets,
+        docs=index.docs, tfs=index.tfs, lengths=index.lengths
+    )
+    return buf.getvalue()
+
+
+def loads(data):
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        if int(npz["version"][0]) != INDEX_VERSION:
+            raise ValueError("Unsupported BM25 index version")
+        return Bm25Index(npz["terms"], npz["offsets"], npz["docs"], npz["tfs"], npz["lengths"])
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _remember(key, index):
+    with _cache_lock:
+        _cache[key] = index
+        _cache.move_to_end(key)
+        while len(_cache) > INDEX_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
+
+
+def load_index(bucket, key, storage_path, texts):
+    """
+    Return the index for a document: from the process cache, else from
+    storage_path in the bucket, else built from `texts` (and saved to
+    storage_path for next time when one is given).
+
+    key          - cache key (content hash, or a per-user key for legacy PDFs)
+    storage_path - blob path of the serialized index, or None
+    texts        - chunk texts, only used when the index has to be built
+    """
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    if storage_path:
+        try:
+            return _remember(key, loads(bucket.blob(storage_path).download_as_bytes()))
+        except NotFound:
+            pass
+        except Exception as e:
+            print(f"⚠️ Could not load BM25 index {storage_path} ({e}), rebuilding")
+
+    index = build_index(texts)
+    if storage_path:
+        save_index(bucket, storage_path, index)
+    return _remember(key, index)
+
+
+def save_index(bucket, storage_path, index):
+    bucket.blob(storage_path).upload_from_string(dumps(index), content_type="application/octet-stream")
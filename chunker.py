@@ -0,0 +1,198 @@
+"""
+Structure-aware chunking of extracted PDF text.
+
+Pages are read as text blocks (paragraphs) with a heading flag taken from
+PyMuPDF's font information. Chunks are packed up to a token budget, break at
+headings, and only split paragraphs at sentence boundaries (or words, for a
+single overlong sentence). Consecutive chunks within a section share a short
+overlap so retrieval doesn't lose a sentence at a boundary.
+
+Chunks are built once at upload and stored with the PDF content; notes,
+chat retrieval, tests and flashcards all read the stored chunks.
+"""
+
+import os
+import re
+
+# Configure via env:
+#   CHUNK_TARGET_TOKENS   token budget per chunk
+#   CHUNK_OVERLAP_TOKENS  tokens repeated from the previous chunk
+CHUNK_TARGET_TOKENS = int(os.environ.get('CHUNK_TARGET_TOKENS', 500))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get('CHUNK_OVERLAP_TOKENS', 50))
+# A heading only starts a new chunk once the current one has this much text
+MIN_CHUNK_TOKENS = CHUNK_TARGET_TOKENS // 4
+
+# Headings: short blocks set noticeably larger than body text, or all bold
+HEADING_SIZE_RATIO = 1.15
+HEADING_MAX_CHARS = 120
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+SENTENCE_RE = re.compile(r'(?<=[.!?])\s+(?=["\'(\[]?[A-Z0-9])')
+PARAGRAPH_RE = re.compile(r'\n\s*\n')
+HYPHEN_BREAK_RE = re.compile(r'(\w)-\n(?=[a-z])')
+WS_RE = re.compile(r'\s+')
+
+
+def estimate_tokens(text):
+    """
+    Offline token estimate close to BPE tokenizers on English text: one token
+    per punctuation mark and per word, plus one per 4 extra characters.
+    """
+    return sum(1 + (len(token) - 1) // 4 for token in TOKEN_RE.findall(text))
+
+
+def _clean(text):
+    return WS_RE.sub(' ', HYPHEN_BREAK_RE.sub(r'\1', text)).strip()
+
+
+def page_blocks(page, textpage=None):
+    """Text blocks of a PyMuPDF page in reading order, as [{"text", "heading"}]."""
+    data = page.get_text("dict", textpage=textpage, sort=True)
+    raw = []
+    size_chars = {}
+    for block in data["blocks"]:
+        if block.get("type") != 0:
+            continue
+        lines = []
+        max_size = 0
+        bold = True
+        for line in block["lines"]:
+            spans = [span for span in line["spans"] if span["text"].strip()]
+            if not spans:
+                continue
+            lines.append("".join(span["text"] for span in line["spans"]))
+            for span in spans:
+                max_size = max(max_size, span["size"])
+                bold = bold and bool(span["flags"] & 16)
+                size = round(span["size"], 1)
+                size_chars[size] = size_chars.get(size, 0) + len(span["text"])
+        text = _clean("\n".join(lines))
+        if text:
+            raw.append((text, max_size, bold, len(lines)))
+
+    # Body size = the font size most of the page's characters are set in
+    body_size = max(size_chars, key=size_chars.get) if size_chars else 0
+    blocks = []
+    for text, size, bold, line_count in raw:
+        short = len(text) <= HEADING_MAX_CHARS and line_count <= 2
+        heading = short and (size >= body_size * HEADING_SIZE_RATIO or (bold and len(raw) > 1))
+        blocks.append({"text": text, "heading": heading})
+    return blocks
+
+
+def text_blocks(text):
+    """Paragraph blocks from plain text (fallback extractors, legacy PDFs)."""
+    return [{"text": cleaned, "heading": False}
+            for cleaned in (_clean(part) for part in PARAGRAPH_RE.split(text)) if cleaned]
+
+
+def _split_long(text, target):
+    """Split an overlong paragraph into sentence (or word) runs within target."""
+    units = []
+    for sentence in SENTENCE_RE.split(text):
+        if estimate_tokens(sentence) <= target:
+            units.append(sentence)
+            continue
+        words, current = sentence.split(), []
+        for word in words:
+            if current and estimate_tokens(" ".join(current + [word])) > target:
+                units.append(" ".join(current))
+                current = []
+            current.append(word)
+        if current:
+            units.append(" ".join(current))
+    return units
+
+
+def _overlap(text, budget):
+    """Trailing sentences of a chunk that fit in the overlap budget."""
+    tail = []
+    used = 0
+    for sentence in reversed(SENTENCE_RE.split(text.rsplit("\n\n", 1)[-1])):
+        tokens = estimate_tokens(sentence)
+        if used + tokens > budget:
+            break
+        tail.insert(0, sentence)
+        used += tokens
+    return " ".join(tail)
+
+
+def chunk_pages(pages, target=CHUNK_TARGET_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """
+    Pack per-page blocks (lists from page_blocks/text_blocks) into chunks.
+    Returns [{"text", "page", "endPage", "heading", "tokens"}] where page and
+    endPage are the 1-based pages the chunk spans and heading is the section
+    heading it falls under.
+    """
+    chunks = []
+    parts, tokens = [], 0
+    first_page = last_page = None
+    heading = None
+
+    def flush(carry=""):
+        nonlocal parts, tokens, first_page
+        if parts:
+            chunks.append({
+                "text": "\n\n".join(parts),
+                "page": first_page,
+                "endPage": last_page,
+                "heading": heading,
+                "tokens": tokens
+            })
+        parts = [carry] if carry else []
+        tokens = estimate_tokens(carry) if carry else 0
+        first_page = last_page if carry else None
+
+    for page_number, blocks in enumerate(pages, start=1):
+        for block in blocks:
+            text = block["text"]
+            if block["heading"]:
+                if tokens >= MIN_CHUNK_TOKENS:
+                    flush()
+                heading = text
+
+            block_tokens = estimate_tokens(text)
+            units = [text] if block_tokens <= target else _split_long(text, target)
+            for unit in units:
+                unit_tokens = estimate_tokens(unit)
+                if parts and tokens + unit_tokens > target:
+                    flush(_overlap(parts[-1], overlap) if overlap else "")
+                if first_page is None:
+                    first_page = page_number
+                last_page = page_number
+                parts.append(unit)
+                tokens += unit_tokens
+    flush()
+    return chunks
+
+
+def chunk_plain_text(text, target=CHUNK_TARGET_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """Chunk text without page structure; page numbers are unknown (None)."""
+    chunks = chunk_pages([text_blocks(text)], target, overlap)
+    for chunk in chunks:
+        chunk["page"] = chunk["endPage"] = None
+    return chunks
+
+
+def stored_chunks(pdf_data):
+    """
+    Chunks saved at upload, or chunks built from the text for PDFs uploaded
+    before structured chunking (which stored plain word-window strings).
+    """
+    chunks = pdf_data.get("chunks") or []
+    if chunks and isinstance(chunks[0], dict):
+        return chunks
+    return chunk_plain_text(pdf_data.get("pdfText", ""))
+
+
+def leading_text(chunks, max_tokens):
+    """The document's opening chunks, whole, up to a token budget."""
+    parts = []
+    used = 0
+    for chunk in chunks:
+        tokens = chunk.get("tokens") or estimate_tokens(chunk["text"])
+        if parts and used + tokens > max_tokens:
+            break
+        parts.append(chunk["text"])
+        used += tokens
+    return "\n\n".join(parts)
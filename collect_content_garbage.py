@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""
+Sweep shared PDF content (pdfContent/{sha256}) left marked purging, e.g.
+when a process died between releasing the last reference and deleting the
+blobs. Until swept, a new upload of the same file is refused with a 503.
+Safe to run at any time; meant to be scheduled (e.g. hourly cron).
+
+Uses the same environment as app.py (FIREBASE_SERVICE_ACCOUNT_JSON etc.).
+
+Usage: python collect_content_garbage.py
+"""
+
+from app import db, bucket
+from content_store import collect_garbage
+
+
+if __name__ == "__main__":
+    print(f"🗑️ Purged {collect_garbage(db, bucket)} unreferenced content entries")
@@ -0,0 +1,175 @@
+"""
+Shared pytest fixtures for the offline tests.
+
+bucket: an in-memory stand-in for a Firebase Storage bucket with just the
+blob calls the app uses (upload/download, reload, delete, list_blobs,
+generations and if_generation_match preconditions). Downloaded paths are
+recorded in bucket.downloads.
+
+db: an in-memory stand-in for Firestore documents, subcollections, simple
+where() filters and transactions (applied immediately, with
+firestore.transactional patched to a plain call). Increment, ArrayUnion and
+SERVER_TIMESTAMP are applied on write. Documents are in db.docs by path.
+"""
+
+from datetime import datetime, timezone
+
+import pytest
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+
+class FakeBucket:
+    def __init__(self):
+        self.blobs = {}        # path -> bytes
+        self.generations = {}  # path -> generation of the current bytes
+        self.downloads = []
+
+    def put(self, path, data):
+        """Write a blob directly (e.g. as another writer), bumping its generation."""
+        self.generations[path] = self.generations.get(path, 0) + 1
+        self.blobs[path] = data
+
+    def list_blobs(self, prefix=""):
+        return [self.blob(path) for path in sorted(self.blobs) if path.startswith(prefix)]
+
+    def blob(self, path):
+        bucket = self
+
+        class Blob:
+            name = path
+            generation = None
+
+            def reload(self):
+                if path not in bucket.blobs:
+                    raise NotFound(path)
+                self.generation = bucket.generations[path]
+
+            def download_as_bytes(self, if_generation_match=None):
+                if path not in bucket.blobs:
+                    raise NotFound(path)
+                if if_generation_match is not None and if_generation_match != bucket.generations[path]:
+                    raise PreconditionFailed(path)
+                bucket.downloads.append(path)
+                return bucket.blobs[path]
+
+            def upload_from_string(self, data, content_type=None, if_generation_match=None):
+                current = bucket.generations.get(path, 0)
+                if if_generation_match is not None and if_generation_match != current:
+                    raise PreconditionFailed(path)
+                bucket.put(path, data)
+                self.generation = bucket.generations[path]
+
+            def delete(self):
+                if path not in bucket.blobs:
+                    raise NotFound(path)
+                del bucket.blobs[path]
+                del bucket.generations[path]
+
+        return Blob()
+
+
+@pytest.fixture
+def bucket():
+    return FakeBucket()
+
+
+def _apply(current, fields):
+    updated = dict(current)
+    for key, value in fields.items():
+        if isinstance(value, firestore.Increment):
+            updated[key] = updated.get(key, 0) + value.value
+        elif isinstance(value, firestore.ArrayUnion):
+            updated[key] = updated.get(key, []) + [v for v in value.values if v not in updated.get(key, [])]
+        elif value is firestore.SERVER_TIMESTAMP:
+            updated[key] = datetime.now(timezone.utc)
+        else:
+            updated[key] = value
+    return updated
+
+
+class FakeSnapshot:
+    def __init__(self, reference, fields):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = fields is not None
+        self._fields = fields
+
+    def to_dict(self):
+        return dict(self._fields) if self.exists else None
+
+
+class FakeDocument:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path[-1]
+
+    def collection(self, name):
+        return FakeCollection(self.db, self.path + (name,))
+
+    def get(self, transaction=None, field_paths=None):
+        return FakeSnapshot(self, self.db.docs.get(self.path))
+
+    def set(self, fields, merge=False):
+        self.db.docs[self.path] = _apply(self.db.docs.get(self.path, {}) if merge else {}, fields)
+
+    def update(self, fields):
+        if self.path not in self.db.docs:
+            raise NotFound("/".join(self.path))
+        self.db.docs[self.path] = _apply(self.db.docs[self.path], fields)
+
+    def delete(self):
+        self.db.docs.pop(self.path, None)
+
+
+class FakeCollection:
+    OPS = {"==": lambda a, b: a == b, "<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+           ">": lambda a, b: a > b, ">=": lambda a, b: a >= b, "in": lambda a, b: a in b}
+
+    def __init__(self, db, path, filters=()):
+        self.db = db
+        self.path = path
+        self.filters = filters
+
+    def document(self, doc_id):
+        return FakeDocument(self.db, self.path + (doc_id,))
+
+    def where(self, filter):
+        return FakeCollection(self.db, self.path, self.filters + (filter,))
+
+    def stream(self):
+        for path, fields in sorted(self.db.docs.items()):
+            if path[:-1] != self.path:
+                continue
+            if all(f.field_path in fields and self.OPS[f.op_string](fields[f.field_path], f.value)
+                   for f in self.filters):
+                yield FakeSnapshot(FakeDocument(self.db, path), fields)
+
+
+class FakeTransaction:
+    def set(self, ref, fields, merge=False):
+        ref.set(fields, merge=merge)
+
+    def update(self, ref, fields):
+        ref.update(fields)
+
+    def delete(self, ref):
+        ref.delete()
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.docs = {}  # path tuple -> fields
+
+    def collection(self, name):
+        return FakeCollection(self, (name,))
+
+    def transaction(self):
+        return FakeTransaction()
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(firestore, "transactional", lambda fn: fn)
+    return FakeFirestore()
@@ -0,0 +1,209 @@
+"""
+Content-addressed store for uploaded PDFs.
+
+Identical files are stored and extracted once. Everything derived from the
+bytes (text, chunks, image metadata, page images) lives under the SHA-256 of
+the file:
+
+    Firestore  pdfContent/{sha256}         extracted metadata + refCount
+    Firestore  pdfContent/{sha256}/mirrors/cdn  pages whose images are copied to R2
+    Storage    content/{sha256}/source.pdf original file
+    Storage    content/{sha256}/text/      compressed chunk text segments (text_store)
+    Storage    content/{sha256}/pages/     rendered page images
+    Storage    content/{sha256}/<artifact> chunk table, search indexes etc.
+
+Per-user documents (users/{uid}/pdfs/{name}) only hold a contentHash plus
+user-specific fields such as notes. refCount tracks how many user documents
+point at an entry; when it drops to zero the entry is marked purging and
+its blobs are deleted, along with any copies mirrored to R2 under the same
+keys (image_upload.py), and the entry itself last. While the mark is set a
+new upload of the same file waits for the purge instead of writing blobs
+under a prefix that is being deleted. Entries left purging by a crash are
+swept by collect_garbage (collect_content_garbage.py, run on a schedule).
+"""
+
+import hashlib
+import time
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+import image_upload
+
+CONTENT_COLLECTION = 'pdfContent'
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# How long an upload waits for a purge of the same content to finish
+PURGE_WAIT_SECONDS = 30
+PURGE_POLL_SECONDS = 0.5
+
+
+class ContentBusy(Exception):
+    """The content entry is still being purged; try the upload again later."""
+
+
+def hash_file(path):
+    """SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_prefix(content_hash):
+    return f'content/{content_hash}/'
+
+
+def content_storage_path(content_hash):
+    return f'{content_prefix(content_hash)}source.pdf'
+
+
+def page_image_prefix(content_hash):
+    return f'{content_prefix(content_hash)}pages/'
+
+
+def content_blob_path(content_hash, filename):
+    """Path of a derived artifact (e.g. a search index) stored with the content."""
+    return f'{content_prefix(content_hash)}{filename}'
+
+
+def _content_ref(db, content_hash):
+    return db.collection(CONTENT_COLLECTION).document(content_hash)
+
+
+def _mirror_ref(db, content_hash):
+    return _content_ref(db, content_hash).collection('mirrors').document('cdn')
+
+
+def mirrored_pages(db, content_hash):
+    """Pages whose image variants have been copied to R2 (see app.cdn_image_url)."""
+    doc = _mirror_ref(db, content_hash).get()
+    return set(doc.to_dict().get("pages", [])) if doc.exists else set()
+
+
+def record_mirrored_page(db, content_hash, page):
+    _mirror_ref(db, content_hash).set({"pages": firestore.ArrayUnion([page])}, merge=True)
+
+
+def _purging(fields):
+    # refCount 0 without the mark: released by a version that didn't set it
+    return fields.get("purging", False) or fields.get("refCount", 0) <= 0
+
+
+def load_content(db, content_hash):
+    """Return the shared content dict for a hash, or None."""
+    doc = _content_ref(db, content_hash).get()
+    return doc.to_dict() if doc.exists else None
+
+
+def acquire_content(db, content_hash):
+    """
+    Take a reference on existing content. Returns the content dict (a dedup
+    hit) or None if this hash hasn't been ingested yet. If the entry is being
+    purged, waits up to PURGE_WAIT_SECONDS for it to go away (then returns
+    None) before raising ContentBusy.
+    """
+    ref = _content_ref(db, content_hash)
+
+    @firestore.transactional
+    def acquire(transaction):
+        snapshot = ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        if _purging(snapshot.to_dict()):
+            raise ContentBusy(f"Content {content_hash[:12]} is still being deleted")
+        transaction.update(ref, {"refCount": firestore.Increment(1)})
+        return snapshot.to_dict()
+
+    deadline = time.monotonic() + PURGE_WAIT_SECONDS
+    while True:
+        try:
+            return acquire(db.transaction())
+        except ContentBusy:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(PURGE_POLL_SECONDS)
+
+
+def store_content(db, content_hash, fields):
+    """
+    Save freshly extracted content with one reference. If another upload of
+    the same file won the race, just take a reference on its entry instead.
+    Raises ContentBusy if that entry is being purged, since the blobs just
+    written under its prefix may be deleted with it.
+    """
+    ref = _content_ref(db, content_hash)
+
+    @firestore.transactional
+    def store(transaction):
+        snapshot = ref.get(transaction=transaction)
+        if snapshot.exists:
+            if _purging(snapshot.to_dict()):
+                raise ContentBusy(f"Content {content_hash[:12]} is being deleted")
+            transaction.update(ref, {"refCount": firestore.Increment(1)})
+            return False
+        transaction.set(ref, {
+            **fields,
+            "refCount": 1,
+            "createdAt": firestore.SERVER_TIMESTAMP
+        })
+        return True
+
+    return store(db.transaction())
+
+
+def _purge(db, bucket, content_hash):
+    """Delete a purging entry's blobs, then the entry."""
+    for blob in bucket.list_blobs(prefix=content_prefix(content_hash)):
+        blob.delete()
+    if image_upload.r2_configured():
+        try:
+            image_upload.delete_prefix_from_r2(content_prefix(content_hash))
+        except Exception as e:
+            print(f"⚠️ Could not delete R2 copies of content {content_hash[:12]} ({e})")
+    _mirror_ref(db, content_hash).delete()
+
+    ref = _content_ref(db, content_hash)
+
+    @firestore.transactional
+    def delete_if_purging(transaction):
+        snapshot = ref.get(transaction=transaction)
+        if snapshot.exists and _purging(snapshot.to_dict()):
+            transaction.delete(ref)
+
+    delete_if_purging(db.transaction())
+
+
+def release_content(db, bucket, content_hash):
+    """Drop one reference; delete the entry and its blobs when none remain."""
+    ref = _content_ref(db, content_hash)
+
+    @firestore.transactional
+    def release(transaction):
+        snapshot = ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        remaining = max(0, snapshot.to_dict().get("refCount", 1) - 1)
+        if remaining == 0:
+            # Blocks new references until _purge has deleted the entry
+            transaction.update(ref, {"refCount": 0, "purging": True, "purgingAt": firestore.SERVER_TIMESTAMP})
+        else:
+            transaction.update(ref, {"refCount": remaining})
+        return remaining
+
+    remaining = release(db.transaction())
+    if remaining == 0:
+        print(f"🗑️ Content {content_hash[:12]} no longer referenced, deleting")
+        _purge(db, bucket, content_hash)
+    return remaining
+
+
+def collect_garbage(db, bucket):
+    """Sweep entries left purging (e.g. a crash between release and purge)."""
+    collected = 0
+    for doc in db.collection(CONTENT_COLLECTION).where(filter=FieldFilter("refCount", "<=", 0)).stream():
+        _purge(db, bucket, doc.id)
+        collected += 1
+    return collected
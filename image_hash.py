@@ -0,0 +1,67 @@
+"""
+Perceptual hashing of rendered pages with NumPy.
+
+A difference hash (dHash) compares neighbouring cells of a downscaled
+grayscale image, so repeated title slides, section dividers and template
+backgrounds hash to (nearly) the same bits even after small text changes.
+"""
+
+import os
+
+import numpy as np
+
+# Hash grid is HASH_SIZE x HASH_SIZE bits
+HASH_SIZE = int(os.environ.get('PAGE_HASH_SIZE', 16))
+# Max differing bits for two pages to count as near-duplicates
+MAX_DISTANCE = int(os.environ.get('PAGE_DEDUP_DISTANCE', 12))
+
+
+def _downscale(gray, rows, cols):
+    """Area-average a 2-D array down to rows x cols."""
+    row_edges = np.linspace(0, gray.shape[0], rows + 1).astype(int)
+    col_edges = np.linspace(0, gray.shape[1], cols + 1).astype(int)
+    # Sum over row bands, then column bands, and divide by cell size
+    summed = np.add.reduceat(np.add.reduceat(gray, row_edges[:-1], axis=0), col_edges[:-1], axis=1)
+    sizes = np.outer(np.diff(row_edges), np.diff(col_edges))
+    return summed / np.maximum(sizes, 1)
+
+
+def dhash(gray, hash_size=HASH_SIZE):
+    """dHash of a 2-D grayscale array as a hex string."""
+    gray = np.asarray(gray, dtype=np.float32)
+    small = _downscale(gray, hash_size, hash_size + 1)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return np.packbits(bits).tobytes().hex()
+
+
+def _bits(hex_hash):
+    return np.unpackbits(np.frombuffer(bytes.fromhex(hex_hash), dtype=np.uint8))
+
+
+def hamming(a, b):
+    """Number of differing bits between two hex hashes."""
+    return int(np.count_nonzero(_bits(a) != _bits(b)))
+
+
+def assign_aliases(images, max_distance=MAX_DISTANCE):
+    """
+    Mark near-duplicate images in place. Each image whose "phash" is within
+    max_distance bits of an earlier canonical image gets "alias_of" set to
+    that image's index; canonical images are left as they are.
+    """
+    canonical_bits = []
+    canonical_index = []
+    for i, image in enumerate(images):
+        if not image.get("phash"):
+            continue
+        bits = _bits(image["phash"])
+        if canonical_bits:
+            distances = np.count_nonzero(np.vstack(canonical_bits) != bits, axis=1)
+            best = int(np.argmin(distances))
+            if distances[best] <= max_distance:
+                image["alias_of"] = canonical_index[best]
+                image.pop("data", None)  # the canonical copy is stored once
+                continue
+        canonical_bits.append(bits)
+        canonical_index.append(i)
+    return images
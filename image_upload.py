@@ -1,30 +1,99 @@
 import boto3
-from botocore.exceptions import NoCredentialsError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError, NoCredentialsError
+from concurrent.futures import ThreadPoolExecutor
+import io
 import os
+import threading
 
-# Configuration — set these in your environment or replace directly
-ENDPOINT_URL = "https://78d5629b13f881a076ac38046e5df31e.r2.cloudflarestorage.com"
-ACCESS_KEY_ID = "8a9e77c0d1328c86d4e1eb3e1cac5510"
-SECRET_ACCESS_KEY = "f265bea8ddcefe13de4224ce6103e3c667327d03ae8221d7a5d36023227b716c"
-BUCKET_NAME = "smartlens-images"
-CDN_DOMAIN = "https://cdn.theboldlens.com"  # Public domain for serving
-
-# Create R2 client
-s3 = boto3.client(
-    "s3",
-    endpoint_url=ENDPOINT_URL,
-    aws_access_key_id=ACCESS_KEY_ID,
-    aws_secret_access_key=SECRET_ACCESS_KEY,
-    region_name="auto"
+# Configuration — required, set these in your environment:
+#   R2_ENDPOINT_URL        https://<account id>.r2.cloudflarestorage.com
+#   R2_ACCESS_KEY_ID       R2 API token key ID
+#   R2_SECRET_ACCESS_KEY   R2 API token secret
+#   R2_BUCKET_NAME         bucket objects are uploaded to
+#   R2_CDN_DOMAIN          public domain serving the bucket (e.g. https://cdn.example.com)
+ENDPOINT_URL = os.environ.get('R2_ENDPOINT_URL')
+ACCESS_KEY_ID = os.environ.get('R2_ACCESS_KEY_ID')
+SECRET_ACCESS_KEY = os.environ.get('R2_SECRET_ACCESS_KEY')
+BUCKET_NAME = os.environ.get('R2_BUCKET_NAME')
+CDN_DOMAIN = os.environ.get('R2_CDN_DOMAIN')
+
+# Upload tuning:
+#   R2_UPLOAD_CONCURRENCY       objects (and parts of one large object) sent at once
+#   R2_MULTIPART_THRESHOLD_MB   objects at least this big go up as multipart uploads
+#   R2_MULTIPART_CHUNK_MB       part size of multipart uploads (R2/S3 minimum is 5)
+#   R2_CACHE_CONTROL            Cache-Control stored with every object
+R2_UPLOAD_CONCURRENCY = int(os.environ.get('R2_UPLOAD_CONCURRENCY', 8))
+R2_MULTIPART_THRESHOLD = int(float(os.environ.get('R2_MULTIPART_THRESHOLD_MB', 8)) * 1024 * 1024)
+R2_MULTIPART_CHUNK = int(float(os.environ.get('R2_MULTIPART_CHUNK_MB', 8)) * 1024 * 1024)
+# Keys are content-addressed, so objects never change under the same key
+R2_CACHE_CONTROL = os.environ.get('R2_CACHE_CONTROL', "public, max-age=31536000, immutable")
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=R2_MULTIPART_THRESHOLD,
+    multipart_chunksize=R2_MULTIPART_CHUNK,
+    max_concurrency=R2_UPLOAD_CONCURRENCY
 )
 
-def upload_to_r2(file_path: str, r2_key: str) -> str:
+# R2 client, created on first use (thread-safe; the pool size covers concurrent uploads times their parts)
+s3 = None
+_client_lock = threading.Lock()
+
+
+def r2_configured() -> bool:
+    """True if every required R2_* setting is present."""
+    return all((ENDPOINT_URL, ACCESS_KEY_ID, SECRET_ACCESS_KEY, BUCKET_NAME, CDN_DOMAIN))
+
+
+def get_client():
+    """The R2 client; raises RuntimeError naming any R2_* setting that is missing."""
+    global s3
+    with _client_lock:
+        if s3 is None:
+            missing = [name for name, value in (
+                ("R2_ENDPOINT_URL", ENDPOINT_URL), ("R2_ACCESS_KEY_ID", ACCESS_KEY_ID),
+                ("R2_SECRET_ACCESS_KEY", SECRET_ACCESS_KEY), ("R2_BUCKET_NAME", BUCKET_NAME),
+                ("R2_CDN_DOMAIN", CDN_DOMAIN)) if not value]
+            if missing:
+                raise RuntimeError(f"R2 is not configured: set {', '.join(missing)}")
+            s3 = boto3.client(
+                "s3",
+                endpoint_url=ENDPOINT_URL,
+                aws_access_key_id=ACCESS_KEY_ID,
+                aws_secret_access_key=SECRET_ACCESS_KEY,
+                region_name="auto",
+                config=Config(max_pool_connections=R2_UPLOAD_CONCURRENCY * 2)
+            )
+        return s3
+
+# Shared by upload_many_to_r2 and submit_to_r2
+_pool = ThreadPoolExecutor(max_workers=R2_UPLOAD_CONCURRENCY, thread_name_prefix="r2-upload")
+
+
+def cdn_url(r2_key: str) -> str:
+    """Public CDN URL of an R2 key."""
+    return f"{CDN_DOMAIN}/{r2_key}"
+
+
+def _extra_args(content_type, cache_control):
+    extra = {"CacheControl": cache_control or R2_CACHE_CONTROL}
+    if content_type:
+        extra["ContentType"] = content_type
+    return extra
+
+
+def upload_to_r2(file_path: str, r2_key: str, content_type: str = None, cache_control: str = None) -> str:
     """
     Upload a local file to Cloudflare R2 and return its public URL.
+    Files of R2_MULTIPART_THRESHOLD_MB or more are sent as a multipart
+    upload with parts in parallel.
 
     Args:
         file_path: Path to the local file (e.g., "./images/photo.jpg")
         r2_key: Path/key in the R2 bucket (e.g., "uploads/photo.jpg")
+        content_type: MIME type stored with the object
+        cache_control: Cache-Control stored with the object (default R2_CACHE_CONTROL)
 
     Returns:
         Public URL of the uploaded file
@@ -33,24 +102,87 @@ def upload_to_r2(file_path: str, r2_key: str) -> str:
         raise FileNotFoundError(f"File not found: {file_path}")
 
     try:
-        s3.upload_file(file_path, BUCKET_NAME, r2_key)
+        get_client().upload_file(file_path, BUCKET_NAME, r2_key,
+                       ExtraArgs=_extra_args(content_type, cache_control), Config=TRANSFER_CONFIG)
         print(f"✅ Uploaded {file_path} to R2 at {r2_key}")
-        return f"{CDN_DOMAIN}/{r2_key}"
+        return cdn_url(r2_key)
     except Exception as e:
         print(f"❌ Upload failed: {e}")
         raise
+
 def upload_content_to_r2(content: str, r2_key: str, content_type: str = 'text/html') -> str:
     """Uploads a string content to R2."""
     try:
-        s3.put_object(Bucket=BUCKET_NAME, Key=r2_key, Body=content, ContentType=content_type)
-        return f"{CDN_DOMAIN}/{r2_key}"
-    except NoCredentialsError:
+        get_client().put_object(Bucket=BUCKET_NAME, Key=r2_key, Body=content, ContentType=content_type)
+        return cdn_url(r2_key)
+    except NoCredentialsError as e:
         print(f"❌ Credentials error: {e}")
         raise
     except Exception as e:
         print(f"❌ Upload failed: {e}")
         raise
 
+def upload_bytes_to_r2(data: bytes, r2_key: str, content_type: str, cache_control: str = None) -> str:
+    """Uploads bytes to R2 (multipart when large) and returns the CDN URL."""
+    get_client().upload_fileobj(io.BytesIO(data), BUCKET_NAME, r2_key,
+                      ExtraArgs=_extra_args(content_type, cache_control), Config=TRANSFER_CONFIG)
+    return cdn_url(r2_key)
+
+
+def _upload(item, if_missing=False):
+    source, r2_key, content_type = item
+    if if_missing and r2_object_exists(r2_key):
+        return cdn_url(r2_key)
+    if isinstance(source, (bytes, bytearray)):
+        return upload_bytes_to_r2(source, r2_key, content_type)
+    return upload_to_r2(source, r2_key, content_type)
+
+
+def upload_many_to_r2(items) -> list:
+    """
+    Upload (source, r2_key, content_type) items concurrently, where source is
+    a local file path or bytes. Returns the CDN URLs in the same order; raises
+    the first upload error after every upload has finished.
+    """
+    futures = [_pool.submit(_upload, item) for item in items]
+    errors = [future.exception() for future in futures]
+    for error in errors:
+        if error is not None:
+            raise error
+    return [future.result() for future in futures]
+
+
+def submit_to_r2(source, r2_key: str, content_type: str = None, if_missing: bool = False):
+    """
+    Start one upload in the background; returns a Future of its CDN URL.
+    With if_missing, a key that already exists is not uploaded again.
+    """
+    return _pool.submit(_upload, (source, r2_key, content_type), if_missing)
+
+
+def r2_object_exists(r2_key: str) -> bool:
+    """True if the key is already in the R2 bucket."""
+    try:
+        get_client().head_object(Bucket=BUCKET_NAME, Key=r2_key)
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+def delete_prefix_from_r2(prefix: str) -> int:
+    """Delete every object under a key prefix; returns how many were deleted."""
+    client = get_client()
+    deleted = 0
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        keys = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+        if keys:
+            client.delete_objects(Bucket=BUCKET_NAME, Delete={"Objects": keys, "Quiet": True})
+            deleted += len(keys)
+    return deleted
+
+
 # Example usage:
 if __name__ == "__main__":
     public_url = upload_to_r2("./images/image.jpg", "uploads/image.jpg")
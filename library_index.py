@@ -0,0 +1,299 @@
+"""
+Per-user library index for searching across all of a user's PDFs.
+
+The per-document indexes built at upload (bm25_index, vector_index) are
+merged into one file per user, users/{uid}/library.npz, holding every
+chunk of every PDF:
+
+    names, hashes         one row per PDF
+    chunk_doc, chunk_pos  PDF row and chunk number of each library chunk
+    chunk_page            first page of each chunk (0 = unknown)
+    text, text_offsets    all chunk texts as one UTF-8 buffer
+    terms ... lengths     merged BM25 postings over library chunk ids
+    vectors, model        stacked float16 embeddings (empty if unavailable)
+    vector_docs           per PDF row, whether its chunks have embeddings
+                          (rows of PDFs without them are zero in `vectors`)
+
+Adding or removing a PDF merges/filters the stored arrays; nothing is
+re-tokenised or re-embedded. Writes use the blob generation as a
+precondition so concurrent uploads by the same user don't lose updates.
+A query loads one file (cached per process while its generation is current).
+"""
+
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+import bm25_index
+import vector_index
+
+LIBRARY_VERSION = 1
+WRITE_RETRIES = 3
+READ_RETRIES = 3
+LIBRARY_CACHE_SIZE = 16
+
+
+def library_path(user_id):
+    return f'users/{user_id}/library.npz'
+
+
+class Library:
+    def __init__(self, names, hashes, chunk_doc, chunk_pos, chunk_page, text, text_offsets, bm25, vectors, model,
+                 vector_docs=None):
+        self.names = list(names)
+        self.hashes = list(hashes)
+        self.chunk_doc = chunk_doc
+        self.chunk_pos = chunk_pos
+        self.chunk_page = chunk_page
+        self.text = text
+        self.text_offsets = text_offsets
+        self.bm25 = bm25
+        self.vectors = vectors
+        self.model = model
+        if vector_docs is None:
+            vector_docs = np.full(len(self.names), vectors is not None, dtype=bool)
+        self.vector_docs = vector_docs
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], np.zeros(0, np.uint32), np.zeros(0, np.uint32), np.zeros(0, np.uint32),
+                   b"", np.zeros(1, np.uint64), bm25_index.build_index([]), None, "", np.zeros(0, bool))
+
+    @property
+    def chunk_count(self):
+        return len(self.chunk_doc)
+
+    def chunk_text(self, i):
+        return self.text[int(self.text_offsets[i]):int(self.text_offsets[i + 1])].decode('utf-8')
+
+    def search(self, query, query_vector=None, top_k=5, alpha=vector_index.HYBRID_ALPHA):
+        """
+        Top-k passages across every PDF: [{"pdf_name", "chunk", "page", "score", "text"}].
+        Uses BM25 alone, or blends in cosine similarity when a query vector is
+        given and the library has embeddings. Chunks of PDFs without embeddings
+        are ranked on their BM25 score alone.
+        """
+        scores = self.bm25.scores(query)
+        if query_vector is not None and self.vectors is not None and len(self.vectors) == self.chunk_count:
+            cosine = vector_index.VectorIndex(self.vectors, self.model).scores(query_vector)
+            missing = ~self.vector_docs[self.chunk_doc]
+            if missing.any():
+                peak = float(scores.max())
+                cosine[missing] = scores[missing] / peak if peak > 0 else 0.0
+            scores = vector_index.hybrid_scores(cosine, scores, alpha)
+        return [{
+            "pdf_name": self.names[self.chunk_doc[i]],
+            "chunk": int(self.chunk_pos[i]),
+            "page": int(self.chunk_page[i]) or None,
+            "score": round(score, 4),
+            "text": self.chunk_text(i)
+        } for i, score in vector_index.top_hits(scores, top_k) if score > 0]
+
+
+def _merge_bm25(a, b, offset):
+    """Postings of b (chunk ids shifted by offset) merged into a."""
+    merged = {}
+    for index, shift in ((a, 0), (b, offset)):
+        for row, term in enumerate(index.terms.tolist()):
+            start, end = index.offsets[row], index.offsets[row + 1]
+            merged.setdefault(term, []).append((index.docs[start:end] + shift, index.tfs[start:end]))
+    return _from_postings(merged, np.concatenate([a.lengths, b.lengths]))
+
+
+def _filter_bm25(index, keep):
+    """Drop chunks where keep is False and renumber the rest."""
+    new_ids = np.cumsum(keep, dtype=np.int64) - 1
+    merged = {}
+    for row, term in enumerate(index.terms.tolist()):
+        start, end = index.offsets[row], index.offsets[row + 1]
+        docs = index.docs[start:end]
+        mask = keep[docs]
+        if mask.any():
+            merged[term] = [(new_ids[docs[mask]].astype(np.uint32), index.tfs[start:end][mask])]
+    return _from_postings(merged, index.lengths[keep])
+
+
+def _from_postings(postings, lengths):
+    terms = sorted(postings)
+    docs = [np.concatenate([d for d, _ in postings[t]]).astype(np.uint32) for t in terms]
+    tfs = [np.concatenate([f for _, f in postings[t]]).astype(np.uint16) for t in terms]
+    offsets = np.zeros(len(terms) + 1, dtype=np.uint32)
+    if terms:
+        offsets[1:] = np.cumsum([len(d) for d in docs])
+    return bm25_index.Bm25Index(
+        np.array(terms, dtype=str), offsets,
+        np.concatenate(docs) if docs else np.zeros(0, np.uint32),
+        np.concatenate(tfs) if tfs else np.zeros(0, np.uint16),
+        lengths.astype(np.uint32)
+    )
+
+
+def _pack_texts(texts):
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    return b"".join(encoded), offsets
+
+
+def remove_document(library, pdf_name):
+    """Library without pdf_name (unchanged if it isn't there)."""
+    if pdf_name not in library.names:
+        return library
+    row = library.names.index(pdf_name)
+    keep = library.chunk_doc != row
+    doc_map = np.arange(len(library.names), dtype=np.int64)
+    doc_map[row + 1:] -= 1
+
+    kept_texts = [library.chunk_text(i) for i in np.flatnonzero(keep)]
+    text, text_offsets = _pack_texts(kept_texts)
+    vector_docs = np.delete(library.vector_docs, row)
+    vectors, model = library.vectors, library.model
+    if vectors is None or not vector_docs.any():
+        vectors, model = None, ""
+    else:
+        vectors = vectors[keep]
+    return Library(
+        library.names[:row] + library.names[row + 1:], library.hashes[:row] + library.hashes[row + 1:],
+        doc_map[library.chunk_doc[keep]].astype(np.uint32), library.chunk_pos[keep], library.chunk_page[keep],
+        text, text_offsets, _filter_bm25(library.bm25, keep), vectors, model, vector_docs
+    )
+
+
+def add_document(library, pdf_name, content_hash, chunks, bm25, vectors=None):
+    """
+    Library with pdf_name's chunks merged in (replacing an older copy).
+    bm25 / vectors are the document's own indexes from upload.
+    """
+    library = remove_document(library, pdf_name)
+    row = len(library.names)
+    base = library.chunk_count
+    count = len(chunks)
+
+    # A PDF without embeddings (or from another model) keeps zero rows marked
+    # missing, so the other PDFs keep theirs; it is re-embedded on re-upload
+    merged_vectors, model = library.vectors, library.model
+    has_vectors = vectors is not None and (merged_vectors is None or model == vectors.model)
+    if has_vectors and merged_vectors is None:
+        merged_vectors = np.zeros((base, vectors.vectors.shape[1]), np.float16)
+        model = vectors.model
+    if merged_vectors is not None:
+        rows = vectors.vectors if has_vectors else np.zeros((count, merged_vectors.shape[1]), np.float16)
+        merged_vectors = np.vstack([merged_vectors, rows])
+
+    texts = [library.chunk_text(i) for i in range(base)] + [chunk["text"] for chunk in chunks]
+    text, text_offsets = _pack_texts(texts)
+    return Library(
+        library.names + [pdf_name], library.hashes + [content_hash or ""],
+        np.concatenate([library.chunk_doc, np.full(count, row, np.uint32)]),
+        np.concatenate([library.chunk_pos, np.arange(count, dtype=np.uint32)]),
+        np.concatenate([library.chunk_page, np.array([chunk.get("page") or 0 for chunk in chunks], np.uint32)]),
+        text, text_offsets, _merge_bm25(library.bm25, bm25, base),
+        merged_vectors, model, np.append(library.vector_docs, has_vectors)
+    )
+
+
+def dumps(library):
+    buf = io.BytesIO()
+    vectors = library.vectors if library.vectors is not None else np.zeros((0, 0), np.float16)
+    np.savez_compressed(
+        buf, version=np.array([LIBRARY_VERSION]),
+        names=np.array(library.names, dtype=str), hashes=np.array(library.hashes, dtype=str),
+        chunk_doc=library.chunk_doc, chunk_pos=library.chunk_pos, chunk_page=library.chunk_page,
+        text=np.frombuffer(library.text, dtype=np.uint8), text_offsets=library.text_offsets,
+        terms=library.bm25.terms, offsets=library.bm25.offsets, docs=library.bm25.docs,
+        tfs=library.bm25.tfs, lengths=library.bm25.lengths,
+        vectors=vectors, model=np.array([library.model]), vector_docs=library.vector_docs
+    )
+    return buf.getvalue()
+
+
+def loads(data):
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        if int(npz["version"][0]) != LIBRARY_VERSION:
+            raise ValueError("Unsupported library index version")
+        bm25 = bm25_index.Bm25Index(npz["terms"], npz["offsets"], npz["docs"], npz["tfs"], npz["lengths"])
+        vectors = npz["vectors"] if npz["vectors"].size else None
+        # Libraries written before vector_docs only had vectors when every PDF did
+        vector_docs = npz["vector_docs"] if "vector_docs" in npz.files else None
+        return Library(
+            npz["names"].tolist(), npz["hashes"].tolist(), npz["chunk_doc"], npz["chunk_pos"],
+            npz["chunk_page"], npz["text"].tobytes(), npz["text_offsets"], bm25, vectors, str(npz["model"][0]),
+            vector_docs
+        )
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _remember(user_id, generation, library):
+    with _cache_lock:
+        _cache[user_id] = (generation, library)
+        _cache.move_to_end(user_id)
+        while len(_cache) > LIBRARY_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return library
+
+
+def load_library(bucket, user_id):
+    """
+    The user's library, or None if it hasn't been built yet. A cached copy is
+    reused while the stored blob's generation is unchanged; a blob rewritten
+    between reload and download is read again.
+    """
+    blob = bucket.blob(library_path(user_id))
+    for attempt in range(READ_RETRIES):
+        try:
+            blob.reload()
+        except NotFound:
+            return None
+
+        with _cache_lock:
+            cached = _cache.get(user_id)
+            if cached and cached[0] == blob.generation:
+                _cache.move_to_end(user_id)
+                return cached[1]
+
+        try:
+            data = blob.download_as_bytes(if_generation_match=blob.generation)
+        except PreconditionFailed:
+            continue  # rewritten since reload(), read the new generation
+        except NotFound:
+            return None
+        return _remember(user_id, blob.generation, loads(data))
+    raise RuntimeError(f"Could not read library of {user_id} after {READ_RETRIES} attempts")
+
+
+def update_library(bucket, user_id, change, create=True):
+    """
+    Apply change(library) -> library to the stored library and save it,
+    retrying if another request wrote it in between. Without create, a
+    missing library is left missing and None is returned.
+    """
+    blob = bucket.blob(library_path(user_id))
+    for attempt in range(WRITE_RETRIES):
+        try:
+            blob.reload()
+            generation = blob.generation
+            library = loads(blob.download_as_bytes(if_generation_match=generation))
+        except NotFound:
+            if not create:
+                return None
+            generation = 0  # only create if it still doesn't exist
+            library = Library.empty()
+        except PreconditionFailed:
+            print(f"⚠️ Library of {user_id} changed while reading, retrying ({attempt + 1}/{WRITE_RETRIES})")
+            continue
+
+        updated = change(library)
+        try:
+            blob.upload_from_string(dumps(updated), content_type="application/octet-stream",
+                                    if_generation_match=generation)
+        except PreconditionFailed:
+            print(f"⚠️ Library of {user_id} changed concurrently, retrying ({attempt + 1}/{WRITE_RETRIES})")
+            continue
+        return _remember(user_id, blob.generation, updated)
+    raise RuntimeError(f"Could not update library of {user_id} after {WRITE_RETRIES} attempts")
@@ -0,0 +1,168 @@
+"""
+Concurrent chat completions for multi-section generation.
+
+The note endpoints send one request per chunk. Issuing them one after another
+makes a full set of notes take the sum of every model latency; here they run
+on a bounded thread pool and come back in section order. A failed section is
+retried on its own, the sections that already finished are kept.
+
+stream_all is the token-streaming variant used for Server-Sent Events.
+"""
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+# Max in-flight model calls per request. Configure via env:
+#   LLM_CONCURRENCY    parallel calls per batch
+#   LLM_RETRIES        extra attempts for a failed section
+#   LLM_RETRY_BACKOFF  seconds before the first retry (doubles each time)
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', 5))
+LLM_RETRIES = int(os.environ.get('LLM_RETRIES', 2))
+LLM_RETRY_BACKOFF = float(os.environ.get('LLM_RETRY_BACKOFF', 1.0))
+
+
+def is_retryable(e):
+    """
+    Whether a failed call is worth retrying: rate limits, timeouts, dropped
+    connections and 5xx responses. Bad requests, auth errors and context
+    length errors fail the same way every time.
+    """
+    if isinstance(e, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+
+def complete(client, request, retries=LLM_RETRIES, backoff=LLM_RETRY_BACKOFF, label=""):
+    """
+    Run one chat completion (request = kwargs for chat.completions.create)
+    and return the message text, retrying transient errors (is_retryable)
+    with exponential backoff.
+    """
+    attempt = 0
+    while True:
+        try:
+            response = client.chat.completions.create(**request)
+            return response.choices[0].message.content
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            delay = backoff * (2 ** attempt)
+            attempt += 1
+            print(f"⚠️ {label or 'LLM call'} failed ({e}), retry {attempt}/{retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def complete_all(client, requests, concurrency=LLM_CONCURRENCY, retries=LLM_RETRIES, backoff=LLM_RETRY_BACKOFF,
+                 on_complete=None):
+    """
+    Run a list of chat completion requests concurrently and return their
+    texts in the same order. Raises the first error of a section that still
+    fails after its retries.
+
+    on_complete(i, text) is called from the worker thread as each section
+    finishes. When it is given, the remaining sections still run after a
+    failure, so their results are persisted for a retry.
+    """
+    if not requests:
+        return []
+
+    def run(i, request):
+        text = complete(client, request, retries, backoff, f"Section {i + 1}/{len(requests)}")
+        if on_complete:
+            on_complete(i, text)
+        return text
+
+    workers = max(1, min(concurrency, len(requests)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run, i, request) for i, request in enumerate(requests)]
+        try:
+            return [future.result() for future in futures]
+        except Exception:
+            if on_complete is None:
+                # Don't start sections nobody will read
+                for future in futures:
+                    future.cancel()
+            raise
+
+
+class StreamCancelled(Exception):
+    """The consumer went away; stop generating."""
+
+
+def _stream_section(client, index, request, events, cancelled, retries, backoff):
+    """Stream one section token by token onto the event queue."""
+    attempt = 0
+    while True:
+        parts = []
+        try:
+            stream = client.chat.completions.create(**request, stream=True)
+            try:
+                for chunk in stream:
+                    if cancelled.is_set():
+                        raise StreamCancelled()
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        events.put(("delta", index, delta))
+            finally:
+                close = getattr(stream, "close", None)
+                if close:
+                    close()
+            text = "".join(parts)
+            events.put(("section", index, text))
+            return text
+        except StreamCancelled:
+            return None
+        except Exception as e:
+            if attempt >= retries or cancelled.is_set() or not is_retryable(e):
+                events.put(("error", index, e))
+                return None
+            delay = backoff * (2 ** attempt)
+            attempt += 1
+            print(f"⚠️ Section {index + 1} stream failed ({e}), retry {attempt}/{retries} in {delay:.1f}s")
+            # Tell the consumer to drop the partial text it already got
+            events.put(("retry", index, None))
+            time.sleep(delay)
+
+
+def stream_all(client, requests, concurrency=LLM_CONCURRENCY, retries=LLM_RETRIES, backoff=LLM_RETRY_BACKOFF):
+    """
+    Generator version of complete_all using token-level streaming. Yields
+    (kind, index, value) events as they happen, from all sections at once:
+
+        ("delta", i, text)     next tokens of section i
+        ("retry", i, None)     section i failed mid-stream and restarts
+        ("section", i, text)   section i is complete
+
+    Raises the error of a section that fails after its retries. Closing the
+    generator (e.g. the HTTP client disconnected) stops every in-flight call.
+    """
+    if not requests:
+        return
+
+    events = queue.Queue()
+    cancelled = threading.Event()
+    workers = max(1, min(concurrency, len(requests)))
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for i, request in enumerate(requests):
+            pool.submit(_stream_section, client, i, request, events, cancelled, retries, backoff)
+
+        remaining = len(requests)
+        while remaining:
+            kind, index, value = events.get()
+            if kind == "error":
+                raise value
+            if kind == "section":
+                remaining -= 1
+            yield kind, index, value
+    finally:
+        cancelled.set()
+        pool.shutdown(wait=False, cancel_futures=True)
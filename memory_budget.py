@@ -0,0 +1,62 @@
+"""
+Process-wide memory budget for PDF ingestion.
+
+Each upload reserves an estimate of its peak memory before it is processed.
+If the reservation doesn't fit, the caller can downgrade (e.g. skip the
+process pool) or reject the upload instead of letting the VM run out of
+memory. Configure with UPLOAD_MEMORY_BUDGET_MB.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+BUDGET_BYTES = int(os.environ.get('UPLOAD_MEMORY_BUDGET_MB', 400)) * 1024 * 1024
+
+# Rough peak-memory model for a file-backed fitz document: MuPDF caches
+# decoded objects/fonts at a small multiple of the file size, plus a fixed
+# per-page cost for text extraction.
+FILE_SIZE_FACTOR = 2
+PER_PAGE_BYTES = 256 * 1024
+
+_reserved = 0
+_cond = threading.Condition()
+
+
+def estimate_ingest_bytes(file_size, page_count=0, workers=1):
+    """Estimated peak memory to ingest a file; each pool worker opens its own copy."""
+    return (file_size * FILE_SIZE_FACTOR + page_count * PER_PAGE_BYTES) * max(1, workers)
+
+
+def reserved_bytes():
+    return _reserved
+
+
+def try_reserve(nbytes, timeout=0):
+    """Reserve nbytes, waiting up to `timeout` seconds. Returns True if granted."""
+    global _reserved
+    if nbytes > BUDGET_BYTES:
+        return False
+    with _cond:
+        if not _cond.wait_for(lambda: _reserved + nbytes <= BUDGET_BYTES, timeout=timeout):
+            return False
+        _reserved += nbytes
+        return True
+
+
+def release(nbytes):
+    global _reserved
+    with _cond:
+        _reserved = max(0, _reserved - nbytes)
+        _cond.notify_all()
+
+
+@contextmanager
+def reservation(nbytes, timeout=0):
+    """Context manager yielding whether the reservation was granted."""
+    granted = try_reserve(nbytes, timeout)
+    try:
+        yield granted
+    finally:
+        if granted:
+            release(nbytes)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+One-off migration: give older inline PDF documents (base64 page images in
+`images`, no contentHash) a payload-free `imageMeta` copy, so
+/api/pdf-image-count can list their images without reading the pages.
+Documents that already have imageMeta are skipped, so it is safe to re-run.
+
+Uses the same environment as app.py (FIREBASE_SERVICE_ACCOUNT_JSON etc.).
+
+Usage: python migrate_image_meta.py [--dry-run]
+"""
+
+import sys
+
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+
+from app import db
+
+
+def migrate(dry_run=False):
+    scanned = migrated = 0
+    for doc in db.collection_group('pdfs').select(["contentHash", "imageMeta"]).stream():
+        scanned += 1
+        fields = doc.to_dict()
+        if fields.get("contentHash") or "imageMeta" in fields:
+            continue
+
+        snapshot = doc.reference.get(field_paths=["images"])
+        images = [{k: v for k, v in img.items() if k != "data"}
+                  for img in (snapshot.to_dict() or {}).get("images", [])]
+        print(f"🖼️ {doc.reference.path}: {len(images)} images")
+        if dry_run:
+            continue
+        try:
+            doc.reference.update({"imageMeta": images, "updatedAt": firestore.SERVER_TIMESTAMP})
+            migrated += 1
+        except NotFound:
+            print(f"⚠️ {doc.reference.path} was deleted, skipping")
+
+    print(f"✅ Scanned {scanned} PDFs, migrated {migrated}")
+
+
+if __name__ == "__main__":
+    migrate(dry_run="--dry-run" in sys.argv[1:])
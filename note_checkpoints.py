@@ -0,0 +1,172 @@
+"""
+Per-section checkpoints for note generation.
+
+Every generate/regenerate request runs under a generation ID. Each finished
+section is written to Firestore as soon as it completes:
+
+    users/{uid}/noteGenerations/{generation_id}              request + status
+    users/{uid}/noteGenerations/{generation_id}/sections/{i} section text
+
+If the request fails part way, the client retries with the same
+generation_id and only the missing sections are generated. A checkpoint is
+only reused if its section key (hash of the exact prompt) still matches, so
+a changed document or prompt can't splice in stale text.
+
+A retry skips the usage charge only if it is for the same PDF, level and
+mode and the generation failed, or is still "running" but its heartbeat
+(updatedAt, bumped with every checkpoint) is older than
+NOTE_GENERATION_STALE_SECONDS (the worker died). A streamed generation whose
+client disconnects is marked failed right away (run_generation).
+"""
+
+import os
+import uuid
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+GENERATIONS_COLLECTION = 'noteGenerations'
+SECTIONS_COLLECTION = 'sections'
+
+# A running generation without a checkpoint for this long is treated as abandoned
+NOTE_GENERATION_STALE_SECONDS = int(os.environ.get('NOTE_GENERATION_STALE_SECONDS', 300))
+
+
+def new_generation_id():
+    return uuid.uuid4().hex
+
+
+def _generation_ref(db, user_id, generation_id):
+    return db.collection('users').document(user_id).collection(GENERATIONS_COLLECTION).document(generation_id)
+
+
+def load_generation(db, user_id, generation_id):
+    """Return the generation record, or None."""
+    if not generation_id:
+        return None
+    doc = _generation_ref(db, user_id, generation_id).get()
+    return doc.to_dict() if doc.exists else None
+
+
+def same_request(generation, pdf_name, level, mode):
+    """True if a generation record was started for this PDF, level and mode."""
+    return (generation.get("pdfName"), generation.get("level"), generation.get("mode")) == (pdf_name, level, mode)
+
+
+def is_stale(generation, now=None):
+    """True if a running generation hasn't checkpointed for NOTE_GENERATION_STALE_SECONDS."""
+    heartbeat = generation.get("updatedAt")
+    if heartbeat is None:
+        return True
+    now = now or datetime.now(timezone.utc)
+    return (now - heartbeat).total_seconds() > NOTE_GENERATION_STALE_SECONDS
+
+
+def is_resumable(generation, now=None):
+    """True for a generation that failed or was abandoned while running."""
+    status = generation.get("status")
+    return status == "failed" or (status == "running" and is_stale(generation, now))
+
+
+def retry_decision(generation, pdf_name, level, mode, now=None):
+    """
+    How to treat a request that names an existing generation record
+    (None if the ID is unknown):
+        "unknown"  no such generation, or it was for another PDF/level/mode
+        "running"  still running with a live heartbeat
+        "resume"   failed or abandoned: resume without charging again
+        "charge"   completed: a new run, charged as usual
+    """
+    if generation is None or not same_request(generation, pdf_name, level, mode):
+        return "unknown"
+    if is_resumable(generation, now):
+        return "resume"
+    if generation.get("status") == "running":
+        return "running"
+    return "charge"
+
+
+def start_generation(db, user_id, generation_id, pdf_name, level, mode):
+    """Create the generation record, or mark an existing one as running again."""
+    ref = _generation_ref(db, user_id, generation_id)
+    ref.set({
+        "pdfName": pdf_name,
+        "level": level,
+        "mode": mode,
+        "status": "running",
+        "updatedAt": firestore.SERVER_TIMESTAMP
+    }, merge=True)
+
+
+def load_checkpoints(db, user_id, generation_id, pdf_name, level, mode):
+    """
+    {section index: {"key", "text"}} saved for a generation, or {} if it
+    doesn't exist or was for a different PDF, level or mode.
+    """
+    generation = load_generation(db, user_id, generation_id)
+    if generation is None:
+        return {}
+    if not same_request(generation, pdf_name, level, mode):
+        print(f"⚠️ Generation {generation_id} is for a different request, starting over")
+        return {}
+
+    sections = _generation_ref(db, user_id, generation_id).collection(SECTIONS_COLLECTION).stream()
+    return {int(doc.id): doc.to_dict() for doc in sections}
+
+
+def save_checkpoint(db, user_id, generation_id, index, key, text):
+    """Persist one finished section and bump the generation's heartbeat."""
+    ref = _generation_ref(db, user_id, generation_id)
+    batch = db.batch()
+    batch.set(ref.collection(SECTIONS_COLLECTION).document(str(index)), {
+        "key": key,
+        "text": text,
+        "savedAt": firestore.SERVER_TIMESTAMP
+    })
+    batch.update(ref, {"updatedAt": firestore.SERVER_TIMESTAMP})
+    batch.commit()
+
+
+def fail_generation(db, user_id, generation_id, error):
+    _generation_ref(db, user_id, generation_id).set({
+        "status": "failed",
+        "error": str(error),
+        "updatedAt": firestore.SERVER_TIMESTAMP
+    }, merge=True)
+
+
+def finish_generation(db, user_id, generation_id):
+    """Mark a generation complete and drop its section checkpoints."""
+    ref = _generation_ref(db, user_id, generation_id)
+    for doc in ref.collection(SECTIONS_COLLECTION).stream():
+        doc.reference.delete()
+    ref.set({"status": "complete", "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
+
+
+def run_generation(db, user_id, generation_id, steps):
+    """
+    Pass on the (event, payload) pairs of a streamed generation and keep its
+    status in step with how it ended: complete just before the "done" event,
+    failed if steps raises (an "error" event is sent instead) or if the
+    consumer stops reading first, e.g. the client disconnected.
+    """
+    ended = False
+    try:
+        for event, payload in steps:
+            if event == "done":
+                finish_generation(db, user_id, generation_id)
+                ended = True
+            yield event, payload
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        ended = True
+        fail_generation(db, user_id, generation_id, e)
+        yield "error", {"error": f"Server error: {str(e)}", "generation_id": generation_id, "resumable": True}
+    finally:
+        steps.close()  # cancels in-flight sections
+        if not ended:
+            try:
+                fail_generation(db, user_id, generation_id, "client disconnected")
+            except Exception as e:
+                print(f"⚠️ Could not mark generation {generation_id} as failed ({e})")
@@ -0,0 +1,102 @@
+"""
+Persistent cache of generated note sections.
+
+A section is stored under a key derived from everything that determines the
+model output (see notes_pipeline.section_cache_key), so regenerating notes
+for an unchanged document at the same level is served from disk instead of
+re-paying for every chunk.
+
+Entries live in a small SQLite file next to the other local data. The cache
+is bounded by NOTES_CACHE_MAX_MB; the least recently used entries are evicted
+first. Hit/miss counters are kept per process and reported by stats().
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+NOTES_CACHE_PATH = os.environ.get(
+    'NOTES_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'notes_cache.sqlite3')
+)
+NOTES_CACHE_MAX_BYTES = int(float(os.environ.get('NOTES_CACHE_MAX_MB', 64)) * 1024 * 1024)
+
+_lock = threading.Lock()
+_conn = None
+_counters = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+
+def _connection():
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(NOTES_CACHE_PATH), exist_ok=True)
+        _conn = sqlite3.connect(NOTES_CACHE_PATH, check_same_thread=False)
+        _conn.execute("""CREATE TABLE IF NOT EXISTS sections (
+            key TEXT PRIMARY KEY,
+            content TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            last_used REAL NOT NULL
+        )""")
+        _conn.execute("CREATE INDEX IF NOT EXISTS sections_last_used ON sections (last_used)")
+        _conn.commit()
+    return _conn
+
+
+def get(key):
+    """Return the cached section text for a key, or None."""
+    with _lock:
+        conn = _connection()
+        row = conn.execute("SELECT content FROM sections WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            _counters["misses"] += 1
+            return None
+        conn.execute("UPDATE sections SET last_used = ? WHERE key = ?", (time.time(), key))
+        conn.commit()
+        _counters["hits"] += 1
+        return row[0]
+
+
+def _evict(conn, max_bytes):
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM sections").fetchone()[0]
+    while total > max_bytes:
+        row = conn.execute("SELECT key, size FROM sections ORDER BY last_used LIMIT 1").fetchone()
+        if row is None:
+            break
+        conn.execute("DELETE FROM sections WHERE key = ?", (row[0],))
+        total -= row[1]
+        _counters["evictions"] += 1
+
+
+def put(key, text, max_bytes=None):
+    """Store a section, evicting least recently used entries over the size limit."""
+    if max_bytes is None:
+        max_bytes = NOTES_CACHE_MAX_BYTES
+    size = len(text.encode('utf-8'))
+    if size > max_bytes:
+        return
+    with _lock:
+        conn = _connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO sections (key, content, size, last_used) VALUES (?, ?, ?, ?)",
+            (key, text, size, time.time())
+        )
+        _evict(conn, max_bytes)
+        conn.commit()
+        _counters["writes"] += 1
+
+
+def stats():
+    """Counters since process start plus the current size of the cache."""
+    with _lock:
+        entries, size = _connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sections"
+        ).fetchone()
+        lookups = _counters["hits"] + _counters["misses"]
+        return {
+            **_counters,
+            "hit_rate": round(_counters["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": NOTES_CACHE_MAX_BYTES
+        }
@@ -0,0 +1,442 @@
+"""
+Notes generation pipeline shared by /api/generate-notes,
+/api/regenerate-notes and /api/regenerate-sections.
+
+build_sections turns a PDF's stored chunks and image metadata into one model
+request per section (section packing, image placement, prompts). Documents
+with more than MAX_CHUNKS sections are condensed with a map-reduce pass
+first, so the notes cover all of the content; the older evenly spaced
+sampling is only used when the caller asks for quick notes.
+
+Notes are stored as addressable sections (note_sections): an ID, the chunk
+range it covers, its image refs and its text, plus a fingerprint of the
+chunks they were built from (chunks_fingerprint). rebuild_sections recreates
+the requests for chosen sections so they can be regenerated on their own.
+
+generate_sections and stream_sections run the requests through llm_batch,
+reusing sections checkpointed by an earlier attempt (note_checkpoints) and,
+where the mode allows it, unchanged sections from notes_cache.
+
+Bump PROMPT_VERSION whenever a prompt template changes so cached sections
+produced by the old prompt are no longer used.
+"""
+
+import os
+import hashlib
+import json
+
+import notes_cache
+from chunker import estimate_tokens
+from llm_batch import complete_all, stream_all
+
+PROMPT_VERSION = 1
+MODEL = "gpt-3.5-turbo"
+MAX_TOKENS = 4096
+
+# Stored chunks are packed into sections of about this many tokens
+SECTION_TOKENS = int(os.environ.get('NOTES_SECTION_TOKENS', 1000))
+MAX_CHUNKS = 15
+
+# Map-reduce over long documents. Configure via env:
+#   NOTES_MAP_MAX_CHUNKS     max map calls for the first level
+#   NOTES_MAP_CONCURRENCY    parallel map calls
+#   NOTES_REDUCE_TOKENS      condensed input per final section
+MAX_MAP_CHUNKS = int(os.environ.get('NOTES_MAP_MAX_CHUNKS', 60))
+MAP_UNIT_MAX_TOKENS = 6000
+MAP_MAX_TOKENS = 500
+MAP_CONCURRENCY = int(os.environ.get('NOTES_MAP_CONCURRENCY', 10))
+REDUCE_INPUT_TOKENS = int(os.environ.get('NOTES_REDUCE_TOKENS', 3000))
+MAX_REDUCE_LEVELS = 3
+
+MAP_PROMPT = """Condense this part of a document for a student's study notes.
+Keep every key concept, definition, formula, date, name and example; drop filler.
+Reply with dense bullet points only."""
+
+# Per-mode prompts. "cached" modes reuse earlier output for identical
+# sections; regeneration asks for different notes, so it always calls the model.
+# "map" is the condensing stage for long documents (see map_reduce).
+MODES = {
+    "map": {"temperature": 0.2, "cached": True},
+    "generate": {
+        "temperature": 0.7,
+        "cached": True,
+        "level_instructions": {
+            "beginner": "Create SIMPLE and EASY-TO-UNDERSTAND notes.",
+            "intermediate": "Create DETAILED and COMPREHENSIVE notes.",
+            "advanced": "Create DEEP and ANALYTICAL notes."
+        },
+        "system": "You are an expert educational note-taking assistant.\n{instructions}",
+        "images": "\nUse images: {refs}",
+        "section": """
+Write detailed study notes ({level} level).
+Section {number}/{total}.
+{images}
+
+CONTENT:
+{chunk}
+"""
+    },
+    "regenerate": {
+        "temperature": 0.8,
+        "cached": False,
+        "level_instructions": {
+            "beginner": "Create SIMPLE notes with a DIFFERENT approach than before.",
+            "intermediate": "Create DETAILED notes using a DIFFERENT structure.",
+            "advanced": "Create DIFFERENT DEEP and ANALYTICAL notes."
+        },
+        "system": """You are an expert educational note-taking assistant.
+Write COMPLETELY DIFFERENT, ALTERNATIVE study notes.
+
+{instructions}
+
+Write in NATURAL FLOWING PARAGRAPHS.
+Use headings (##, ###). No glossary format.""",
+        "images": "\nIMAGES: {refs}",
+        "section": """Write COMPLETELY DIFFERENT study notes.
+Section {number} of {total}.
+{images}
+
+CONTENT:
+{chunk}"""
+    }
+}
+
+
+def sample_pieces(pieces):
+    """Quick mode: keep an evenly spaced sample of MAX_CHUNKS pieces."""
+    if len(pieces) <= MAX_CHUNKS:
+        return pieces
+    step = len(pieces) / MAX_CHUNKS
+    return [pieces[int(i * step)] for i in range(MAX_CHUNKS)]
+
+
+def _condense(client, pieces):
+    """
+    Map stage: condense every piece concurrently (cached). A piece is
+    (text, first_chunk, last_chunk) over the original chunk positions.
+    """
+    keys = [section_cache_key(text, "map", "map") for text, _, _ in pieces]
+    texts = {}
+    for i, key in enumerate(keys):
+        cached = notes_cache.get(key)
+        if cached is not None:
+            texts[i] = cached
+
+    missing = [i for i in range(len(pieces)) if i not in texts]
+    requests = [{
+        "model": MODEL,
+        "messages": [
+            {"role": "system", "content": MAP_PROMPT},
+            {"role": "user", "content": pieces[i][0]}
+        ],
+        "temperature": MODES["map"]["temperature"],
+        "max_tokens": MAP_MAX_TOKENS
+    } for i in missing]
+    for i, text in zip(missing, complete_all(client, requests, concurrency=MAP_CONCURRENCY)):
+        texts[i] = text
+        notes_cache.put(keys[i], text)
+
+    return [(texts[i], first, last) for i, (_, first, last) in enumerate(pieces)]
+
+
+def chunk_tokens(chunk):
+    return chunk.get("tokens") or estimate_tokens(chunk["text"])
+
+
+def _chunk_pieces(chunks):
+    return [(chunk["text"], i, i) for i, chunk in enumerate(chunks)]
+
+
+def _pack(pieces, budget):
+    """Group consecutive pieces so each group stays within a token budget."""
+    groups, current, size = [], [], 0
+    for piece in pieces:
+        tokens = estimate_tokens(piece[0])
+        if current and size + tokens > budget:
+            groups.append(current)
+            current, size = [], 0
+        current.append(piece)
+        size += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _split_evenly(pieces, count):
+    """Group consecutive pieces into at most `count` groups of similar length."""
+    step = len(pieces) / count
+    bounds = sorted({int(i * step) for i in range(count)} | {len(pieces)})
+    return [pieces[a:b] for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def _merge(group):
+    return ("\n\n".join(text for text, _, _ in group), group[0][1], group[-1][2])
+
+
+def _map_units(chunks):
+    """First-level map inputs. Large documents use bigger units so the number of calls stays bounded."""
+    total = sum(chunk_tokens(chunk) for chunk in chunks)
+    budget = min(max(SECTION_TOKENS, -(-total // MAX_MAP_CHUNKS)), MAP_UNIT_MAX_TOKENS)
+    return [_merge(group) for group in _pack(_chunk_pieces(chunks), budget)]
+
+
+def map_reduce(client, chunks):
+    """
+    Cover the whole document in at most MAX_CHUNKS sections. Every chunk is
+    condensed (map), consecutive condensed chunks are packed into sections
+    of up to REDUCE_INPUT_TOKENS (reduce), and if that still leaves too many
+    sections the packed groups are condensed again.
+
+    Returns [(section text, first_chunk, last_chunk)].
+    """
+    units = _map_units(chunks)
+    pieces = _condense(client, units)
+
+    groups = _pack(pieces, REDUCE_INPUT_TOKENS)
+    level = 1
+    while len(groups) > MAX_CHUNKS:
+        level += 1
+        print(f"🗜️ {len(groups)} groups over budget, condensing again (level {level})")
+        pieces = _condense(client, [_merge(group) for group in groups])
+        packed = _pack(pieces, REDUCE_INPUT_TOKENS)
+        if len(packed) >= len(groups) or level >= MAX_REDUCE_LEVELS:
+            # Budget too small to make progress: split evenly instead
+            groups = _split_evenly(pieces, MAX_CHUNKS)
+            break
+        groups = packed
+
+    print(f"🗜️ Map-reduce: {len(chunks)} chunks, {len(units)} map calls -> {len(groups)} sections")
+    return [_merge(group) for group in groups]
+
+
+def range_content(client, chunks, first, last):
+    """
+    Section input for chunks[first..last]: the text itself for a normal
+    section, or its condensed form for a map-reduced one (the map stage is
+    cached, so this normally makes no model calls).
+    """
+    pieces = _chunk_pieces(chunks)[first:last + 1]
+    if first == last or sum(chunk_tokens(chunk) for chunk in chunks[first:last + 1]) <= SECTION_TOKENS:
+        return _merge(pieces)[0]
+
+    units = [unit for unit in _map_units(chunks) if first <= unit[1] and unit[2] <= last]
+    pieces = _condense(client, units)
+    for _ in range(MAX_REDUCE_LEVELS - 1):
+        groups = _pack(pieces, REDUCE_INPUT_TOKENS)
+        if len(groups) <= 1:
+            break
+        pieces = _condense(client, [_merge(group) for group in groups])
+    return _merge(pieces)[0]
+
+
+def section_id(first, last):
+    """Stable ID of a section: the chunk range it covers."""
+    return f"c{first}-{last}"
+
+
+def assign_images(images, ranges, chunks):
+    """
+    Give each section the images of the pages its chunks span (ranges of
+    (first_chunk, last_chunk)). Without page numbers (legacy PDFs) images are
+    spread evenly over the chunks instead. Near-duplicate images are
+    referenced once, by their canonical index. Returns one list per section.
+    """
+    total = len(images)
+    paged = all(chunk.get("page") for chunk in chunks) and all("page" in image for image in images)
+    used = set()
+    per_section = []
+    for first, last in ranges:
+        if paged:
+            low, high = chunks[first]["page"], chunks[last]["endPage"]
+            candidates = [i for i, image in enumerate(images) if low <= image["page"] <= high]
+        else:
+            images_per_chunk = total / len(chunks)
+            candidates = range(int(first * images_per_chunk), min(int((last + 1) * images_per_chunk), total))
+        refs = []
+        for i in candidates:
+            canonical = images[i].get("alias_of", i)
+            if canonical not in used:
+                used.add(canonical)
+                refs.append(canonical)
+        per_section.append(refs)
+    return per_section
+
+
+def section_cache_key(section_message, level, mode):
+    """Cache key: (section text hash, level, model, prompt version, temperature mode)."""
+    section_hash = hashlib.sha256(section_message.encode('utf-8')).hexdigest()
+    spec = MODES[mode]
+    key = json.dumps([section_hash, level, MODEL, PROMPT_VERSION, mode, spec["temperature"]])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def build_sections(client, chunks, images, level, mode="generate", quick=False):
+    """
+    One entry per section: {"id", "index", "chunks", "images", "request", "key", "cached"}.
+    id is the section's stable ID (section_id), chunks is the (first, last) range of stored chunks the section covers,
+    request is the kwargs for client.chat.completions.create, key identifies
+    the exact prompt (cache and checkpoint key) and cached says whether the
+    mode may reuse cached output.
+
+    `chunks` are the PDF's stored chunks (see chunker.stored_chunks), packed
+    into sections of about SECTION_TOKENS. Documents with more than
+    MAX_CHUNKS sections are map-reduced so every chunk is covered;
+    quick=True instead samples MAX_CHUNKS sections without extra calls.
+    """
+    spec, system_prompt = _prompts(level, mode)
+
+    pieces = [_merge(group) for group in _pack(_chunk_pieces(chunks), SECTION_TOKENS)]
+    if len(pieces) > MAX_CHUNKS:
+        pieces = sample_pieces(pieces) if quick else map_reduce(client, chunks)
+    image_refs = assign_images(images, [(first, last) for _, first, last in pieces], chunks)
+
+    return [
+        _section(spec, system_prompt, level, mode, idx, len(pieces), content, first, last, image_refs[idx])
+        for idx, (content, first, last) in enumerate(pieces)
+    ]
+
+
+def _prompts(level, mode):
+    spec = MODES[mode]
+    instructions = spec["level_instructions"].get(level, spec["level_instructions"]["beginner"])
+    return spec, spec["system"].format(instructions=instructions)
+
+
+def _section(spec, system_prompt, level, mode, idx, total, content, first, last, refs):
+    img_instruction = spec["images"].format(refs=", ".join(f"[PDF_IMG:{i}]" for i in refs)) if refs else ""
+    message = spec["section"].format(
+        level=level, number=idx + 1, total=total, images=img_instruction, chunk=content
+    )
+    return {
+        "id": section_id(first, last),
+        "index": idx,
+        "chunks": [first, last],
+        "images": refs,
+        "request": {
+            "model": MODEL,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": message}
+            ],
+            "temperature": spec["temperature"],
+            "max_tokens": MAX_TOKENS
+        },
+        "key": section_cache_key(message, level, mode),
+        "cached": spec["cached"]
+    }
+
+
+def rebuild_sections(client, chunks, note_sections, section_ids, level, mode="regenerate"):
+    """
+    Sections for just the stored note sections listed in section_ids, rebuilt
+    from their chunk ranges and image refs. Index and total match the stored
+    notes so the prompts read the same as a full run.
+    """
+    spec, system_prompt = _prompts(level, mode)
+    total = len(note_sections)
+    sections = []
+    for idx, stored in enumerate(note_sections):
+        if stored["id"] not in section_ids:
+            continue
+        first, last = stored["chunks"]
+        content = range_content(client, chunks, first, last)
+        sections.append(_section(spec, system_prompt, level, mode, idx, total, content, first, last,
+                                 stored.get("images", [])))
+    return sections
+
+
+def chunks_fingerprint(chunks):
+    """Hash of the chunk texts notes were built from, stored with their sections."""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk["text"].encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def notes_stale(note_sections, chunks, chunks_hash):
+    """
+    Whether stored note sections no longer match the PDF's chunks, so their
+    chunk ranges can't be regenerated one by one. Notes saved before the
+    fingerprint (no chunks_hash) can only be checked against the chunk count.
+    """
+    if chunks_hash:
+        return chunks_hash != chunks_fingerprint(chunks)
+    return bool(note_sections) and note_sections[-1]["chunks"][1] >= len(chunks)
+
+
+def note_sections(sections, texts):
+    """Addressable sections stored with the notes (see rebuild_sections)."""
+    return [{
+        "id": section["id"],
+        "chunks": section["chunks"],
+        "images": section["images"],
+        "content": text
+    } for section, text in zip(sections, texts)]
+
+
+def _reusable(sections, done):
+    """
+    {section index: text} for sections that don't need the model: a
+    checkpoint from an earlier attempt with the same key, or a cache hit.
+    """
+    found = {}
+    for section in sections:
+        checkpoint = (done or {}).get(section["index"])
+        if checkpoint and checkpoint.get("key") == section["key"]:
+            found[section["index"]] = checkpoint["text"]
+        elif section["cached"]:
+            text = notes_cache.get(section["key"])
+            if text is not None:
+                found[section["index"]] = text
+    return found
+
+
+def _finished(section, text, on_section):
+    if section["cached"]:
+        notes_cache.put(section["key"], text)
+    if on_section:
+        on_section(section, text)
+
+
+def generate_sections(client, sections, done=None, on_section=None):
+    """
+    Return the text of every section in order. The model is only called for
+    sections without a matching checkpoint in `done` ({index: {"key", "text"}})
+    or a cache hit. on_section(section, text) is called as each generated
+    section finishes (used for checkpointing).
+    """
+    texts = _reusable(sections, done)
+    missing = [section for section in sections if section["index"] not in texts]
+    if texts:
+        print(f"♻️ {len(texts)}/{len(sections)} sections reused from checkpoints/cache")
+
+    results = complete_all(
+        client, [section["request"] for section in missing],
+        on_complete=lambda i, text: _finished(missing[i], text, on_section)
+    )
+    for section, text in zip(missing, results):
+        texts[section["index"]] = text
+    return [texts[section["index"]] for section in sections]
+
+
+def stream_sections(client, sections, done=None, on_section=None):
+    """
+    Streaming counterpart of generate_sections, yielding llm_batch.stream_all
+    events with section indices. Reused sections are yielded first as
+    complete "section" events.
+    """
+    reused = _reusable(sections, done)
+    for index, text in reused.items():
+        yield "section", index, text
+
+    missing = [section for section in sections if section["index"] not in reused]
+    events = stream_all(client, [section["request"] for section in missing])
+    try:
+        for kind, i, value in events:
+            section = missing[i]
+            if kind == "section":
+                _finished(section, value, on_section)
+            yield kind, section["index"], value
+    finally:
+        events.close()
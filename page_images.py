@@ -0,0 +1,221 @@
+"""
+Page image storage for uploaded PDFs.
+
+Rendered pages live as separate blobs in the Storage bucket instead of
+base64 strings inside the Firestore PDF document. Uploads only record which
+pages are worth rendering; a page is rendered the first time it is requested
+and the blob is reused from then on.
+
+Each page is stored in several size variants (see PAGE_IMAGE_VARIANTS):
+a small thumbnail, a display-size WebP/JPEG and optionally a lossless
+full-resolution PNG. All variants are encoded from a single render.
+
+Served images are kept in a byte-bounded per-process LRU together with a
+strong ETag (hash of the bytes), so repeated requests neither hit Storage
+nor re-decode inline base64 pages.
+"""
+
+import io
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+from google.api_core.exceptions import NotFound
+
+from pdf_ingest import render_page_image
+
+EXT_TO_MIME = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "gif": "image/gif",
+    "bmp": "image/bmp",
+    "tiff": "image/tiff",
+    "webp": "image/webp"
+}
+
+# Pillow format names for the encodings we produce
+PIL_FORMATS = {"png": "PNG", "jpg": "JPEG", "webp": "WEBP"}
+
+# Size variants produced for every rendered page. Configure via env:
+#   PAGE_IMAGE_FORMAT   webp | jpg      (thumb + display variants)
+#   PAGE_IMAGE_QUALITY  1-100           (display variant)
+#   PAGE_IMAGE_DPI      display DPI
+#   PAGE_THUMB_WIDTH    thumbnail width in px
+#   PAGE_IMAGE_FULL     1 to also keep a lossless PNG at PAGE_FULL_DPI
+PAGE_IMAGE_VARIANTS = {
+    "thumb": {
+        "format": os.environ.get('PAGE_IMAGE_FORMAT', 'webp'),
+        "quality": 60,
+        "max_width": int(os.environ.get('PAGE_THUMB_WIDTH', 240))
+    },
+    "display": {
+        "format": os.environ.get('PAGE_IMAGE_FORMAT', 'webp'),
+        "quality": int(os.environ.get('PAGE_IMAGE_QUALITY', 80)),
+        "dpi": int(os.environ.get('PAGE_IMAGE_DPI', 110))
+    }
+}
+if os.environ.get('PAGE_IMAGE_FULL', '0') == '1':
+    PAGE_IMAGE_VARIANTS["full"] = {
+        "format": "png",
+        "dpi": int(os.environ.get('PAGE_FULL_DPI', 144))
+    }
+
+DEFAULT_SIZE = "display"
+
+# Decoded image bytes kept per process
+PAGE_IMAGE_CACHE_BYTES = int(float(os.environ.get('PAGE_IMAGE_CACHE_MB', 32)) * 1024 * 1024)
+
+_cache = OrderedDict()  # key -> (bytes, mime, etag)
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+
+def resolve_size(size):
+    """Map a requested size to a configured variant (unknown/disabled -> display)."""
+    if size in PAGE_IMAGE_VARIANTS:
+        return size
+    return DEFAULT_SIZE
+
+
+def variant_mime(size):
+    return EXT_TO_MIME[PAGE_IMAGE_VARIANTS[size]["format"]]
+
+
+def legacy_page_prefix(user_id, pdf_name):
+    """Page image prefix for PDFs uploaded before content-addressed storage."""
+    return f'users/{user_id}/pdf_pages/{pdf_name}/'
+
+
+def page_image_path(prefix, page, size):
+    """Storage path of a rendered page variant under a page prefix."""
+    ext = PAGE_IMAGE_VARIANTS[size]["format"]
+    return f'{prefix}{page}-{size}.{ext}'
+
+
+def render_dpi():
+    """DPI the page is rendered at - the highest any variant needs."""
+    return max(spec.get("dpi", 0) for spec in PAGE_IMAGE_VARIANTS.values())
+
+
+def variant_dimensions(width, height, dpi, size=DEFAULT_SIZE):
+    """(width, height) of a variant encoded from a width x height render at `dpi`."""
+    spec = PAGE_IMAGE_VARIANTS[resolve_size(size)]
+    if "max_width" in spec and width > spec["max_width"]:
+        return spec["max_width"], round(height * spec["max_width"] / width)
+    if spec.get("dpi", dpi) < dpi:
+        scale = spec["dpi"] / dpi
+        return round(width * scale), round(height * scale)
+    return width, height
+
+
+def encode_variants(image, dpi):
+    """Encode a page rendered at `dpi` (PIL image) into every variant."""
+    variants = {}
+    for size, spec in PAGE_IMAGE_VARIANTS.items():
+        variant = image
+        dimensions = variant_dimensions(image.width, image.height, dpi, size)
+        if dimensions != image.size:
+            variant = image.resize(dimensions)
+
+        buf = io.BytesIO()
+        if "quality" in spec:
+            variant.save(buf, PIL_FORMATS[spec["format"]], quality=spec["quality"])
+        else:
+            variant.save(buf, PIL_FORMATS[spec["format"]], optimize=True)
+        variants[size] = buf.getvalue()
+    return variants
+
+
+def render_variants(bucket, storage_path, prefix, page, clip=None):
+    """Render a page (or its clip region) once, store every variant and return {size: bytes}."""
+    dpi = render_dpi()
+
+    # Spool the PDF to disk so only the requested page is loaded into memory
+    fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        bucket.blob(storage_path).download_to_filename(pdf_path)
+        image = render_page_image(pdf_path, page, dpi, clip)
+    finally:
+        os.remove(pdf_path)
+
+    variants = encode_variants(image, dpi)
+    for size, data in variants.items():
+        bucket.blob(page_image_path(prefix, page, size)).upload_from_string(data, content_type=variant_mime(size))
+    return variants
+
+
+def image_etag(data):
+    """Strong ETag value for image bytes."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def cached_image(key):
+    """(bytes, mime, etag) cached under key, or None."""
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+        return entry
+
+
+def remember_image(key, data, mime):
+    """Cache decoded image bytes under key; returns (bytes, mime, etag)."""
+    global _cache_bytes
+    entry = (data, mime, image_etag(data))
+    if len(data) > PAGE_IMAGE_CACHE_BYTES:
+        return entry
+    with _cache_lock:
+        if key in _cache:
+            _cache_bytes -= len(_cache.pop(key)[0])
+        _cache[key] = entry
+        _cache_bytes += len(data)
+        while _cache_bytes > PAGE_IMAGE_CACHE_BYTES:
+            _, (evicted, _, _) = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted)
+    return entry
+
+
+def image_response(data, mime, etag, cache_control):
+    """Image response with a strong ETag; answers If-None-Match (304) and Range (206) requests."""
+    response = Response(data, mimetype=mime)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+
+def load_page_image(bucket, storage_path, prefix, page, size=DEFAULT_SIZE, clip=None):
+    """
+    Return (bytes, mime, etag) for a page variant, rendering and persisting
+    all variants of the page on first request.
+
+    storage_path - path of the original PDF in the bucket
+    prefix       - page image prefix the variants are stored under
+    page         - 1-based page number
+    size         - thumb | display | full
+    clip         - optional [x0, y0, x1, y1] figure region of the page
+    """
+    size = resolve_size(size)
+    path = page_image_path(prefix, page, size)
+    entry = cached_image(path)
+    if entry is not None:
+        return entry
+
+    try:
+        return remember_image(path, bucket.blob(path).download_as_bytes(), variant_mime(size))
+    except NotFound:
+        pass
+
+    print(f"🖼️ Rendering page {page} on demand -> {prefix}")
+    variants = render_variants(bucket, storage_path, prefix, page, clip)
+    return remember_image(path, variants[size], variant_mime(size))
+
+
+def delete_page_images(bucket, prefix):
+    """Remove every stored page image under a page prefix."""
+    for blob in bucket.list_blobs(prefix=prefix):
+        blob.delete()
@@ -0,0 +1,254 @@
+"""
+Read-through cache of PDF records (user PDF documents and shared content).
+
+Two tiers:
+    memory  decoded records in a per-process LRU bounded by PDF_CACHE_MAX_MB
+    disk    pickled records in PDF_DISK_CACHE_DIR, one file per key; shared
+            by every gunicorn worker on the machine and bounded by
+            PDF_DISK_CACHE_MAX_MB (least recently used files evicted first)
+
+Every entry carries the version it was read at (the document's updatedAt).
+A lookup for a specific version only returns an entry with that version, so
+any Firestore write that bumps updatedAt invalidates stale copies everywhere.
+Entries stored with version None (immutable content) match any lookup.
+Records revalidated within PDF_CACHE_FRESH_SECONDS are served from memory
+without asking Firestore for the current version at all.
+
+Each process keeps a running total of the disk tier's bytes (one directory
+scan at first use, then updated on every write and removal). The directory
+is only scanned again when that total goes over budget, which also picks up
+files written by other workers.
+
+Hit/miss counters per tier are kept per process and reported by stats().
+"""
+
+import os
+import time
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+PDF_CACHE_MAX_BYTES = int(float(os.environ.get('PDF_CACHE_MAX_MB', 64)) * 1024 * 1024)
+# Set to an empty string to disable the disk tier
+PDF_DISK_CACHE_DIR = os.environ.get(
+    'PDF_DISK_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'pdf_cache')
+)
+PDF_DISK_CACHE_MAX_BYTES = int(float(os.environ.get('PDF_DISK_CACHE_MAX_MB', 512)) * 1024 * 1024)
+# How long a revalidated record is trusted before checking its version again
+PDF_CACHE_FRESH_SECONDS = float(os.environ.get('PDF_CACHE_FRESH_SECONDS', 5))
+
+_lock = threading.Lock()
+_memory = OrderedDict()  # key -> (version, record, size, validated_at)
+_memory_bytes = 0
+_disk_bytes = None  # this process's running total for the disk tier, None until first scanned
+_counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0, "invalidations": 0}
+
+
+def _disk_path(key):
+    return os.path.join(PDF_DISK_CACHE_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.bin')
+
+
+def _matches(stored_version, version):
+    return stored_version is None or stored_version == version
+
+
+def _remember(key, version, record, size):
+    """Insert into the memory tier (caller holds _lock)."""
+    global _memory_bytes
+    if key in _memory:
+        _memory_bytes -= _memory.pop(key)[2]
+    if size > PDF_CACHE_MAX_BYTES:
+        return
+    _memory[key] = (version, record, size, time.monotonic())
+    _memory_bytes += size
+    while _memory_bytes > PDF_CACHE_MAX_BYTES:
+        _, (_, _, evicted, _) = _memory.popitem(last=False)
+        _memory_bytes -= evicted
+        _counters["evictions"] += 1
+
+
+def _read_disk(key, version):
+    """(stored version, record) from the disk tier, or None."""
+    path = _disk_path(key)
+    try:
+        with open(path, 'rb') as f:
+            header = int.from_bytes(f.read(4), 'little')
+            stored = f.read(header).decode('utf-8') or None
+            if not _matches(stored, version):
+                return None
+            payload = f.read()
+        os.utime(path)  # recently used, evicted last
+        return stored, pickle.loads(payload), len(payload)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"⚠️ Dropping unreadable PDF cache file {path} ({e})")
+        _remove(path)
+        return None
+
+
+def _remove(path):
+    global _disk_bytes
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return
+    with _lock:
+        if _disk_bytes is not None:
+            _disk_bytes = max(0, _disk_bytes - size)
+
+
+def _disk_usage():
+    """Running total of the disk tier's bytes, scanning the directory only the first time."""
+    global _disk_bytes
+    if _disk_bytes is None:
+        total = sum(entry.stat().st_size for entry in _disk_entries())
+        with _lock:
+            if _disk_bytes is None:
+                _disk_bytes = total
+    return _disk_bytes
+
+
+def _write_disk(key, version, payload):
+    global _disk_bytes
+    header = (version or '').encode('utf-8')
+    path = _disk_path(key)
+    _disk_usage()
+    os.makedirs(PDF_DISK_CACHE_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=PDF_DISK_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(len(header).to_bytes(4, 'little'))
+            f.write(header)
+            f.write(payload)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp, path)  # atomic: readers see the old or the new file
+    except Exception:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    with _lock:
+        _disk_bytes += 4 + len(header) + len(payload) - replaced
+        over = _disk_bytes > PDF_DISK_CACHE_MAX_BYTES
+    if over:
+        _evict_disk()
+
+
+def _disk_entries():
+    try:
+        return [entry for entry in os.scandir(PDF_DISK_CACHE_DIR) if entry.name.endswith('.bin')]
+    except FileNotFoundError:
+        return []
+
+
+def _evict_disk():
+    """Rescan the directory and drop least recently used files until under budget."""
+    global _disk_bytes
+    entries = []
+    for entry in _disk_entries():
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue  # removed by another worker
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    for _, size, path in sorted(entries):
+        if total <= PDF_DISK_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted += 1
+    with _lock:
+        _disk_bytes = total
+        _counters["evictions"] += evicted
+
+
+def get_fresh(key):
+    """A memory-tier record revalidated within PDF_CACHE_FRESH_SECONDS, or None."""
+    with _lock:
+        entry = _memory.get(key)
+        if entry and time.monotonic() - entry[3] < PDF_CACHE_FRESH_SECONDS:
+            _memory.move_to_end(key)
+            _counters["memory_hits"] += 1
+            return entry[1]
+    return None
+
+
+def get(key, version=None):
+    """The record cached for key at version (memory first, then disk), or None."""
+    with _lock:
+        entry = _memory.get(key)
+        if entry and _matches(entry[0], version):
+            _memory.move_to_end(key)
+            _memory[key] = entry[:3] + (time.monotonic(),)
+            _counters["memory_hits"] += 1
+            return entry[1]
+
+    found = _read_disk(key, version) if PDF_DISK_CACHE_DIR else None
+    with _lock:
+        if found is None:
+            _counters["misses"] += 1
+            return None
+        stored, record, size = found
+        _remember(key, stored, record, size)
+        _counters["disk_hits"] += 1
+        return record
+
+
+def put(key, version, record, disk=True):
+    """
+    Cache a record read at version (None for content that never changes).
+    disk=False keeps it in process memory only (e.g. short-lived version stamps).
+    """
+    payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+    with _lock:
+        _remember(key, version, record, len(payload))
+        _counters["writes"] += 1
+    if disk and PDF_DISK_CACHE_DIR:
+        try:
+            _write_disk(key, version, payload)
+        except Exception as e:
+            print(f"⚠️ Could not write PDF cache file for {key} ({e})")
+    return record
+
+
+def invalidate(key):
+    """Forget key in both tiers (after a local write or delete)."""
+    global _memory_bytes
+    with _lock:
+        if key in _memory:
+            _memory_bytes -= _memory.pop(key)[2]
+        _counters["invalidations"] += 1
+    if PDF_DISK_CACHE_DIR:
+        _remove(_disk_path(key))
+
+
+def stats():
+    """Counters since process start plus the bytes held by each tier."""
+    entries = _disk_entries() if PDF_DISK_CACHE_DIR else []
+    with _lock:
+        hits = _counters["memory_hits"] + _counters["disk_hits"]
+        lookups = hits + _counters["misses"]
+        return {
+            **_counters,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(_memory),
+            "memory_bytes": _memory_bytes,
+            "memory_max_bytes": PDF_CACHE_MAX_BYTES,
+            "disk_entries": len(entries),
+            "disk_bytes": sum(entry.stat().st_size for entry in entries),
+            "disk_max_bytes": PDF_DISK_CACHE_MAX_BYTES
+        }
@@ -0,0 +1,447 @@
+"""
+Single-pass PDF ingestion for LiftOff uploads.
+
+The document is opened once with PyMuPDF and every page is visited exactly
+once to collect its text, classify whether it holds figures worth rendering,
+gather quality stats and either render it or record it as a render
+candidate. PyPDF2 / pdfplumber are kept only as a fallback for files
+PyMuPDF can't open (text only, no images).
+
+Sources can be raw bytes or a path to a spooled file; with a path MuPDF reads
+pages from disk on demand instead of holding the whole file in memory.
+"""
+
+import io
+import os
+import re
+import sys
+import base64
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+import numpy as np
+import PyPDF2
+import pdfplumber
+from PIL import Image
+
+import memory_budget
+from image_hash import dhash, assign_aliases
+from pdf_quality import build_quality_profile
+from chunker import page_blocks, text_blocks
+
+# Watermarks / footers that shouldn't count as real page content
+WATERMARK_RE = re.compile(r'(oalevelnotes\.com|dalevelnotes\.com|made with gamma)', re.IGNORECASE)
+URL_RE = re.compile(r'https?://\S+|www\.\S+')
+
+# Text-only pages with fewer meaningful characters than this are never rendered
+MIN_RENDER_CHARS = 20
+
+# Render at 2x zoom (default is 72 DPI, 2x = 144 DPI)
+RENDER_ZOOM = 2
+
+# Figure-aware page selection: only pages with real visual content (raster
+# figures, vector diagrams, tables) are rendered. PDF_RENDER_TEXT_PAGES=1
+# restores rendering every non-empty page.
+RENDER_TEXT_PAGES = os.environ.get('PDF_RENDER_TEXT_PAGES', '0') == '1'
+# Raster images smaller than this share of the page are logos/icons
+MIN_IMAGE_AREA_RATIO = 0.02
+# Vector drawings: at least this many paths covering this share of the page
+MIN_DRAWINGS = 6
+MIN_DRAWING_AREA_RATIO = 0.05
+# Elements covering nearly the whole page are backgrounds/frames, unless the
+# page has almost no text (a scanned page or full-page figure)
+BACKGROUND_AREA_RATIO = 0.9
+SCANNED_MAX_CHARS = 200
+# Crop to the figure region when it covers less than this share of the page
+CROP_MAX_AREA_RATIO = 0.6
+CROP_MARGIN = 12
+
+# Width of the tiny grayscale render used for perceptual hashing
+HASH_RENDER_WIDTH = 96
+
+# Page-parallel mode: documents with at least PDF_PARALLEL_MIN_PAGES pages are
+# sharded into page ranges and processed by a bounded process pool, never
+# larger than the CPU count (see parallel_workers). Set PDF_PARALLEL_WORKERS=1
+# to disable.
+PARALLEL_WORKERS = int(os.environ.get('PDF_PARALLEL_WORKERS', min(4, os.cpu_count() or 1)))
+PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 40))
+# Each worker process costs a spawn plus module imports; below this many
+# pages per worker that outweighs the work it takes over
+MIN_PAGES_PER_WORKER = 10
+# Shards per worker - smaller ranges balance uneven pages (slides vs. text)
+SHARDS_PER_WORKER = 4
+# "spawn" keeps workers clear of the gRPC threads Firebase starts in the parent
+PARALLEL_START_METHOD = os.environ.get('PDF_PARALLEL_START_METHOD', 'spawn')
+
+
+def _open_pdf(source):
+    """Open a PDF from bytes or a file path."""
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source, filetype="pdf")
+
+
+def _source_size(source):
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    return os.path.getsize(source)
+
+
+def should_skip_page(page_text):
+    """Return True if a page's text is near-empty or only URLs/watermarks."""
+    clean_text = WATERMARK_RE.sub('', page_text).strip()
+    non_url_text = URL_RE.sub('', clean_text).strip()
+    return len(non_url_text) < MIN_RENDER_CHARS
+
+
+def classify_page(page, page_text, textpage=None):
+    """
+    Decide whether a page has visual content worth rendering.
+
+    Returns a dict with:
+        kind           - "figure" or "text"
+        clip           - [x0, y0, x1, y1] figure region to crop to, or None
+                         when the whole page should be rendered
+        images         - number of significant raster images
+        drawings       - number of vector paths
+        text_coverage  - share of the page covered by text blocks
+    """
+    page_rect = page.rect
+    page_area = abs(page_rect) or 1
+    regions = []
+
+    image_rects = [fitz.Rect(info["bbox"]) & page_rect for info in page.get_image_info()]
+    image_rects = [r for r in image_rects if abs(r) / page_area >= MIN_IMAGE_AREA_RATIO]
+
+    drawing_rects = [d["rect"] & page_rect for d in page.get_drawings()]
+    drawing_rects = [r for r in drawing_rects if abs(r) / page_area < BACKGROUND_AREA_RATIO]
+
+    blocks = page.get_text("blocks", textpage=textpage)
+    text_area = sum(abs(fitz.Rect(b[:4]) & page_rect) for b in blocks if b[6] == 0)
+    text_coverage = min(1.0, text_area / page_area)
+    nearly_textless = len(page_text.strip()) < SCANNED_MAX_CHARS
+
+    for rect in image_rects:
+        if abs(rect) / page_area < BACKGROUND_AREA_RATIO or nearly_textless:
+            regions.append(rect)
+
+    if len(drawing_rects) >= MIN_DRAWINGS:
+        drawing_bounds = fitz.Rect()
+        for rect in drawing_rects:
+            drawing_bounds |= rect
+        if abs(drawing_bounds) / page_area >= MIN_DRAWING_AREA_RATIO:
+            regions.append(drawing_bounds)
+
+    info = {
+        "kind": "figure" if regions else "text",
+        "clip": None,
+        "images": len(image_rects),
+        "drawings": len(drawing_rects),
+        "text_coverage": round(text_coverage, 3)
+    }
+
+    if regions:
+        bounds = fitz.Rect()
+        for rect in regions:
+            bounds |= rect
+        if abs(bounds) / page_area < CROP_MAX_AREA_RATIO:
+            bounds = (bounds + (-CROP_MARGIN, -CROP_MARGIN, CROP_MARGIN, CROP_MARGIN)) & page_rect
+            info["clip"] = [round(v, 1) for v in bounds]
+    return info
+
+
+def page_phash(page, clip=None):
+    """Perceptual hash of a page (or clip region) from a tiny grayscale render."""
+    rect = fitz.Rect(clip) if clip else page.rect
+    zoom = HASH_RENDER_WIDTH / max(rect.width, 1)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=rect, colorspace=fitz.csGRAY, alpha=False)
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    return dhash(gray)
+
+
+def page_candidate(page, clip=None, dpi=RENDER_ZOOM * 72):
+    """
+    Image metadata for a page (or clipped region) that will be rendered
+    later: the pixel size a render at `dpi` produces, and that dpi.
+    """
+    rect = fitz.Rect(clip) if clip else page.rect
+    zoom = dpi / 72
+    pixels = (rect * fitz.Matrix(zoom, zoom)).irect  # same rounding as get_pixmap
+    candidate = {
+        "ext": "png",
+        "width": pixels.width,
+        "height": pixels.height,
+        "dpi": dpi,
+        "page": page.number + 1
+    }
+    if clip:
+        candidate["clip"] = clip
+    return candidate
+
+
+def render_page(page, clip=None, zoom=RENDER_ZOOM):
+    """Render a fitz page (or clipped region) to the image dict stored in the PDF document."""
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=fitz.Rect(clip) if clip else None)
+    image_data = pix.tobytes("png")
+    image = {
+        "data": base64.b64encode(image_data).decode('utf-8'),
+        "ext": "png",
+        "width": pix.width,
+        "height": pix.height,
+        "page": page.number + 1
+    }
+    if clip:
+        image["clip"] = clip
+    return image
+
+
+def render_page_image(source, page_number, dpi, clip=None):
+    """
+    Open a PDF (bytes or path) and render a single (1-based) page, or the
+    clip region of it, to a PIL image.
+    """
+    doc = _open_pdf(source)
+    try:
+        pix = doc[page_number - 1].get_pixmap(dpi=dpi, clip=fitz.Rect(clip) if clip else None)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    finally:
+        doc.close()
+
+
+def extract_text_fallback(source):
+    """Extract per-page text with PyPDF2, falling back to pdfplumber."""
+    def stream():
+        if isinstance(source, (bytes, bytearray)):
+            return io.BytesIO(source)
+        return open(source, 'rb')
+
+    try:
+        with stream() as f:
+            reader = PyPDF2.PdfReader(f)
+            return [(page.extract_text() or "") for page in reader.pages]
+    except Exception as e:
+        print(f"PyPDF2 failed ({e}), trying pdfplumber")
+        with stream() as f, pdfplumber.open(f) as pdf:
+            return [(page.extract_text() or "") for page in pdf.pages]
+
+
+def _build_result(page_results, engine):
+    pages = []
+    for i, result in enumerate(page_results):
+        text = result["text"]
+        pages.append({
+            "page": i + 1,
+            "chars": len(text),
+            "words": len(text.split()),
+            "kind": result["kind"],
+            "skip": result["skip"]
+        })
+
+    page_texts = [result["text"] for result in page_results]
+    images = [result["image"] for result in page_results if result["image"] is not None]
+    # Collapse repeated slides/templates onto one canonical image
+    assign_aliases(images)
+
+    # Score pages once here; garbage pages are left out of the document text
+    quality = build_quality_profile(page_texts)
+    dropped = set(quality["droppedPages"])
+    return {
+        "text": "".join(t + "\n" for i, t in enumerate(page_texts) if i + 1 not in dropped),
+        "page_texts": page_texts,
+        # Paragraph/heading blocks per page for chunking (empty for dropped pages)
+        "page_blocks": [[] if i + 1 in dropped else result["blocks"] for i, result in enumerate(page_results)],
+        "pages": pages,
+        "images": images,
+        "quality": quality,
+        "stats": {
+            "engine": engine,
+            "page_count": len(pages),
+            "word_count": sum(p["words"] for p in pages),
+            "char_count": sum(p["chars"] for p in pages),
+            "figure_pages": sum(1 for p in pages if p["kind"] == "figure"),
+            "skipped_pages": sum(1 for p in pages if p["skip"]),
+            # Pages kept as images, rendered or (render=False) candidates
+            "image_pages": len(images),
+            "duplicate_images": sum(1 for img in images if "alias_of" in img),
+            "dropped_pages": len(dropped)
+        }
+    }
+
+
+def _process_page(page, render, candidate_dpi):
+    """
+    Extract and classify a single page. Returns a dict with its text, kind,
+    whether it was skipped for rendering, and its image (rendered, or a
+    metadata-only candidate sized for candidate_dpi when render=False).
+    """
+    textpage = page.get_textpage()
+    page_text = page.get_text(textpage=textpage)
+    classification = classify_page(page, page_text, textpage)
+    result = {"text": page_text, "blocks": page_blocks(page, textpage), "kind": classification["kind"],
+              "skip": True, "image": None}
+    clip = classification["clip"]
+
+    if classification["kind"] != "figure":
+        if not RENDER_TEXT_PAGES or should_skip_page(page_text):
+            print(f"  Skipping page {page.number + 1} (no figures)")
+            return result
+        clip = None
+
+    result["skip"] = False
+    if not render:
+        result["image"] = page_candidate(page, clip, candidate_dpi)
+    else:
+        try:
+            result["image"] = render_page(page, clip)
+            print(f"  Rendered page {page.number + 1} as image: {result['image']['width']}x{result['image']['height']}")
+        except Exception as e:
+            print(f"Error rendering page {page.number + 1}: {str(e)}")
+            return result
+
+    result["image"]["phash"] = page_phash(page, clip)
+    return result
+
+
+# Set once per worker process by the pool initializer so the PDF source (bytes
+# or spooled file path) is shipped to each worker only once, not with every shard.
+_worker_pdf_source = None
+
+
+def _init_worker(source, quiet):
+    global _worker_pdf_source
+    _worker_pdf_source = source
+    if quiet:
+        # Spawned workers don't inherit the parent's redirect_stdout
+        sys.stdout = open(os.devnull, 'w')
+
+
+def _process_page_range(page_range):
+    """Worker entry point: open the shared source and process pages [start, end)."""
+    start, end, render, candidate_dpi = page_range
+    doc = _open_pdf(_worker_pdf_source)
+    try:
+        return [_process_page(doc[i], render, candidate_dpi) for i in range(start, end)]
+    finally:
+        doc.close()
+
+
+def _page_ranges(page_count, workers):
+    shard_size = max(1, math.ceil(page_count / (workers * SHARDS_PER_WORKER)))
+    return [(start, min(start + shard_size, page_count)) for start in range(0, page_count, shard_size)]
+
+
+def parallel_workers(page_count, workers):
+    """
+    Worker processes worth starting for page_count pages: at most `workers`,
+    one per CPU and MIN_PAGES_PER_WORKER pages each. Below 2, run serially.
+    """
+    return max(1, min(workers, os.cpu_count() or 1, page_count // MIN_PAGES_PER_WORKER))
+
+
+def _ingest_parallel(source, page_count, render, candidate_dpi, workers, on_image=None, quiet=False):
+    """Fan page ranges out to a process pool and merge results in page order."""
+    ranges = [(start, end, render, candidate_dpi) for start, end in _page_ranges(page_count, workers)]
+    print(f"⚡ Parallel ingest: {page_count} pages, {len(ranges)} shards, {workers} workers")
+
+    ctx = multiprocessing.get_context(PARALLEL_START_METHOD)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(source, quiet)) as pool:
+        # map() yields in submission order, so pages come back in order
+        results = []
+        for shard in pool.map(_process_page_range, ranges):
+            results.extend(_emit_images(shard, on_image))
+        return results
+
+
+def _emit_images(results, on_image):
+    """Hand rendered images to on_image as they arrive instead of keeping them."""
+    if on_image is None:
+        return results
+    emitted = []
+    for result in results:
+        if result["image"] is not None:
+            on_image(result["image"])
+        emitted.append({**result, "image": None})
+    return emitted
+
+
+def ingest_pdf(source, render=True, parallel=None,
+               workers=PARALLEL_WORKERS, min_pages=PARALLEL_MIN_PAGES,
+               on_image=None, budget_timeout=0, candidate_dpi=RENDER_ZOOM * 72, quiet=False):
+    """
+    Parse a PDF (bytes or file path) in a single pass.
+
+    Large documents (>= min_pages) are split into page ranges and processed by
+    a pool of up to `workers` processes; pass parallel=True/False to force a
+    mode. Either way the pool is capped at one worker per CPU and per
+    MIN_PAGES_PER_WORKER pages, and a single worker means a serial pass.
+    If the parallel run doesn't fit the memory budget it is downgraded to a
+    serial pass; if that doesn't fit within budget_timeout seconds either,
+    MemoryError is raised.
+
+    With render=False, candidates record the size of a render at
+    candidate_dpi (pass the DPI pages will actually be rendered at).
+
+    With render=True and an on_image callback, rendered pages are handed to
+    the callback one at a time and not kept in the result (so they are not
+    checked for near-duplicates).
+
+    quiet=True silences the per-page prints of the worker processes.
+
+    Near-duplicate images (same perceptual hash within a few bits) get an
+    "alias_of" index pointing at the first occurrence.
+
+    Returns a dict with:
+        text        - full document text (one block per page)
+        page_texts  - list of per-page text
+        page_blocks - per-page text blocks with heading flags (chunker input)
+        pages       - per-page stats, kind (figure/text) and skip decision
+        images      - rendered page images, or metadata-only render
+                      candidates when render=False
+        quality     - per-page quality profile and dropped pages
+        stats       - document-level counts
+    """
+    try:
+        doc = _open_pdf(source)
+    except Exception as e:
+        print(f"PyMuPDF could not open PDF ({e}), using text-only fallback")
+        page_results = [{"text": text, "blocks": text_blocks(text), "kind": "text", "skip": True, "image": None}
+                        for text in extract_text_fallback(source)]
+        return _build_result(page_results, "fallback")
+
+    reserved = 0
+    try:
+        page_count = len(doc)
+        file_size = _source_size(source)
+        workers = parallel_workers(page_count, workers)
+        if parallel is None:
+            parallel = page_count >= min_pages
+        parallel = parallel and workers > 1
+
+        if parallel:
+            reserved = memory_budget.estimate_ingest_bytes(file_size, page_count, workers)
+            if not memory_budget.try_reserve(reserved):
+                print("⚠️ Memory budget too tight for parallel ingest, running serially")
+                parallel = False
+                reserved = 0
+
+        if not parallel:
+            estimate = memory_budget.estimate_ingest_bytes(file_size, page_count)
+            if not memory_budget.try_reserve(estimate, timeout=budget_timeout):
+                raise MemoryError("Server is busy processing other large PDFs, please try again shortly")
+            reserved = estimate
+
+        if parallel:
+            doc.close()
+            results = _ingest_parallel(source, page_count, render, candidate_dpi, workers, on_image, quiet)
+        else:
+            results = list(_emit_images((_process_page(page, render, candidate_dpi) for page in doc), on_image))
+    finally:
+        if not doc.is_closed:
+            doc.close()
+        if reserved:
+            memory_budget.release(reserved)
+
+    return _build_result(results, "pymupdf-parallel" if parallel else "pymupdf")
@@ -0,0 +1,108 @@
+"""
+Text quality scoring for extracted PDF text.
+
+Quality is scored once per page at upload (build_quality_profile) and the
+compact profile is stored with the PDF, so generation endpoints just read
+the stored verdict. Pages that are mostly garbage (bad OCR, handwriting) are
+dropped individually instead of rejecting the whole document.
+check_pdf_quality scores a whole text at once for documents without a profile.
+"""
+
+import re
+
+PROFILE_VERSION = 1
+
+MIN_WORDS = 30
+MIN_WORD_RATIO = 0.4
+MIN_AVG_WORD_LEN = 2.0
+# Pages with fewer words than this are too short to judge and are kept
+MIN_PAGE_WORDS_TO_JUDGE = 10
+
+# A "real" word is a whitespace token with at least two letters in it
+REAL_WORD_RE = re.compile(r'(?<!\S)\S*?[^\W\d_]\S*?[^\W\d_]\S*')
+
+EMPTY_REASON = "The PDF appears to be empty or contains no extractable text. It may be a scanned image without OCR."
+LOW_RATIO_REASON = "The PDF text quality is too low — most of the content couldn't be read clearly. This may be due to poor handwriting, low scan quality, or image-based content without proper text."
+FRAGMENTED_REASON = "The PDF content appears to be fragmented or corrupted. Please try a clearer version of the document."
+
+
+def too_few_words_reason(word_count):
+    return f"The PDF contains too little readable text ({word_count} words found). The content may be handwritten, a scanned image, or in a language we can't process."
+
+
+def score_text(text):
+    """Return (words, real_words, chars) for a block of text."""
+    words = text.split()
+    return len(words), len(REAL_WORD_RE.findall(text)), sum(map(len, words))
+
+
+def _verdict(words, real_words, chars, min_words=MIN_WORDS, min_word_ratio=MIN_WORD_RATIO):
+    if words == 0:
+        return False, EMPTY_REASON
+    if words < min_words:
+        return False, too_few_words_reason(words)
+    if real_words / words < min_word_ratio:
+        return False, LOW_RATIO_REASON
+    if chars / words < MIN_AVG_WORD_LEN:
+        return False, FRAGMENTED_REASON
+    return True, "OK"
+
+
+def is_garbage_page(words, real_words, chars):
+    """A page with enough words to judge whose words are mostly not real."""
+    if words < MIN_PAGE_WORDS_TO_JUDGE:
+        return False
+    return real_words / words < MIN_WORD_RATIO or chars / words < MIN_AVG_WORD_LEN
+
+
+def build_quality_profile(page_texts):
+    """
+    Score every page and compute the document verdict over the pages that
+    aren't garbage. Returns a Firestore-friendly dict (flat arrays only).
+    """
+    scores = [score_text(text) for text in page_texts]
+    dropped = [i + 1 for i, score in enumerate(scores) if is_garbage_page(*score)]
+
+    # If every page is garbage there is nothing to drop down to
+    if len(dropped) == len(scores):
+        dropped = []
+
+    dropped_set = set(dropped)
+    kept = [score for i, score in enumerate(scores) if i + 1 not in dropped_set]
+    words = sum(s[0] for s in kept)
+    real_words = sum(s[1] for s in kept)
+    chars = sum(s[2] for s in kept)
+    ok, reason = _verdict(words, real_words, chars)
+
+    return {
+        "version": PROFILE_VERSION,
+        "ok": ok,
+        "reason": reason,
+        "words": [s[0] for s in scores],
+        "realWords": [s[1] for s in scores],
+        "chars": [s[2] for s in scores],
+        "droppedPages": dropped
+    }
+
+
+def check_pdf_quality(text, min_words=MIN_WORDS, min_word_ratio=MIN_WORD_RATIO):
+    """
+    Check if extracted PDF text is readable enough to generate content from.
+    Returns (is_ok: bool, reason: str)
+
+    Checks:
+    1. Minimum word count
+    2. Ratio of real English words (>=2 chars, mostly alpha) vs garbage tokens
+    3. Average word length sanity (garbage OCR produces very short or very long tokens)
+    """
+    if not text or not text.strip():
+        return False, EMPTY_REASON
+    return _verdict(*score_text(text), min_words=min_words, min_word_ratio=min_word_ratio)
+
+
+def stored_quality_verdict(pdf_data, text):
+    """Read the verdict stored at upload; score the text for older documents."""
+    profile = pdf_data.get("qualityProfile")
+    if profile and profile.get("version") == PROFILE_VERSION:
+        return profile["ok"], profile["reason"]
+    return check_pdf_quality(text)
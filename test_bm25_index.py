@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the BM25 chunk index (bm25_index.py), using the in-memory
+bucket from conftest.py.
+
+Run: python -m pytest -q test_bm25_index.py
+"""
+
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+import bm25_index
+
+TEXTS = [
+    "Osmosis is the movement of water across a semi-permeable membrane.",
+    "The mitochondria produce energy for cells; cells need energy to divide.",
+    "Water is polar. Osmosis and diffusion both depend on concentration.",
+    "Acids donate protons while bases accept them.",
+]
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    """A fresh, empty index cache for every test."""
+    monkeypatch.setattr(bm25_index, "_cache", bm25_index.OrderedDict())
+
+
+def reference_scores(texts, query):
+    """Textbook BM25, one document at a time."""
+    docs = [Counter(bm25_index.tokenize(text)) for text in texts]
+    lengths = [sum(doc.values()) for doc in docs]
+    avg = sum(lengths) / len(lengths)
+    scores = []
+    for doc, length in zip(docs, lengths):
+        score = 0.0
+        for term in set(bm25_index.tokenize(query)):
+            df = sum(1 for d in docs if term in d)
+            if not doc[term]:
+                continue
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            tf = doc[term]
+            score += idf * tf * (bm25_index.K1 + 1) / (
+                tf + bm25_index.K1 * (1 - bm25_index.B + bm25_index.B * length / avg))
+        scores.append(score)
+    return scores
+
+
+def test_tokenize_drops_stopwords_and_stems():
+    assert bm25_index.tokenize("The cells are dividing") == ["cell", "divid"]
+    assert bm25_index.stem("osmosis") == "osmosis"
+    assert bm25_index.stem("proteins") == "protein"
+
+
+@pytest.mark.parametrize("query", ["osmosis water", "energy for the cell", "protons", "photosynthesis"])
+def test_scores_match_reference_bm25(query):
+    index = bm25_index.build_index(TEXTS)
+    assert np.allclose(index.scores(query), reference_scores(TEXTS, query), atol=1e-5)
+
+
+def test_search_ranks_best_first_and_skips_non_matches():
+    index = bm25_index.build_index(TEXTS)
+    hits = index.search("osmosis water", top_k=3)
+    assert {i for i, _ in hits} == {0, 2}
+    assert hits[0][1] >= hits[1][1] > 0
+    assert index.search("photosynthesis") == []
+    assert bm25_index.build_index([]).search("osmosis") == []
+
+
+def test_npz_round_trip():
+    index = bm25_index.build_index(TEXTS)
+    loaded = bm25_index.loads(bm25_index.dumps(index))
+    for field in ("terms", "offsets", "docs", "tfs", "lengths"):
+        assert np.array_equal(getattr(loaded, field), getattr(index, field))
+        assert getattr(loaded, field).dtype == getattr(index, field).dtype
+    assert np.array_equal(loaded.scores("energy cells"), index.scores("energy cells"))
+
+
+def test_load_index_builds_once_then_reads_storage(bucket):
+    path = "content/abc/" + bm25_index.INDEX_FILENAME
+    built = bm25_index.load_index(bucket, "abc", path, TEXTS)
+    assert path in bucket.blobs
+
+    bm25_index._cache.clear()  # another process
+    loaded = bm25_index.load_index(bucket, "abc", path, texts=[])
+    assert bucket.downloads == [path]
+    assert np.array_equal(loaded.scores("osmosis"), built.scores("osmosis"))
+    assert bm25_index.load_index(bucket, "abc", path, texts=[]) is loaded
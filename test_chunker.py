@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Offline tests for structure-aware chunking (chunker.py).
+
+Run: python -m pytest -q test_chunker.py
+"""
+
+import chunker
+
+
+def sentences(topic, count):
+    return [f"Sentence {i} explains how {topic} works in living cells." for i in range(count)]
+
+
+def paragraph(topic, count):
+    return {"text": " ".join(sentences(topic, count)), "heading": False}
+
+
+def heading(text):
+    return {"text": text, "heading": True}
+
+
+def test_headings_start_a_new_chunk_once_it_has_enough_text():
+    # ~140 tokens per section: above MIN_CHUNK_TOKENS, well below the target
+    pages = [[heading("Osmosis"), paragraph("osmosis", 12)],
+             [heading("Respiration"), paragraph("respiration", 12)]]
+    chunks = chunker.chunk_pages(pages)
+
+    assert [chunk["heading"] for chunk in chunks] == ["Osmosis", "Respiration"]
+    assert chunks[1]["text"].startswith("Respiration\n\n")  # no overlap across a heading
+    assert [(chunk["page"], chunk["endPage"]) for chunk in chunks] == [(1, 1), (2, 2)]
+
+
+def test_short_sections_are_packed_together():
+    pages = [[heading("Osmosis"), paragraph("osmosis", 2), heading("Diffusion"), paragraph("diffusion", 2)]]
+    [chunk] = chunker.chunk_pages(pages)
+
+    assert chunk["heading"] == "Diffusion"
+    assert "Osmosis" in chunk["text"] and "Diffusion" in chunk["text"]
+
+
+def test_consecutive_chunks_overlap_by_whole_sentences():
+    pages = [[paragraph("osmosis", 10)], [paragraph("diffusion", 10)]]
+    chunks = chunker.chunk_pages(pages, target=60, overlap=20)
+
+    assert len(chunks) > 2
+    for previous, chunk in zip(chunks, chunks[1:]):
+        last_sentence = chunker.SENTENCE_RE.split(previous["text"])[-1]
+        assert chunker.estimate_tokens(last_sentence) <= 20
+        assert chunk["text"].startswith(last_sentence)
+        assert chunk["page"] == previous["endPage"]
+    # Every sentence is kept, in order
+    text = " ".join(chunk["text"] for chunk in chunks)
+    positions = [text.index(s) for s in sentences("osmosis", 10) + sentences("diffusion", 10)]
+    assert positions == sorted(positions)
+
+
+def test_overlong_sentence_is_split_at_words_within_the_target():
+    words = [f"word{i}" for i in range(300)]
+    chunks = chunker.chunk_pages([[{"text": " ".join(words), "heading": False}]], target=50, overlap=15)
+
+    assert all(chunk["tokens"] <= 50 for chunk in chunks)
+    assert " ".join(chunk["text"] for chunk in chunks).split() == words
+
+
+def test_plain_text_chunks_have_no_pages():
+    chunks = chunker.chunk_plain_text("First paragraph.\n\nSecond paragraph.")
+    assert chunks == [{"text": "First paragraph.\n\nSecond paragraph.", "page": None, "endPage": None,
+                       "heading": None, "tokens": 12}]
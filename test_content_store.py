@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the shared content store (content_store.py), using the
+in-memory Firestore and bucket from conftest.py.
+
+Run: python -m pytest -q test_content_store.py
+"""
+
+import pytest
+
+import content_store
+
+HASH = "ab" * 32
+
+
+def entry(db):
+    return db.docs.get((content_store.CONTENT_COLLECTION, HASH))
+
+
+def ingest(db, bucket):
+    """What a fresh upload writes: blobs under the content prefix, then the entry."""
+    bucket.put(content_store.content_storage_path(HASH), b"%PDF")
+    bucket.put(content_store.content_blob_path(HASH, "bm25.npz"), b"index")
+    return content_store.store_content(db, HASH, {"storagePath": content_store.content_storage_path(HASH)})
+
+
+@pytest.fixture
+def no_wait(monkeypatch):
+    monkeypatch.setattr(content_store, "PURGE_WAIT_SECONDS", 0)
+
+
+def test_upload_during_purge_is_refused_until_the_blobs_are_gone(db, bucket, no_wait):
+    ingest(db, bucket)
+    attempts = []
+    list_blobs = bucket.list_blobs
+
+    def list_blobs_while_reuploading(prefix=""):
+        # A new upload of the same file arrives while the purge is running
+        with pytest.raises(content_store.ContentBusy):
+            content_store.acquire_content(db, HASH)
+        with pytest.raises(content_store.ContentBusy):
+            content_store.store_content(db, HASH, {"storagePath": "new"})
+        attempts.append(entry(db))
+        return list_blobs(prefix)
+
+    bucket.list_blobs = list_blobs_while_reuploading
+    assert content_store.release_content(db, bucket, HASH) == 0
+
+    assert attempts[0]["purging"] and attempts[0]["refCount"] == 0
+    assert entry(db) is None and bucket.blobs == {}
+
+    # Once the purge is done the file is ingested afresh
+    assert content_store.acquire_content(db, HASH) is None
+    assert ingest(db, bucket) is True
+    assert entry(db)["refCount"] == 1 and content_store.content_storage_path(HASH) in bucket.blobs
+
+
+def test_acquire_waits_for_a_running_purge(db, monkeypatch):
+    db.collection(content_store.CONTENT_COLLECTION).document(HASH).set({"refCount": 0, "purging": True})
+    # The purge in another process finishes while we wait
+    monkeypatch.setattr(content_store.time, "sleep",
+                        lambda seconds: db.collection(content_store.CONTENT_COLLECTION).document(HASH).delete())
+
+    assert content_store.acquire_content(db, HASH) is None
+
+
+def test_collect_garbage_sweeps_entries_left_purging(db, bucket):
+    ingest(db, bucket)
+    content_store.store_content(db, "cd" * 32, {"storagePath": "other"})
+    db.collection(content_store.CONTENT_COLLECTION).document(HASH).update({"refCount": 0, "purging": True})
+
+    assert content_store.collect_garbage(db, bucket) == 1
+    assert entry(db) is None and bucket.blobs == {}
+    assert (content_store.CONTENT_COLLECTION, "cd" * 32) in db.docs
+
+
+def test_identical_uploads_share_one_entry(db, bucket):
+    assert content_store.acquire_content(db, HASH) is None  # first upload ingests
+    assert ingest(db, bucket) is True
+
+    content = content_store.acquire_content(db, HASH)  # second upload deduplicates
+    assert content["storagePath"] == content_store.content_storage_path(HASH)
+    # A third upload that ingested concurrently only takes a reference
+    assert content_store.store_content(db, HASH, {"storagePath": "ignored"}) is False
+    assert entry(db)["refCount"] == 3 and entry(db)["storagePath"] == content_store.content_storage_path(HASH)
+
+
+def test_blobs_are_deleted_with_the_last_reference(db, bucket):
+    ingest(db, bucket)
+    content_store.acquire_content(db, HASH)
+    bucket.put("content/" + "cd" * 32 + "/source.pdf", b"other")
+
+    assert content_store.release_content(db, bucket, HASH) == 1
+    assert entry(db)["refCount"] == 1 and not entry(db).get("purging")
+    assert content_store.content_storage_path(HASH) in bucket.blobs
+
+    assert content_store.release_content(db, bucket, HASH) == 0
+    assert entry(db) is None
+    assert list(bucket.blobs) == ["content/" + "cd" * 32 + "/source.pdf"]
+    assert content_store.release_content(db, bucket, HASH) is None  # already gone
+
+
+def test_mirrored_pages_are_recorded_and_purged(db, bucket):
+    ingest(db, bucket)
+    content_store.record_mirrored_page(db, HASH, 3)
+    content_store.record_mirrored_page(db, HASH, 3)
+    content_store.record_mirrored_page(db, HASH, 5)
+    assert content_store.mirrored_pages(db, HASH) == {3, 5}
+
+    content_store.release_content(db, bucket, HASH)
+    assert content_store.mirrored_pages(db, HASH) == set()
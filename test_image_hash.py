@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Offline tests for perceptual page hashing (image_hash.py) and near-duplicate
+detection of rendered pages (pdf_ingest.page_phash).
+
+Run: python -m pytest -q test_image_hash.py
+"""
+
+import fitz
+import numpy as np
+
+import image_hash
+from pdf_ingest import ingest_pdf, page_phash
+
+
+def slide(doc, title):
+    """A template slide: banner with a title and the same picture on every copy."""
+    page = doc.new_page()
+    page.draw_rect(fitz.Rect(0, 0, 595, 160), color=None, fill=(0.1, 0.2, 0.6))
+    page.insert_text((60, 100), title, fontsize=36, color=(1, 1, 1))
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+    pix.set_rect(fitz.IRect(0, 0, 32, 64), (200, 60, 40))
+    pix.set_rect(fitz.IRect(32, 0, 64, 64), (240, 220, 90))
+    page.insert_image(fitz.Rect(100, 250, 500, 650), pixmap=pix)
+
+
+def test_dhash_tolerates_small_changes_only():
+    rng = np.random.default_rng(0)
+    gray = rng.integers(0, 256, (200, 300)).astype(np.float32)
+    noisy = np.clip(gray + rng.normal(0, 4, gray.shape), 0, 255)
+
+    assert len(image_hash.dhash(gray)) == image_hash.HASH_SIZE ** 2 // 4
+    assert image_hash.hamming(image_hash.dhash(gray), image_hash.dhash(noisy)) <= image_hash.MAX_DISTANCE
+    assert image_hash.hamming(image_hash.dhash(gray), image_hash.dhash(255 - gray)) > image_hash.MAX_DISTANCE
+
+
+def test_repeated_slides_hash_alike():
+    doc = fitz.open()
+    slide(doc, "Week 1")
+    slide(doc, "Week 2")
+    chart = doc.new_page()
+    for k in range(8):
+        chart.draw_rect(fitz.Rect(60 + k * 60, 720 - k * 80, 100 + k * 60, 800), color=(0, 0, 0), fill=(0, 0, 0))
+    first, again, other = doc
+
+    assert image_hash.hamming(page_phash(first), page_phash(again)) <= image_hash.MAX_DISTANCE
+    assert image_hash.hamming(page_phash(first), page_phash(other)) > image_hash.MAX_DISTANCE
+    # A clip hashes only that region
+    assert page_phash(first, [0, 0, 595, 160]) != page_phash(first)
+
+
+def test_assign_aliases_points_at_the_first_copy():
+    a, b = "00" * 32, "ff" * 32
+    near_a = "01" + "00" * 31
+    images = [{"phash": a, "data": "A"}, {"phash": b, "data": "B"}, {"phash": near_a, "data": "A2"},
+              {"data": "no hash"}, {"phash": b, "data": "B2"}]
+    image_hash.assign_aliases(images)
+
+    assert [img.get("alias_of") for img in images] == [None, None, 0, None, 1]
+    assert [img.get("data") for img in images] == ["A", "B", None, "no hash", None]
+
+
+def test_ingest_marks_duplicate_slides():
+    doc = fitz.open()
+    for week in range(3):
+        slide(doc, f"Week {week + 1}")
+    ingest = ingest_pdf(doc.tobytes(), render=False, parallel=False)
+
+    assert [img["page"] for img in ingest["images"]] == [1, 2, 3]
+    assert [img.get("alias_of") for img in ingest["images"]] == [None, 0, 0]
+    assert ingest["stats"]["duplicate_images"] == 2
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Tests for the R2 upload backend (image_upload.py) against moto's in-process
+S3 stand-in (pip install -r requirements-dev.txt).
+
+Run: python -m pytest -q test_image_upload.py
+"""
+
+import boto3
+import pytest
+from boto3.s3.transfer import TransferConfig
+
+import moto
+
+import image_upload
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def r2(monkeypatch):
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="test-bucket")
+        monkeypatch.setattr(image_upload, "s3", client)
+        monkeypatch.setattr(image_upload, "BUCKET_NAME", "test-bucket")
+        monkeypatch.setattr(image_upload, "CDN_DOMAIN", "https://cdn.example.com")
+        # S3's minimum part size, so a 6 MB object needs two parts
+        monkeypatch.setattr(image_upload, "TRANSFER_CONFIG",
+                            TransferConfig(multipart_threshold=5 * MB, multipart_chunksize=5 * MB))
+        yield client
+
+
+def test_upload_many_sets_headers_and_returns_cdn_urls(r2, tmp_path):
+    pdf = tmp_path / "doc.pdf"
+    pdf.write_bytes(b"%PDF-1.4" + b"0" * (6 * MB))
+
+    urls = image_upload.upload_many_to_r2([
+        (str(pdf), "content/abc/original.pdf", "application/pdf"),
+        (b"webp-bytes", "content/abc/pages/p0001_display.webp", "image/webp"),
+    ])
+
+    assert urls == ["https://cdn.example.com/content/abc/original.pdf",
+                    "https://cdn.example.com/content/abc/pages/p0001_display.webp"]
+    large = r2.head_object(Bucket="test-bucket", Key="content/abc/original.pdf")
+    assert large["ETag"].strip('"').endswith("-2")  # multipart upload of two parts
+    assert large["ContentLength"] == pdf.stat().st_size
+    small = r2.head_object(Bucket="test-bucket", Key="content/abc/pages/p0001_display.webp")
+    assert small["ContentType"] == "image/webp"
+    assert small["CacheControl"] == image_upload.R2_CACHE_CONTROL
+    assert image_upload.r2_object_exists("content/abc/original.pdf")
+    assert not image_upload.r2_object_exists("content/abc/missing.pdf")
+
+
+def test_if_missing_skips_existing_keys_and_prefix_delete(r2):
+    r2.put_object(Bucket="test-bucket", Key="content/abc/source.pdf", Body=b"original")
+    r2.put_object(Bucket="test-bucket", Key="content/abd/source.pdf", Body=b"other")
+
+    future = image_upload.submit_to_r2(b"changed", "content/abc/source.pdf", "application/pdf", if_missing=True)
+    assert future.result() == "https://cdn.example.com/content/abc/source.pdf"
+    assert r2.get_object(Bucket="test-bucket", Key="content/abc/source.pdf")["Body"].read() == b"original"
+
+    assert image_upload.delete_prefix_from_r2("content/abc/") == 1
+    assert not image_upload.r2_object_exists("content/abc/source.pdf")
+    assert image_upload.r2_object_exists("content/abd/source.pdf")
+
+
+def test_missing_settings_raise_a_clear_error(monkeypatch):
+    monkeypatch.setattr(image_upload, "s3", None)
+    monkeypatch.setattr(image_upload, "SECRET_ACCESS_KEY", None)
+    with pytest.raises(RuntimeError, match="R2_SECRET_ACCESS_KEY"):
+        image_upload.get_client()
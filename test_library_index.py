@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the per-user library index (library_index.py).
+Uses the local embedder and the in-memory bucket from conftest.py.
+
+Run: python -m pytest -q test_library_index.py
+"""
+
+import numpy as np
+import pytest
+
+import bm25_index
+import library_index
+import vector_index
+
+BIOLOGY = [
+    {"text": "Osmosis is the movement of water across a semi-permeable membrane.", "page": 1},
+    {"text": "The mitochondria produce energy for the cell through respiration.", "page": 2},
+]
+CHEMISTRY = [
+    {"text": "Covalent bonds share electron pairs between atoms.", "page": 3},
+    {"text": "Water is a polar molecule; osmosis depends on solute concentration.", "page": 5},
+    {"text": "Acids donate protons while bases accept them.", "page": 7},
+]
+PHYSICS = [
+    {"text": "Newton's second law relates force, mass and acceleration.", "page": 1},
+]
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    """A fresh, empty library cache for every test."""
+    monkeypatch.setattr(library_index, "_cache", library_index.OrderedDict())
+
+
+def document(chunks, embedder):
+    texts = [chunk["text"] for chunk in chunks]
+    return bm25_index.build_index(texts), vector_index.build_index(embedder, texts)
+
+
+def build(docs, embedder):
+    library = library_index.Library.empty()
+    for name, chunks in docs:
+        library = library_index.add_document(library, name, f"hash-{name}", chunks, *document(chunks, embedder))
+    return library
+
+
+def test_merged_index_matches_one_built_from_scratch():
+    embedder = vector_index.HashingEmbedder()
+    library = build([("bio", BIOLOGY), ("chem", CHEMISTRY), ("phys", PHYSICS)], embedder)
+    library = library_index.remove_document(library, "chem")
+
+    remaining = [chunk["text"] for chunk in BIOLOGY + PHYSICS]
+    expected = bm25_index.build_index(remaining)
+    assert library.names == ["bio", "phys"]
+    assert [library.chunk_text(i) for i in range(library.chunk_count)] == remaining
+    for query in ["osmosis water", "force mass", "energy cell"]:
+        assert np.allclose(library.bm25.scores(query), expected.scores(query))
+    assert library.vectors.shape == (len(remaining), vector_index.LOCAL_DIMENSIONS)
+
+
+def test_search_spans_documents():
+    embedder = vector_index.HashingEmbedder()
+    library = build([("bio", BIOLOGY), ("chem", CHEMISTRY), ("phys", PHYSICS)], embedder)
+
+    hits = library.search("where did we cover osmosis", top_k=2)
+    assert {(hit["pdf_name"], hit["chunk"]) for hit in hits} == {("bio", 0), ("chem", 1)}
+    assert hits[0]["page"] in (1, 5) and "smosis" in hits[0]["text"]
+
+    hybrid = library.search("osmosis", embedder.embed(["osmosis"])[0], top_k=1)
+    assert hybrid[0]["pdf_name"] in ("bio", "chem")
+
+
+def test_reupload_replaces_document():
+    embedder = vector_index.HashingEmbedder()
+    library = build([("bio", BIOLOGY), ("phys", PHYSICS)], embedder)
+    library = library_index.add_document(library, "bio", "hash-new", CHEMISTRY, *document(CHEMISTRY, embedder))
+
+    assert library.names == ["phys", "bio"] and library.chunk_count == len(PHYSICS) + len(CHEMISTRY)
+    assert library.search("mitochondria") == []
+
+
+def test_library_round_trips_and_survives_concurrent_writes(bucket):
+    embedder = vector_index.HashingEmbedder()
+    assert library_index.update_library(bucket, "u1", lambda library: library, create=False) is None
+
+    library_index.update_library(bucket, "u1", lambda library: library_index.add_document(
+        library, "bio", "h1", BIOLOGY, *document(BIOLOGY, embedder)))
+
+    # Another writer adds a PDF between our read and our write: we retry on top of it
+    path = library_index.library_path("u1")
+    raced = []
+
+    def add_physics(library):
+        if not raced:
+            raced.append(True)
+            other = library_index.add_document(library, "chem", "h2", CHEMISTRY, *document(CHEMISTRY, embedder))
+            bucket.put(path, library_index.dumps(other))
+        return library_index.add_document(library, "phys", "h3", PHYSICS, *document(PHYSICS, embedder))
+
+    library_index.update_library(bucket, "u1", add_physics)
+    loaded = library_index.load_library(bucket, "u1")
+    assert loaded.names == ["bio", "chem", "phys"]
+    assert loaded.model == embedder.model
+    assert loaded.search("newton force")[0]["pdf_name"] == "phys"
+
+
+def test_document_without_vectors_keeps_the_library_vectors():
+    embedder = vector_index.HashingEmbedder()
+    library = build([("bio", BIOLOGY), ("phys", PHYSICS)], embedder)
+    library = library_index.add_document(library, "chem", "h2", CHEMISTRY, bm25_index.build_index(
+        [chunk["text"] for chunk in CHEMISTRY]), None)
+
+    assert library.model == embedder.model
+    assert library.vectors.shape == (library.chunk_count, vector_index.LOCAL_DIMENSIONS)
+    assert library.vector_docs.tolist() == [True, True, False]
+    assert not library.vectors[library.chunk_doc == 2].any()
+
+    # Still found through BM25 in a hybrid search, and the flags survive storage
+    library = library_index.loads(library_index.dumps(library))
+    hits = library.search("covalent bonds electron", embedder.embed(["covalent bonds electron"])[0], top_k=1)
+    assert hits[0]["pdf_name"] == "chem"
+
+    # Re-adding it with embeddings fills its rows in
+    library = library_index.add_document(library, "chem", "h2", CHEMISTRY, *document(CHEMISTRY, embedder))
+    assert library.vector_docs.all() and library.vectors[library.chunk_doc == 2].any()
+    library = library_index.remove_document(library_index.remove_document(library, "bio"), "phys")
+    assert library.vectors.shape == (len(CHEMISTRY), vector_index.LOCAL_DIMENSIONS)
+
+
+def test_rewrite_between_reload_and_download_is_retried(bucket, monkeypatch):
+    embedder = vector_index.HashingEmbedder()
+    path = library_index.library_path("u1")
+    bucket.put(path, library_index.dumps(build([("bio", BIOLOGY)], embedder)))
+    chem = library_index.dumps(build([("bio", BIOLOGY), ("chem", CHEMISTRY)], embedder))
+
+    # Another writer replaces the library right after each of the first reloads
+    rewrites = [chem, chem]
+    blob = bucket.blob
+
+    def racing_blob(name):
+        inner = blob(name)
+        reload = inner.reload
+
+        def reload_then_rewrite():
+            reload()
+            if rewrites:
+                bucket.put(path, rewrites.pop())
+
+        inner.reload = reload_then_rewrite
+        return inner
+
+    monkeypatch.setattr(bucket, "blob", racing_blob)
+    assert library_index.load_library(bucket, "u1").names == ["bio", "chem"]
+
+    rewrites.append(chem)
+    updated = library_index.update_library(bucket, "u1", lambda library: library_index.add_document(
+        library, "phys", "h3", PHYSICS, *document(PHYSICS, embedder)))
+    assert updated.names == ["bio", "chem", "phys"]
+    assert library_index.loads(bucket.blobs[path]).names == ["bio", "chem", "phys"]
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the retry policy of the chat completion batcher
+(llm_batch.py).
+
+Run: python -m pytest -q test_llm_batch.py
+"""
+
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import llm_batch
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def status_error(cls, status):
+    return cls(f"{status} error", response=httpx.Response(status, request=REQUEST), body=None)
+
+
+class FlakyClient:
+    """Raises the given errors in turn, then answers."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="notes"))])
+
+
+def test_transient_errors_are_retried():
+    client = FlakyClient(status_error(openai.RateLimitError, 429),
+                         openai.APITimeoutError(request=REQUEST),
+                         status_error(openai.InternalServerError, 503))
+
+    assert llm_batch.complete(client, {}, retries=3, backoff=0) == "notes"
+    assert client.calls == 4
+
+
+@pytest.mark.parametrize("error", [
+    status_error(openai.BadRequestError, 400),
+    status_error(openai.AuthenticationError, 401),
+    ValueError("bad request body"),
+])
+def test_permanent_errors_fail_at_once(error):
+    client = FlakyClient(error)
+
+    with pytest.raises(type(error)):
+        llm_batch.complete(client, {}, retries=3, backoff=0)
+    assert client.calls == 1
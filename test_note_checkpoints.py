@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Offline tests for when a note generation retry skips the usage charge
+(note_checkpoints.retry_decision) and for the status a streamed generation
+ends in (note_checkpoints.run_generation).
+
+Run: python -m pytest -q test_note_checkpoints.py
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import note_checkpoints
+
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def generation(status, age_seconds=0, **fields):
+    return {"pdfName": "bio.pdf", "level": "beginner", "mode": "generate", "status": status,
+            "updatedAt": NOW - timedelta(seconds=age_seconds), **fields}
+
+
+def decide(record, pdf_name="bio.pdf", level="beginner", mode="generate"):
+    return note_checkpoints.retry_decision(record, pdf_name, level, mode, now=NOW)
+
+
+def test_failed_or_abandoned_generation_resumes_free():
+    stale = note_checkpoints.NOTE_GENERATION_STALE_SECONDS + 1
+    assert decide(generation("failed")) == "resume"
+    assert decide(generation("running", age_seconds=stale)) == "resume"
+
+
+def test_unknown_generation_id_is_rejected():
+    assert decide(None) == "unknown"
+
+
+def test_generation_for_another_request_is_rejected():
+    failed = generation("failed")
+    assert decide(failed, pdf_name="chem.pdf") == "unknown"
+    assert decide(failed, level="advanced") == "unknown"
+    assert decide(failed, mode="regenerate") == "unknown"
+
+
+def test_live_running_generation_is_not_resumed():
+    assert decide(generation("running", age_seconds=5)) == "running"
+
+
+def test_completed_generation_is_charged_again():
+    assert decide(generation("complete")) == "charge"
+
+
+def status(db, generation_id="g1"):
+    return db.docs[("users", "u1", note_checkpoints.GENERATIONS_COLLECTION, generation_id)]["status"]
+
+
+def steps(fail=False):
+    yield "start", {}
+    yield "section", {"section": 0}
+    if fail:
+        raise RuntimeError("model error")
+    yield "done", {"success": True}
+
+
+def test_finished_generation_is_marked_complete(db):
+    events = list(note_checkpoints.run_generation(db, "u1", "g1", steps()))
+    assert [event for event, _ in events] == ["start", "section", "done"]
+    assert status(db) == "complete"
+
+
+def test_failed_generation_sends_an_error_event(db):
+    events = list(note_checkpoints.run_generation(db, "u1", "g1", steps(fail=True)))
+    assert events[-1] == ("error", {"error": "Server error: model error", "generation_id": "g1",
+                                    "resumable": True})
+    assert status(db) == "failed"
+
+
+def test_client_disconnect_marks_generation_failed_so_a_retry_resumes(db):
+    source = steps()
+    run = note_checkpoints.run_generation(db, "u1", "g1", source)
+    assert next(run)[0] == "start"
+    run.close()  # the client went away mid-stream
+
+    assert status(db) == "failed"
+    assert source.gi_frame is None  # the sections generator was closed too
+    assert decide(generation("failed")) == "resume"
+
+
+def test_disconnect_after_done_keeps_generation_complete(db):
+    run = note_checkpoints.run_generation(db, "u1", "g1", steps())
+    assert [next(run)[0] for _ in range(3)] == ["start", "section", "done"]
+    run.close()
+    assert status(db) == "complete"
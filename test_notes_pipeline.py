@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the notes pipeline (notes_pipeline.py): section packing,
+map-reduce over long documents, reuse of checkpointed sections and
+regenerating single sections (rebuild_sections, notes_stale). The
+model is a fake client; the section cache is a temporary SQLite file.
+
+Run: python -m pytest -q test_notes_pipeline.py
+"""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import notes_cache
+import notes_pipeline
+
+
+class FakeClient:
+    """Condenses map requests to ~300 tokens and writes notes for sections; counts calls."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.map_calls = 0
+        self.section_calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, stream=False, **request):
+        system, user = (message["content"] for message in request["messages"])
+        with self.lock:
+            if system == notes_pipeline.MAP_PROMPT:
+                self.map_calls += 1
+                text = f"Summary of {user.split('.')[0]}." + " cell" * 300
+            else:
+                self.section_calls += 1
+                text = f"Notes {self.section_calls}"
+        if stream:
+            return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch, tmp_path):
+    """An empty section cache for every test."""
+    monkeypatch.setattr(notes_cache, "NOTES_CACHE_PATH", str(tmp_path / "notes_cache.sqlite3"))
+    monkeypatch.setattr(notes_cache, "_conn", None)
+
+
+def document(chunk_count, chunk_words=490):
+    return [{"text": f"Chunk {i}." + " cell" * chunk_words, "page": i + 1, "endPage": i + 1}
+            for i in range(chunk_count)]
+
+
+def assert_covers(sections, chunk_count):
+    ranges = [tuple(section["chunks"]) for section in sections]
+    assert ranges[0][0] == 0 and ranges[-1][1] == chunk_count - 1
+    assert all(nxt[0] == prev[1] + 1 for prev, nxt in zip(ranges, ranges[1:]))
+    assert [section["id"] for section in sections] == [notes_pipeline.section_id(*r) for r in ranges]
+
+
+def test_short_document_is_packed_without_model_calls():
+    client = FakeClient()
+    sections = notes_pipeline.build_sections(client, document(6, 400), [], "beginner")
+
+    assert len(sections) == 3 and client.map_calls == 0
+    assert_covers(sections, 6)
+    assert "Chunk 0." in sections[0]["request"]["messages"][1]["content"]
+
+
+def test_long_document_is_map_reduced_over_every_chunk():
+    client = FakeClient()
+    chunks = document(40)
+    sections = notes_pipeline.build_sections(client, chunks, [], "beginner")
+
+    assert client.map_calls == 20  # one per ~SECTION_TOKENS unit
+    assert len(sections) <= notes_pipeline.MAX_CHUNKS
+    assert_covers(sections, 40)
+    prompts = "".join(section["request"]["messages"][1]["content"] for section in sections)
+    assert all(f"Summary of Chunk {i}" in prompts for i in range(0, 40, 2))
+
+    # The map stage is cached: a second build makes no calls
+    again = notes_pipeline.build_sections(client, chunks, [], "beginner")
+    assert client.map_calls == 20
+    assert [s["key"] for s in again] == [s["key"] for s in sections]
+
+
+def test_groups_over_budget_are_condensed_again(monkeypatch):
+    monkeypatch.setattr(notes_pipeline, "MAX_CHUNKS", 2)
+    client = FakeClient()
+    sections = notes_pipeline.build_sections(client, document(40), [], "beginner")
+
+    assert client.map_calls == 20 + 3  # 3 packed groups condensed at level 2
+    assert len(sections) <= 2
+    assert_covers(sections, 40)
+
+
+def test_quick_mode_samples_without_model_calls():
+    client = FakeClient()
+    sections = notes_pipeline.build_sections(client, document(40), [], "beginner", quick=True)
+    assert len(sections) == notes_pipeline.MAX_CHUNKS and client.map_calls == 0
+
+
+def test_images_follow_the_pages_of_their_section():
+    images = [{"page": 1}, {"page": 2, "alias_of": 0}, {"page": 5}]
+    sections = notes_pipeline.build_sections(FakeClient(), document(6, 400), images, "beginner")
+    assert [section["images"] for section in sections] == [[0], [], [2]]
+    assert "[PDF_IMG:2]" in sections[2]["request"]["messages"][1]["content"]
+
+
+def test_checkpointed_sections_are_not_generated_again():
+    client = FakeClient()
+    sections = notes_pipeline.build_sections(client, document(6, 400), [], "beginner")
+    done = {0: {"key": sections[0]["key"], "text": "saved"},
+            1: {"key": "stale-prompt", "text": "outdated"}}
+    finished = []
+
+    texts = notes_pipeline.generate_sections(client, sections, done,
+                                             on_section=lambda section, text: finished.append(section["index"]))
+    assert texts[0] == "saved" and texts[1] != "outdated"
+    assert client.section_calls == 2 and sorted(finished) == [1, 2]
+
+    # Generated sections are cached, so streaming them again makes no calls
+    events = list(notes_pipeline.stream_sections(client, sections, done))
+    assert client.section_calls == 2
+    assert sorted(events) == [("section", i, text) for i, text in enumerate(texts)]
+
+
+def test_rebuilt_sections_match_a_full_run():
+    client = FakeClient()
+    chunks = document(6, 400)
+    full = notes_pipeline.build_sections(client, chunks, [{"page": 3}], "advanced", mode="regenerate")
+    stored = notes_pipeline.note_sections(full, ["a", "b", "c"])
+
+    rebuilt = notes_pipeline.rebuild_sections(client, chunks, stored, {full[1]["id"]}, "advanced")
+    assert len(rebuilt) == 1
+    assert {k: rebuilt[0][k] for k in ("id", "index", "chunks", "images", "request", "key")} == \
+        {k: full[1][k] for k in ("id", "index", "chunks", "images", "request", "key")}
+
+
+def test_rebuilding_a_map_reduced_section_reuses_the_map_stage():
+    client = FakeClient()
+    chunks = document(40)
+    full = notes_pipeline.build_sections(client, chunks, [], "beginner")
+    stored = notes_pipeline.note_sections(full, ["text"] * len(full))
+    calls = client.map_calls
+
+    [rebuilt] = notes_pipeline.rebuild_sections(client, chunks, stored, {full[-1]["id"]}, "beginner")
+    assert client.map_calls == calls
+    assert rebuilt["chunks"] == full[-1]["chunks"]
+    assert "Summary of Chunk" in rebuilt["request"]["messages"][1]["content"]
+
+
+def test_notes_are_stale_once_the_chunks_change():
+    chunks = document(6, 400)
+    stored = notes_pipeline.note_sections(notes_pipeline.build_sections(FakeClient(), chunks, [], "beginner"),
+                                          ["a", "b", "c"])
+    fingerprint = notes_pipeline.chunks_fingerprint(chunks)
+    assert not notes_pipeline.notes_stale(stored, chunks, fingerprint)
+
+    # Re-chunked into the same number of chunks: only the fingerprint notices
+    rechunked = [{**chunk, "text": chunk["text"] + " extra"} for chunk in chunks]
+    assert notes_pipeline.notes_stale(stored, rechunked, fingerprint)
+
+    # Notes saved before the fingerprint fall back to the chunk range check
+    assert not notes_pipeline.notes_stale(stored, rechunked, None)
+    assert notes_pipeline.notes_stale(stored, chunks[:4], None)
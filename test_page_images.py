@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the page image LRU, ETags and conditional responses
+(page_images.py).
+
+Run: python -m pytest -q test_page_images.py
+"""
+
+import io
+
+import fitz
+import pytest
+from flask import Flask
+from PIL import Image
+
+import page_images
+from pdf_ingest import ingest_pdf, render_page_image
+
+PREFIX = "content/abc/pages/"
+
+
+@pytest.fixture(autouse=True)
+def lru(monkeypatch):
+    """A fresh, empty image LRU for every test."""
+    monkeypatch.setattr(page_images, "_cache", page_images.OrderedDict())
+    monkeypatch.setattr(page_images, "_cache_bytes", 0)
+    return page_images
+
+
+@pytest.fixture
+def client(bucket):
+    bucket.put(page_images.page_image_path(PREFIX, 3, "display"), b"0123456789")
+    app = Flask(__name__)
+
+    @app.route("/image")
+    def image():
+        data, mime, etag = page_images.load_page_image(bucket, "content/abc/source.pdf", PREFIX, 3)
+        return page_images.image_response(data, mime, etag, "private, no-cache")
+
+    return app.test_client()
+
+
+def test_stored_variant_is_downloaded_once(bucket):
+    bucket.put(page_images.page_image_path(PREFIX, 3, "display"), b"webp-bytes")
+
+    first = page_images.load_page_image(bucket, "content/abc/source.pdf", PREFIX, 3)
+    second = page_images.load_page_image(bucket, "content/abc/source.pdf", PREFIX, 3)
+
+    assert first == second
+    assert first[:2] == (b"webp-bytes", page_images.variant_mime("display"))
+    assert first[2] == page_images.image_etag(b"webp-bytes")
+    assert len(bucket.downloads) == 1
+
+
+def test_etag_revalidates_with_304(client):
+    response = client.get("/image")
+    etag = page_images.image_etag(b"0123456789")
+    assert response.status_code == 200 and response.data == b"0123456789"
+    assert response.headers["ETag"] == f'"{etag}"'
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+    cached = client.get("/image", headers={"If-None-Match": f'"{etag}"'})
+    assert cached.status_code == 304 and cached.data == b""
+
+    changed = client.get("/image", headers={"If-None-Match": '"something-else"'})
+    assert changed.status_code == 200
+
+
+def test_range_request_returns_206(client):
+    response = client.get("/image", headers={"Range": "bytes=2-5"})
+    assert response.status_code == 206
+    assert response.data == b"2345"
+    assert response.headers["Content-Range"] == "bytes 2-5/10"
+
+
+def test_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(page_images, "PAGE_IMAGE_CACHE_BYTES", 10)
+
+    page_images.remember_image("a", b"12345", "image/png")
+    page_images.remember_image("b", b"12345", "image/png")
+    page_images.cached_image("a")  # a is now the most recently used
+    page_images.remember_image("c", b"12345", "image/png")
+    page_images.remember_image("huge", b"x" * 11, "image/png")
+
+    assert page_images.cached_image("a") is not None
+    assert page_images.cached_image("b") is None
+    assert page_images.cached_image("c") is not None
+    assert page_images.cached_image("huge") is None
+    assert page_images._cache_bytes == 10
+
+
+def test_candidate_size_matches_the_served_variant():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Figure 1 " * 5, fontsize=20)
+    page.draw_rect(fitz.Rect(100, 100, 400, 500), color=(1, 0, 0), fill=(0, 1, 0))
+    for k in range(30):
+        page.draw_line((100, 100 + k * 10), (400, 110 + k * 10))
+    data = doc.tobytes()
+
+    dpi = page_images.render_dpi()
+    [candidate] = ingest_pdf(data, render=False, parallel=False, candidate_dpi=dpi)["images"]
+    variants = page_images.encode_variants(render_page_image(data, 1, dpi, candidate.get("clip")), dpi)
+    for size in page_images.PAGE_IMAGE_VARIANTS:
+        served = Image.open(io.BytesIO(variants[size])).size
+        assert page_images.variant_dimensions(candidate["width"], candidate["height"], candidate["dpi"], size) == served
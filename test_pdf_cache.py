@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the two-tier PDF record cache (pdf_cache.py).
+
+Run: python -m pytest -q test_pdf_cache.py
+"""
+
+import pytest
+
+import pdf_cache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_cache, "PDF_DISK_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(pdf_cache, "_memory", pdf_cache.OrderedDict())
+    monkeypatch.setattr(pdf_cache, "_memory_bytes", 0)
+    monkeypatch.setattr(pdf_cache, "_disk_bytes", None)
+    monkeypatch.setattr(pdf_cache, "_counters", dict.fromkeys(pdf_cache._counters, 0))
+    return pdf_cache
+
+
+def forget_memory(cache):
+    """Simulate another worker: same disk, empty process memory."""
+    cache._memory.clear()
+    cache._memory_bytes = 0
+
+
+def test_versioned_lookups(cache):
+    cache.put("users/u/pdfs/a", "v1", {"notes": "old"})
+    assert cache.get("users/u/pdfs/a", "v1") == {"notes": "old"}
+    assert cache.get("users/u/pdfs/a", "v2") is None
+
+    forget_memory(cache)
+    assert cache.get("users/u/pdfs/a", "v1") == {"notes": "old"}  # served by the disk tier
+    assert cache.get("users/u/pdfs/a", "v2") is None
+
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 2)
+    assert stats["disk_entries"] == 1 and stats["memory_bytes"] > 0
+
+
+def test_unversioned_entries_match_any_version(cache):
+    cache.put("pdfContent/abc", None, {"pdfText": "x" * 100})
+    forget_memory(cache)
+    assert cache.get("pdfContent/abc", "anything")["pdfText"] == "x" * 100
+
+
+def test_invalidate_drops_both_tiers(cache):
+    cache.put("users/u/pdfs/a", "v1", {"notes": "old"})
+    assert cache.get_fresh("users/u/pdfs/a") == {"notes": "old"}
+    cache.invalidate("users/u/pdfs/a")
+    assert cache.get_fresh("users/u/pdfs/a") is None
+    assert cache.get("users/u/pdfs/a", "v1") is None
+    assert cache.stats()["disk_entries"] == 0
+
+
+def test_tiers_stay_within_byte_limits(cache, monkeypatch):
+    monkeypatch.setattr(cache, "PDF_CACHE_MAX_BYTES", 3000)
+    monkeypatch.setattr(cache, "PDF_DISK_CACHE_MAX_BYTES", 5000)
+    for i in range(10):
+        cache.put(f"k{i}", "v", {"pdfText": str(i) * 1000})
+
+    stats = cache.stats()
+    assert stats["memory_bytes"] <= 3000 and stats["disk_bytes"] <= 5000
+    assert cache.get("k9", "v") is not None
+    assert "k0" not in cache._memory
+    assert cache._disk_bytes == stats["disk_bytes"]
+
+
+def test_disk_is_only_scanned_when_over_budget(cache, monkeypatch):
+    scans = []
+    entries = cache._disk_entries
+    monkeypatch.setattr(cache, "_disk_entries", lambda: scans.append(1) or entries())
+    monkeypatch.setattr(cache, "PDF_DISK_CACHE_MAX_BYTES", 5000)
+
+    for i in range(4):
+        cache.put(f"k{i}", "v", {"pdfText": str(i) * 1000})
+    assert len(scans) == 1  # initial total only
+
+    cache.put("k4", "v", {"pdfText": "4" * 1000})  # over budget: rescan and evict
+    assert len(scans) == 2
+    assert cache._disk_bytes <= 5000
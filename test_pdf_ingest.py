@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Offline tests for single-pass PDF ingestion (pdf_ingest.py): worker
+sizing and figure-aware page classification.
+
+Run: python -m pytest -q test_pdf_ingest.py
+"""
+
+import fitz
+
+import pdf_ingest
+
+
+def test_parallel_ingest_needs_cpus_and_pages(monkeypatch):
+    monkeypatch.setattr(pdf_ingest.os, "cpu_count", lambda: 1)
+    assert pdf_ingest.parallel_workers(500, 4) == 1
+
+    monkeypatch.setattr(pdf_ingest.os, "cpu_count", lambda: 8)
+    assert pdf_ingest.parallel_workers(500, 4) == 4
+    assert pdf_ingest.parallel_workers(25, 4) == 2
+    assert pdf_ingest.parallel_workers(5, 4) == 1
+
+
+BODY = " ".join(["Photosynthesis converts light energy into chemical energy in plants."] * 12)
+
+
+def new_page(doc, text=BODY):
+    page = doc.new_page()  # 595 x 842
+    page.insert_textbox(fitz.Rect(72, 72, 520, 400), text, fontsize=11)
+    return page
+
+
+def image(page, rect):
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+    pix.set_rect(pix.irect, (40, 120, 200))
+    page.insert_image(rect, pixmap=pix)
+
+
+def classify(page):
+    return pdf_ingest.classify_page(page, page.get_text())
+
+
+def test_text_page_is_not_a_figure():
+    doc = fitz.open()
+    info = classify(new_page(doc))
+    assert info["kind"] == "text" and info["clip"] is None
+    assert info["images"] == 0 and info["text_coverage"] > 0
+
+
+def test_chart_is_a_figure_cropped_to_its_region():
+    doc = fitz.open()
+    page = new_page(doc)
+    for k in range(6):
+        page.draw_rect(fitz.Rect(100 + k * 60, 670 - k * 30, 140 + k * 60, 700), color=(0, 0, 1), fill=(0.8, 0.9, 1))
+    info = classify(page)
+
+    assert info["kind"] == "figure" and info["drawings"] == 6
+    margin = pdf_ingest.CROP_MARGIN
+    assert info["clip"] == [100 - margin, 520 - margin, 440 + margin, 700 + margin]
+
+
+def test_few_strokes_and_logos_are_not_figures():
+    doc = fitz.open()
+    page = new_page(doc)
+    page.draw_line((72, 420), (520, 420))  # a rule under the text
+    image(page, fitz.Rect(540, 20, 580, 40))  # a small logo
+    info = classify(page)
+    assert info["kind"] == "text" and info["images"] == 0
+
+
+def test_background_image_only_counts_on_a_textless_page():
+    doc = fitz.open()
+    page = new_page(doc)
+    image(page, page.rect)  # template background behind real text
+    assert classify(page)["kind"] == "text"
+
+    scanned = doc.new_page()
+    image(scanned, scanned.rect)  # a scanned page: no text layer
+    info = classify(scanned)
+    assert info["kind"] == "figure" and info["clip"] is None
+
+
+def test_only_figure_pages_become_candidates():
+    doc = fitz.open()
+    new_page(doc)
+    figure = new_page(doc)
+    image(figure, fitz.Rect(100, 450, 400, 750))
+    ingest = pdf_ingest.ingest_pdf(doc.tobytes(), render=False, parallel=False)
+
+    assert [page["kind"] for page in ingest["pages"]] == ["text", "figure"]
+    assert [page["skip"] for page in ingest["pages"]] == [True, False]
+    assert [img["page"] for img in ingest["images"]] == [2]
+    assert ingest["images"][0]["clip"]
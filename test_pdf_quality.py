@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Offline tests for per-page text quality scoring (pdf_quality.py) and for
+dropping garbage pages at ingest.
+
+Run: python -m pytest -q test_pdf_quality.py
+"""
+
+import fitz
+
+import pdf_quality
+from pdf_ingest import ingest_pdf
+
+GOOD = " ".join(["Photosynthesis converts light energy into chemical energy in plants."] * 5)
+GARBAGE = " ".join(["x1 #4 ~~ 7 ;; 0q %% |l"] * 6)
+SHORT = "Figure 3"
+
+
+def test_garbage_pages_are_dropped_and_the_rest_judged():
+    profile = pdf_quality.build_quality_profile([GOOD, GARBAGE, SHORT, GOOD])
+
+    assert profile["droppedPages"] == [2]
+    assert profile["ok"] and profile["reason"] == "OK"
+    assert profile["words"] == [len(text.split()) for text in (GOOD, GARBAGE, SHORT, GOOD)]
+    assert profile["realWords"][1] < profile["words"][1] * pdf_quality.MIN_WORD_RATIO
+
+
+def test_all_garbage_document_keeps_its_pages_and_fails():
+    profile = pdf_quality.build_quality_profile([GARBAGE, GARBAGE])
+    assert profile["droppedPages"] == []
+    assert not profile["ok"] and profile["reason"] == pdf_quality.LOW_RATIO_REASON
+
+
+def test_too_little_text_fails():
+    profile = pdf_quality.build_quality_profile([SHORT, ""])
+    assert not profile["ok"] and "2 words found" in profile["reason"]
+    assert pdf_quality.build_quality_profile([])["reason"] == pdf_quality.EMPTY_REASON
+
+
+def test_stored_verdict_is_used_unless_outdated():
+    stored = {"qualityProfile": {"version": pdf_quality.PROFILE_VERSION, "ok": False, "reason": "stored"}}
+    assert pdf_quality.stored_quality_verdict(stored, GOOD) == (False, "stored")
+
+    outdated = {"qualityProfile": {"version": pdf_quality.PROFILE_VERSION - 1, "ok": False, "reason": "old"}}
+    assert pdf_quality.stored_quality_verdict(outdated, GOOD) == (True, "OK")
+    assert pdf_quality.stored_quality_verdict({}, GARBAGE) == (False, pdf_quality.LOW_RATIO_REASON)
+
+
+def test_ingest_leaves_dropped_pages_out_of_the_text():
+    doc = fitz.open()
+    for text in (GOOD, GARBAGE, GOOD):
+        doc.new_page().insert_textbox(fitz.Rect(72, 72, 520, 700), text, fontsize=11)
+
+    ingest = ingest_pdf(doc.tobytes(), render=False, parallel=False)
+    assert ingest["quality"]["droppedPages"] == [2]
+    assert ingest["stats"]["dropped_pages"] == 1
+    assert "x1" not in ingest["text"] and "Photosynthesis" in ingest["text"]
+    assert "x1" in ingest["page_texts"][1]  # still kept per page
+    assert ingest["page_blocks"][1] == [] and ingest["page_blocks"][0]
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the sharded chunk text store (text_store.py).
+
+Run: python -m pytest -q test_text_store.py
+"""
+
+import zlib
+
+import pytest
+
+import pdf_cache
+import text_store
+from chunker import chunk_pages
+
+PARAGRAPH = ("Osmosis moves water across a membrane. Diffusion spreads solutes évenly. "
+             "Active transport uses ATP — against the gradient. ")
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_cache, "PDF_DISK_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(pdf_cache, "_memory", pdf_cache.OrderedDict())
+    monkeypatch.setattr(pdf_cache, "_memory_bytes", 0)
+    monkeypatch.setattr(text_store, "TEXT_SEGMENT_BYTES", 512)
+
+
+def sample_chunks():
+    pages = [[{"text": "Cell Transport", "heading": True}] +
+             [{"text": PARAGRAPH * 3, "heading": False} for _ in range(4)] for _ in range(5)]
+    return chunk_pages(pages, target=120, overlap=30)
+
+
+def test_overlapping_chunks_are_stored_once():
+    chunks = sample_chunks()
+    stream, spans = text_store.build_stream([chunk["text"] for chunk in chunks])
+    data = stream.encode("utf-8")
+    for chunk, (start, end) in zip(chunks, spans):
+        assert data[start:end].decode("utf-8") == chunk["text"]
+    assert len(data) < sum(len(chunk["text"].encode("utf-8")) for chunk in chunks)
+
+
+def test_round_trip_through_segments(bucket):
+    chunks = sample_chunks()
+    manifest = text_store.save_text(bucket, "abc", chunks)
+
+    assert manifest["segments"] > 3 and manifest["chunkCount"] == len(chunks)
+    assert all(len(zlib.decompress(bucket.blobs[text_store.segment_path("abc", i)])) <= 512
+               for i in range(manifest["segments"]))
+    assert text_store.load_chunks(bucket, "abc", manifest) == chunks
+
+
+def test_opening_chunks_only_fetch_their_segments(bucket):
+    chunks = sample_chunks()
+    manifest = text_store.save_text(bucket, "abc", chunks)
+
+    opening = text_store.load_chunks(bucket, "abc", manifest, max_tokens=150)
+    assert opening == chunks[:len(opening)] and 0 < len(opening) < len(chunks)
+    segments = [path for path in bucket.downloads if "/text/" in path]
+    assert len(segments) < manifest["segments"]
+
+    # Cached after the first read
+    bucket.downloads.clear()
+    text_store.load_chunks(bucket, "abc", manifest, max_tokens=150)
+    assert bucket.downloads == []
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Offline tests for upload job leases (upload_jobs.py).
+
+Run: python -m pytest -q test_upload_jobs.py
+"""
+
+import threading
+import time
+
+import upload_jobs
+
+
+class RecordingDb:
+    """Records document updates made through db.collection(...).document(...)."""
+
+    def __init__(self):
+        self.updates = []
+
+    def collection(self, name):
+        db = self
+
+        class Collection:
+            def document(self, doc_id):
+                class Document:
+                    def update(self, fields):
+                        db.updates.append((name, doc_id, fields))
+
+                return Document()
+
+        return Collection()
+
+
+def test_lease_is_renewed_until_the_job_stops(monkeypatch):
+    monkeypatch.setattr(upload_jobs, "HEARTBEAT_SECONDS", 0.01)
+    db = RecordingDb()
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=upload_jobs._keep_lease, args=(db, "job1", stop))
+    heartbeat.start()
+    time.sleep(0.1)
+    stop.set()
+    heartbeat.join(timeout=1)
+
+    assert not heartbeat.is_alive()
+    assert len(db.updates) >= 3
+    assert all(doc_id == "job1" and fields["leaseUntil"] > upload_jobs._now()
+               for _, doc_id, fields in db.updates)
+
+
+def test_inline_job_is_not_resumed_by_another_worker(db, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(upload_jobs, "submit_job", lambda db, job_id, process_fn: submitted.append(job_id))
+    inline = upload_jobs.create_job(db, "u1", "bio.pdf", "bio.pdf", "content/a/source.pdf", "a", run_here=True)
+    queued = upload_jobs.create_job(db, "u1", "chem.pdf", "chem.pdf", "content/b/source.pdf", "b")
+
+    # Another process starts serving before the inline request got to run_job
+    assert upload_jobs.resume_pending_jobs(db, None) == 1
+    assert submitted == [queued]
+
+    job = upload_jobs.run_job(db, inline, lambda job, progress: {"pdf_name": job["pdfName"]}, claimed=True)
+    assert job["status"] == "done" and job["result"] == {"pdf_name": "bio.pdf"}
+    assert job["leaseUntil"] is None
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the chunk embedding index (vector_index.py).
+Uses the deterministic local embedder and the conftest.py bucket, so no
+OpenAI or Firebase access is needed.
+
+Run: python -m pytest -q test_vector_index.py
+"""
+
+import numpy as np
+
+import bm25_index
+import vector_index
+
+CHUNKS = [
+    "Osmosis is the movement of water across a semi-permeable membrane.",
+    "The mitochondria produce energy for the cell through respiration.",
+    "Cells divide by mitosis; meiosis produces gametes for reproduction.",
+    "Photosynthesis converts light energy into chemical energy in plants.",
+]
+
+
+class CountingEmbedder(vector_index.HashingEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def embed(self, texts):
+        self.calls.append(len(texts))
+        return super().embed(texts)
+
+
+def test_local_embedder_is_deterministic():
+    a = vector_index.HashingEmbedder().embed(CHUNKS)
+    b = vector_index.HashingEmbedder().embed(CHUNKS)
+    assert a.shape == (len(CHUNKS), vector_index.LOCAL_DIMENSIONS)
+    assert np.array_equal(a, b)
+
+
+def test_embeddings_are_batched_within_limits():
+    embedder = CountingEmbedder()
+    texts = CHUNKS * 25
+    vectors = vector_index.embed_texts(embedder, texts, batch_size=40)
+    assert embedder.calls == [40, 40, 20]
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-5)
+
+    embedder = CountingEmbedder()
+    vector_index.embed_texts(embedder, texts, batch_size=1000, batch_tokens=200)
+    assert len(embedder.calls) > 1 and sum(embedder.calls) == len(texts)
+
+
+def test_search_finds_matching_chunk():
+    embedder = vector_index.HashingEmbedder()
+    index = vector_index.build_index(embedder, CHUNKS)
+    assert index.vectors.dtype == np.float16
+
+    hits = index.search(embedder.embed(["how does water move through a membrane"])[0], top_k=2)
+    assert hits[0][0] == 0
+    assert len(hits) == 2 and hits[0][1] >= hits[1][1]
+
+
+def test_hybrid_scores_blend_bm25():
+    embedder = vector_index.HashingEmbedder()
+    index = vector_index.build_index(embedder, CHUNKS)
+    query = "chemical energy in plants"
+    cosine = index.scores(embedder.embed([query])[0])
+    bm25 = bm25_index.build_index(CHUNKS).scores(query)
+
+    blended = vector_index.hybrid_scores(cosine, bm25, alpha=0.5)
+    assert vector_index.top_hits(blended, 1)[0][0] == 3
+    assert np.allclose(vector_index.hybrid_scores(cosine, bm25, alpha=1.0), cosine)
+
+
+def test_index_persists_and_reloads(bucket):
+    embedder = CountingEmbedder()
+    path = "content/abc/" + vector_index.INDEX_FILENAME
+
+    built = vector_index.load_index(bucket, "test-persist", path, CHUNKS, embedder)
+    assert path in bucket.blobs and embedder.calls == [len(CHUNKS)]
+
+    loaded = vector_index.loads(bucket.blobs[path])
+    assert loaded.model == embedder.model
+    assert np.array_equal(loaded.vectors, built.vectors)
+
+    # Served from the process cache, no new embedding calls
+    vector_index.load_index(bucket, "test-persist", path, CHUNKS, embedder)
+    assert embedder.calls == [len(CHUNKS)]
+
+
+def test_index_from_another_model_is_rebuilt(bucket):
+    path = "content/def/" + vector_index.INDEX_FILENAME
+    vector_index.load_index(bucket, "test-model-a", path, CHUNKS, vector_index.HashingEmbedder(64))
+
+    other = vector_index.HashingEmbedder(128)
+    index = vector_index.load_index(bucket, "test-model-b", path, CHUNKS, other)
+    assert index.model == other.model and index.vectors.shape[1] == 128
@@ -0,0 +1,170 @@
+"""
+Compressed, sharded storage for a PDF's chunk text.
+
+Chunks overlap (each repeats the tail of the previous one), so instead of
+storing every chunk string the text is kept once as a stream that every
+chunk is a span of. The UTF-8 stream is cut into fixed-size segments and
+each segment is zlib-compressed into its own blob next to the content:
+
+    content/{sha256}/text/00000.z ...   segments of TEXT_SEGMENT_KB raw bytes
+    content/{sha256}/chunks.json.z      chunk table: byte offsets + page/heading/tokens
+
+Only a small manifest goes into the Firestore content document, so there is
+no document size ceiling. Readers fetch just the segments covering the
+chunks they need, in parallel, and decompressed segments are kept in
+pdf_cache (they never change for a hash).
+"""
+
+import os
+import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pdf_cache
+from content_store import content_blob_path
+
+STORE_VERSION = 1
+CODEC = 'zlib'
+COMPRESS_LEVEL = 6
+
+# Raw bytes per segment
+TEXT_SEGMENT_BYTES = int(os.environ.get('TEXT_SEGMENT_KB', 256)) * 1024
+# Segments downloaded at once
+TEXT_FETCH_CONCURRENCY = int(os.environ.get('TEXT_FETCH_CONCURRENCY', 8))
+
+CHUNK_TABLE_FILENAME = 'chunks.json.z'
+SEPARATOR = "\n\n"
+
+
+def segment_path(content_hash, index):
+    return content_blob_path(content_hash, f'text/{index:05d}.z')
+
+
+def build_stream(texts):
+    """
+    (stream, spans): one string holding every chunk text, with each chunk's
+    [start, end) UTF-8 byte span. A chunk that opens with the tail of the
+    previous one (its overlap, followed by a paragraph break) reuses that
+    tail instead of repeating it.
+    """
+    parts = []
+    spans = []
+    length = 0  # bytes so far
+    previous = ""
+    for text in texts:
+        shared = _shared_prefix(previous, text)
+        if shared:
+            start = length - len(shared.encode('utf-8'))
+            rest = text[len(shared):]
+        else:
+            if parts:
+                parts.append(SEPARATOR)
+                length += len(SEPARATOR)
+            start = length
+            rest = text
+        parts.append(rest)
+        length += len(rest.encode('utf-8'))
+        spans.append((start, length))
+        previous = text
+    return "".join(parts), spans
+
+
+def _shared_prefix(previous, text):
+    """Longest paragraph-aligned prefix of text that ends previous ("" if none)."""
+    best = ""
+    index = text.find(SEPARATOR)
+    while index > 0:
+        if previous.endswith(text[:index]):
+            best = text[:index]
+        index = text.find(SEPARATOR, index + 1)
+    return best
+
+
+def save_text(bucket, content_hash, chunks):
+    """
+    Store chunk texts as compressed segments plus the chunk table; returns
+    the manifest to save with the content.
+    """
+    stream, spans = build_stream([chunk["text"] for chunk in chunks])
+    data = stream.encode('utf-8')
+    segments = [data[i:i + TEXT_SEGMENT_BYTES] for i in range(0, len(data), TEXT_SEGMENT_BYTES)]
+
+    table = [{**{k: v for k, v in chunk.items() if k != "text"}, "start": start, "end": end}
+             for chunk, (start, end) in zip(chunks, spans)]
+    uploads = [(segment_path(content_hash, i), segment) for i, segment in enumerate(segments)]
+    uploads.append((content_blob_path(content_hash, CHUNK_TABLE_FILENAME), json.dumps(table).encode('utf-8')))
+
+    def upload(item):
+        path, raw = item
+        bucket.blob(path).upload_from_string(zlib.compress(raw, COMPRESS_LEVEL),
+                                             content_type="application/octet-stream")
+
+    with ThreadPoolExecutor(max_workers=TEXT_FETCH_CONCURRENCY) as pool:
+        list(pool.map(upload, uploads))
+
+    return {
+        "version": STORE_VERSION,
+        "codec": CODEC,
+        "segmentBytes": TEXT_SEGMENT_BYTES,
+        "segments": len(segments),
+        "bytes": len(data),
+        "chunkCount": len(chunks)
+    }
+
+
+def _fetch(bucket, path):
+    """Decompressed blob, through pdf_cache."""
+    data = pdf_cache.get(path)
+    if data is None:
+        data = pdf_cache.put(path, None, zlib.decompress(bucket.blob(path).download_as_bytes()))
+    return data
+
+
+def _fetch_all(bucket, paths):
+    if len(paths) <= 1:
+        return [_fetch(bucket, path) for path in paths]
+    with ThreadPoolExecutor(max_workers=min(TEXT_FETCH_CONCURRENCY, len(paths))) as pool:
+        return list(pool.map(lambda path: _fetch(bucket, path), paths))
+
+
+def load_chunk_table(bucket, content_hash):
+    return json.loads(_fetch(bucket, content_blob_path(content_hash, CHUNK_TABLE_FILENAME)))
+
+
+def read_spans(bucket, content_hash, manifest, spans):
+    """Text of each (start, end) byte span, fetching only the segments they cover."""
+    size = manifest["segmentBytes"]
+    needed = sorted({i for start, end in spans if end > start for i in range(start // size, (end - 1) // size + 1)})
+    segments = dict(zip(needed, _fetch_all(bucket, [segment_path(content_hash, i) for i in needed])))
+
+    texts = []
+    for start, end in spans:
+        first, last = start // size, max(start, end - 1) // size
+        data = b"".join(segments.get(i, b"") for i in range(first, last + 1))
+        texts.append(data[start - first * size:end - first * size].decode('utf-8'))
+    return texts
+
+
+def load_chunks(bucket, content_hash, manifest, max_tokens=None):
+    """
+    Stored chunks with their text, as chunker.chunk_pages returns them. With
+    max_tokens, only the opening chunks within that budget (at least one)
+    are returned, so only their segments are downloaded.
+    """
+    table = load_chunk_table(bucket, content_hash)
+    if max_tokens is not None:
+        used = 0
+        for count, chunk in enumerate(table):
+            if count and used + chunk["tokens"] > max_tokens:
+                table = table[:count]
+                break
+            used += chunk["tokens"]
+
+    texts = read_spans(bucket, content_hash, manifest, [(chunk["start"], chunk["end"]) for chunk in table])
+    return [{**{k: v for k, v in chunk.items() if k not in ("start", "end")}, "text": text}
+            for chunk, text in zip(table, texts)]
+
+
+def read_text(bucket, content_hash, manifest):
+    """The whole stored stream (every chunk's text, overlaps once)."""
+    return read_spans(bucket, content_hash, manifest, [(0, manifest["bytes"])])[0]
@@ -0,0 +1,210 @@
+"""
+Background upload jobs for /api/upload-pdf.
+
+The request handler stores the raw PDF in Storage, creates a job record in
+Firestore (uploadJobs/{job_id}) and hands the job to a small thread pool.
+Each ingest stage is recorded on the job as it completes so clients can poll
+/api/upload-status/<job_id>. Jobs hold a lease while running, renewed by a
+heartbeat thread so long stages keep it. When a server starts serving, any
+queued job, or running job whose lease has expired (process restart), is
+picked up again; a short Firestore lock makes sure only one of the starting
+processes does the scan.
+"""
+
+import os
+import uuid
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+JOBS_COLLECTION = 'uploadJobs'
+LOCKS_COLLECTION = 'uploadJobLocks'
+
+# Ordered ingest stages reported to the client
+STAGES = ["store", "extract", "chunk", "index", "publish", "save"]
+
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 2))
+# A running job that hasn't reported progress for this long is considered dead
+LEASE_SECONDS = int(os.environ.get('UPLOAD_JOB_LEASE_SECONDS', 600))
+# How often a running job renews its lease
+HEARTBEAT_SECONDS = max(1, LEASE_SECONDS // 3)
+# Processes starting within this window share one resume scan
+RESUME_LOCK_SECONDS = 60
+
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload-job")
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _job_ref(db, job_id):
+    return db.collection(JOBS_COLLECTION).document(job_id)
+
+
+def create_job(db, user_id, pdf_name, filename, storage_path, content_hash, run_here=False):
+    """
+    Create a queued job whose raw bytes are already at storage_path. With
+    run_here the job is created running, under a lease held by the caller,
+    so no resume scan can take it before the caller's run_job(claimed=True).
+    """
+    job_id = uuid.uuid4().hex
+    _job_ref(db, job_id).set({
+        "userId": user_id,
+        "pdfName": pdf_name,
+        "filename": filename,
+        "storagePath": storage_path,
+        "contentHash": content_hash,
+        "status": "running" if run_here else "queued",
+        "stages": {stage: "pending" for stage in STAGES} | {"store": "done"},
+        "error": None,
+        "result": None,
+        "leaseUntil": _now() + timedelta(seconds=LEASE_SECONDS) if run_here else None,
+        "createdAt": firestore.SERVER_TIMESTAMP,
+        "updatedAt": firestore.SERVER_TIMESTAMP
+    })
+    return job_id
+
+
+def get_job(db, job_id):
+    """Return the job dict (with id and progress) or None."""
+    doc = _job_ref(db, job_id).get()
+    if not doc.exists:
+        return None
+    job = doc.to_dict()
+    job["id"] = job_id
+    done = sum(1 for stage in STAGES if job.get("stages", {}).get(stage) == "done")
+    job["progress"] = round(done / len(STAGES), 2)
+    return job
+
+
+def _update_job(db, job_id, fields):
+    fields["updatedAt"] = firestore.SERVER_TIMESTAMP
+    _job_ref(db, job_id).update(fields)
+
+
+def mark_stage(db, job_id, stage):
+    """Mark `stage` as running (and every earlier stage done); extend the lease."""
+    fields = {f"stages.{s}": "done" for s in STAGES[:STAGES.index(stage)]}
+    fields[f"stages.{stage}"] = "running"
+    fields["leaseUntil"] = _now() + timedelta(seconds=LEASE_SECONDS)
+    _update_job(db, job_id, fields)
+
+
+def _claim_job(db, job_id):
+    """Atomically take the lease on a job. Returns the job dict or None."""
+    ref = _job_ref(db, job_id)
+
+    @firestore.transactional
+    def claim(transaction):
+        snapshot = ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        job = snapshot.to_dict()
+        if job.get("status") in ("done", "failed"):
+            return None
+        lease = job.get("leaseUntil")
+        if job.get("status") == "running" and lease and lease > _now():
+            return None
+        transaction.update(ref, {
+            "status": "running",
+            "leaseUntil": _now() + timedelta(seconds=LEASE_SECONDS),
+            "updatedAt": firestore.SERVER_TIMESTAMP
+        })
+        job["id"] = job_id
+        return job
+
+    return claim(db.transaction())
+
+
+def _keep_lease(db, job_id, stop):
+    """Extend a running job's lease every HEARTBEAT_SECONDS until stop is set."""
+    while not stop.wait(HEARTBEAT_SECONDS):
+        try:
+            _job_ref(db, job_id).update({"leaseUntil": _now() + timedelta(seconds=LEASE_SECONDS)})
+        except Exception as e:
+            print(f"⚠️ Could not extend lease of upload job {job_id} ({e})")
+
+
+def run_job(db, job_id, process_fn, claimed=False):
+    """
+    Run a job in the current thread. claimed=True means the caller already
+    holds the lease (create_job(run_here=True)).
+
+    process_fn(job, progress) does the work; it calls progress(stage) when a
+    stage starts and returns a JSON-able result dict when every stage is done.
+    """
+    job = get_job(db, job_id) if claimed else _claim_job(db, job_id)
+    if job is None:
+        return get_job(db, job_id)
+
+    def progress(stage):
+        mark_stage(db, job_id, stage)
+
+    stop = threading.Event()
+    threading.Thread(target=_keep_lease, args=(db, job_id, stop), daemon=True,
+                     name=f"upload-lease-{job_id[:8]}").start()
+    try:
+        result = process_fn(job, progress)
+        _update_job(db, job_id, {
+            "status": "done",
+            "stages": {stage: "done" for stage in STAGES},
+            "result": result,
+            "leaseUntil": None
+        })
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        _update_job(db, job_id, {
+            "status": "failed",
+            "error": str(e),
+            # Out of memory budget - the client may simply retry later
+            "retryable": isinstance(e, MemoryError),
+            "leaseUntil": None
+        })
+    finally:
+        stop.set()
+
+    return get_job(db, job_id)
+
+
+def submit_job(db, job_id, process_fn):
+    """Queue a job on the background worker pool."""
+    return _executor.submit(run_job, db, job_id, process_fn)
+
+
+def _claim_resume(db):
+    """True if this process may scan for unfinished jobs (no other did within RESUME_LOCK_SECONDS)."""
+    ref = db.collection(LOCKS_COLLECTION).document('resume')
+
+    @firestore.transactional
+    def claim(transaction):
+        snapshot = ref.get(transaction=transaction)
+        until = snapshot.to_dict().get("leaseUntil") if snapshot.exists else None
+        if until and until > _now():
+            return False
+        transaction.set(ref, {"leaseUntil": _now() + timedelta(seconds=RESUME_LOCK_SECONDS)})
+        return True
+
+    return claim(db.transaction())
+
+
+def resume_pending_jobs(db, process_fn):
+    """Re-queue jobs left unfinished by a previous process (once across starting processes)."""
+    if not _claim_resume(db):
+        return 0
+    query = db.collection(JOBS_COLLECTION).where(filter=FieldFilter("status", "in", ["queued", "running"]))
+    resumed = 0
+    for doc in query.stream():
+        job = doc.to_dict()
+        lease = job.get("leaseUntil")
+        if job.get("status") == "running" and lease and lease > _now():
+            continue  # still owned by a live worker
+        submit_job(db, doc.id, process_fn)
+        resumed += 1
+    if resumed:
+        print(f"🔁 Resumed {resumed} unfinished upload job(s)")
+    return resumed
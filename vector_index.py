@@ -0,0 +1,203 @@
+"""
+Embedding index over a PDF's stored chunks for semantic chat retrieval.
+
+Chunk embeddings are computed at upload in as few batched embedding calls as
+possible and saved as a packed float16 matrix next to the content
+(content/{sha256}/embeddings.npz). Rows are L2-normalised, so cosine
+similarity is a single matmul against the query vector. Search results can
+be blended with BM25 scores (hybrid_scores) so exact term matches still
+count.
+
+Embedders (set EMBEDDING_BACKEND):
+    openai  OpenAI embeddings API (EMBEDDING_MODEL)
+    local   deterministic feature-hashing embedder, no network; used by the
+            tests and for offline development
+"""
+
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from google.api_core.exceptions import NotFound
+
+from bm25_index import tokenize
+from chunker import estimate_tokens
+
+INDEX_VERSION = 1
+INDEX_FILENAME = 'embeddings.npz'
+
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'openai')
+EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'text-embedding-3-small')
+# Per embedding call limits
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', 256))
+EMBED_BATCH_TOKENS = int(os.environ.get('EMBED_BATCH_TOKENS', 250000))
+# Weight of the cosine score in hybrid ranking (the rest is BM25)
+HYBRID_ALPHA = float(os.environ.get('HYBRID_ALPHA', 0.6))
+LOCAL_DIMENSIONS = 256
+
+# Loaded matrices kept per process
+INDEX_CACHE_SIZE = 16
+
+
+class OpenAIEmbedder:
+    def __init__(self, client, model=EMBEDDING_MODEL):
+        self.client = client
+        self.model = model
+
+    def embed(self, texts):
+        response = self.client.embeddings.create(model=self.model, input=texts)
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+
+class HashingEmbedder:
+    """Deterministic bag-of-stems embedding via signed feature hashing."""
+
+    def __init__(self, dimensions=LOCAL_DIMENSIONS):
+        self.dimensions = dimensions
+        self.model = f"local-hash-{dimensions}"
+
+    def _slot(self, term):
+        digest = hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest()
+        value = int.from_bytes(digest, 'little')
+        return value % self.dimensions, 1.0 if value >> 63 else -1.0
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for term in tokenize(text):
+                slot, sign = self._slot(term)
+                vectors[row, slot] += sign
+        return vectors
+
+
+def make_embedder(client, backend=EMBEDDING_BACKEND):
+    if backend == 'local':
+        return HashingEmbedder()
+    return OpenAIEmbedder(client)
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _batches(texts, max_size, max_tokens):
+    """Consecutive [start, end) ranges within the per-call input and token limits."""
+    start, tokens = 0, 0
+    for i, text in enumerate(texts):
+        cost = estimate_tokens(text)
+        if i > start and (i - start >= max_size or tokens + cost > max_tokens):
+            yield start, i
+            start, tokens = i, 0
+        tokens += cost
+    if start < len(texts):
+        yield start, len(texts)
+
+
+def embed_texts(embedder, texts, batch_size=EMBED_BATCH_SIZE, batch_tokens=EMBED_BATCH_TOKENS):
+    """Embed texts in as few calls as the limits allow; returns normalised float32 rows."""
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    parts = [embedder.embed(texts[start:end]) for start, end in _batches(texts, batch_size, batch_tokens)]
+    return normalize(np.vstack(parts))
+
+
+class VectorIndex:
+    """Normalised chunk embeddings stored as float16."""
+
+    def __init__(self, vectors, model):
+        self.vectors = vectors.astype(np.float16)
+        self.model = model
+
+    def scores(self, query_vector):
+        """Cosine similarity of every chunk to a query vector."""
+        if not len(self.vectors):
+            return np.zeros(0, dtype=np.float32)
+        query = normalize(np.asarray(query_vector, dtype=np.float32))
+        return self.vectors.astype(np.float32) @ query
+
+    def search(self, query_vector, top_k=3):
+        """[(chunk index, score)] best first."""
+        return top_hits(self.scores(query_vector), top_k)
+
+
+def top_hits(scores, top_k):
+    if not len(scores):
+        return []
+    top_k = min(top_k, len(scores))
+    candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    best = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return [(int(i), float(scores[i])) for i in best]
+
+
+def hybrid_scores(cosine, bm25, alpha=HYBRID_ALPHA):
+    """Blend cosine similarity with BM25 scores scaled to [0, 1]."""
+    peak = float(bm25.max()) if len(bm25) else 0.0
+    lexical = bm25 / peak if peak > 0 else np.zeros_like(cosine)
+    return alpha * cosine + (1 - alpha) * lexical
+
+
+def build_index(embedder, texts):
+    return VectorIndex(embed_texts(embedder, texts), embedder.model)
+
+
+def dumps(index):
+    buf = io.BytesIO()
+    np.savez(buf, version=np.array([INDEX_VERSION]), model=np.array([index.model]), vectors=index.vectors)
+    return buf.getvalue()
+
+
+def loads(data):
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        if int(npz["version"][0]) != INDEX_VERSION:
+            raise ValueError("Unsupported vector index version")
+        return VectorIndex(npz["vectors"], str(npz["model"][0]))
+
+
+def save_index(bucket, storage_path, index):
+    bucket.blob(storage_path).upload_from_string(dumps(index), content_type="application/octet-stream")
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _remember(key, index):
+    with _cache_lock:
+        _cache[key] = index
+        _cache.move_to_end(key)
+        while len(_cache) > INDEX_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
+
+
+def load_index(bucket, key, storage_path, texts, embedder):
+    """
+    Return the embedding index for a document: from the process cache, else
+    from storage_path, else embedded from `texts` (and saved when a
+    storage_path is given). An index built with a different embedding model
+    is rebuilt, since its vectors aren't comparable to the query's.
+    """
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and cached.model == embedder.model:
+            _cache.move_to_end(key)
+            return cached
+
+    if storage_path:
+        try:
+            index = loads(bucket.blob(storage_path).download_as_bytes())
+            if index.model == embedder.model:
+                return _remember(key, index)
+        except NotFound:
+            pass
+        except Exception as e:
+            print(f"⚠️ Could not load vector index {storage_path} ({e}), rebuilding")
+
+    index = build_index(embedder, texts)
+    if storage_path:
+        save_index(bucket, storage_path, index)
+    return _remember(key, index)